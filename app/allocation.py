@@ -0,0 +1,118 @@
+import bisect
+from collections import deque
+from dataclasses import dataclass, field
+from itertools import groupby
+
+from app import services
+from app.database import get_connection
+
+
+@dataclass
+class Assignment:
+    student_id: int
+    full_name: str
+    study_group: str | None
+    room_id: int
+    building: str
+    floor: int
+    room_number: str
+
+
+@dataclass
+class AllocationPlan:
+    assignments: list[Assignment] = field(default_factory=list)
+    unassigned: list[int] = field(default_factory=list)
+
+    def pairs(self) -> list[tuple[int, int]]:
+        return [(a.student_id, a.room_id) for a in self.assignments]
+
+
+def pending_students(faculty: str | None = None) -> list:
+    sql = """
+        SELECT st.id, st.full_name, st.faculty, st.study_group
+        FROM students st
+        WHERE NOT EXISTS (SELECT 1 FROM stays s WHERE s.student_id = st.id AND s.checkout_date IS NULL)
+    """
+    params: tuple = ()
+    if faculty:
+        sql += " AND st.faculty = ?"
+        params = (faculty,)
+    return get_connection().execute(sql + " ORDER BY st.faculty, st.study_group, st.full_name", params).fetchall()
+
+
+def free_rooms(building: str | None = None) -> list:
+    sql = """
+        SELECT id, building, floor, room_number, occupied, total_beds - occupied AS free
+        FROM rooms
+        WHERE status != 'repair' AND occupied < total_beds
+    """
+    params: tuple = ()
+    if building:
+        sql += " AND building = ?"
+        params = (building,)
+    return get_connection().execute(sql + " ORDER BY building, floor, room_number", params).fetchall()
+
+
+class _Floor:
+    def __init__(self, key: tuple, rooms: list):
+        self.key = key
+        # Partially occupied rooms first so that existing rooms are packed before empty ones.
+        self.rooms = deque(sorted(rooms, key=lambda r: (r["occupied"] == 0, r["free"])))
+        self.free_beds = {r["id"]: r["free"] for r in rooms}
+        self.free = sum(self.free_beds.values())
+
+    def take(self, count: int) -> list:
+        taken = []
+        while count and self.rooms:
+            room = self.rooms[0]
+            beds = min(count, self.free_beds[room["id"]])
+            taken.extend([room] * beds)
+            self.free_beds[room["id"]] -= beds
+            self.free -= beds
+            count -= beds
+            if not self.free_beds[room["id"]]:
+                self.rooms.popleft()
+        return taken
+
+
+def plan_allocation(students: list, rooms: list) -> AllocationPlan:
+    floors = {
+        key: _Floor(key, list(group))
+        for key, group in groupby(rooms, key=lambda r: (r["building"], r["floor"]))
+    }
+    # (free beds, floor key), kept sorted for best-fit lookups.
+    by_free = sorted((floor.free, floor.key) for floor in floors.values())
+
+    groups = [list(g) for _, g in groupby(students, key=lambda s: (s["faculty"], s["study_group"]))]
+    groups.sort(key=len, reverse=True)
+
+    plan = AllocationPlan()
+    for group in groups:
+        queue = deque(group)
+        while queue and by_free:
+            # Smallest floor that fits the whole group, otherwise the emptiest one.
+            index = bisect.bisect_left(by_free, (len(queue),))
+            if index == len(by_free):
+                index -= 1
+            _, key = by_free.pop(index)
+            floor = floors[key]
+            for room in floor.take(len(queue)):
+                student = queue.popleft()
+                plan.assignments.append(
+                    Assignment(
+                        student["id"], student["full_name"], student["study_group"],
+                        room["id"], room["building"], room["floor"], room["room_number"],
+                    )
+                )
+            if floor.free:
+                bisect.insort(by_free, (floor.free, key))
+        plan.unassigned.extend(s["id"] for s in queue)
+    return plan
+
+
+def preview(faculty: str | None = None, building: str | None = None) -> AllocationPlan:
+    return plan_allocation(pending_students(faculty), free_rooms(building))
+
+
+def commit(plan: AllocationPlan, checkin_date: str, actor=None) -> int:
+    return services.check_in_many(plan.pairs(), checkin_date, actor)
@@ -0,0 +1,408 @@
+import base64
+import hashlib
+import json
+import logging
+import re
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+from urllib.parse import parse_qs, urlsplit
+
+from app import auth, cache, finance, services, sync
+
+DEFAULT_READERS = 4
+DEFAULT_PAGE = 100
+MAX_PAGE = 1000
+MAX_BODY = 1 << 20
+MAX_BATCH = 64 << 20
+REQUEST_TIMEOUT = 30
+
+log = logging.getLogger("skfu.api")
+
+
+class ApiError(Exception):
+    def __init__(self, status: HTTPStatus, message: str, headers: dict | None = None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+@dataclass
+class Request:
+    user: auth.AuthUser | None
+    params: dict[str, str]
+    query: dict[str, str]
+    body: dict
+
+
+@dataclass
+class Route:
+    method: str
+    pattern: re.Pattern
+    handler: Callable[[Request], object]
+    permission: str | None
+    writes: bool = False
+
+
+def _rows(rows: list) -> list[dict]:
+    return [{key: row[key] for key in row.keys()} for row in rows]
+
+
+def encode_cursor(key: tuple) -> str:
+    return base64.urlsafe_b64encode(json.dumps(list(key), ensure_ascii=False).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str | None) -> tuple | None:
+    if not cursor:
+        return None
+    try:
+        return tuple(json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))))
+    except (ValueError, TypeError):
+        raise ApiError(HTTPStatus.BAD_REQUEST, "Некорректный курсор after")
+
+
+def _limit(req: Request) -> int:
+    try:
+        limit = int(req.query.get("limit", DEFAULT_PAGE))
+    except ValueError:
+        raise ApiError(HTTPStatus.BAD_REQUEST, "limit должен быть числом")
+    return max(1, min(limit, MAX_PAGE))
+
+
+def _page(rows: list, limit: int, key: Callable) -> dict:
+    return {"items": _rows(rows), "next": encode_cursor(key(rows[-1])) if len(rows) == limit else None}
+
+
+def _field(body: dict, name: str, kind=str, required: bool = True):
+    value = body.get(name)
+    if value is None:
+        if required:
+            raise ApiError(HTTPStatus.BAD_REQUEST, f"Не указано поле {name}")
+        return None
+    try:
+        return kind(value)
+    except (TypeError, ValueError):
+        raise ApiError(HTTPStatus.BAD_REQUEST, f"Некорректное значение поля {name}")
+
+
+def list_students(req: Request):
+    limit = _limit(req)
+    rows = services.list_students(req.query.get("q", ""), limit=limit, after=decode_cursor(req.query.get("after")))
+    return _page(rows, limit, services.student_page_key)
+
+
+def get_student(req: Request):
+    row = services.get_student(int(req.params["id"]))
+    if row is None:
+        raise ApiError(HTTPStatus.NOT_FOUND, "Студент не найден")
+    return _rows([row])[0]
+
+
+def create_student(req: Request):
+    _field(req.body, "full_name")
+    return {"id": services.add_student(req.body, req.user)}
+
+
+def student_statement(req: Request):
+    get_student(req)
+    student_id, as_of = int(req.params["id"]), req.query.get("as_of")
+    return {
+        "items": [
+            {"date": r["op_date"], "kind": r["kind"], "amount": finance.rubles(r["amount_kop"]),
+             "balance": finance.rubles(r["balance_kop"]), "note": r["note"]}
+            for r in finance.statement(student_id, as_of)
+        ],
+        "allocations": [
+            {"period": r["period"], "due": finance.rubles(r["due_kop"]), "paid": finance.rubles(r["paid_kop"]),
+             "open": finance.rubles(r["open_kop"]), "age_days": r["age_days"]}
+            for r in finance.allocations(student_id, as_of)
+        ],
+    }
+
+
+def list_rooms(req: Request):
+    limit = _limit(req)
+    rows = services.list_rooms(limit=limit, after=decode_cursor(req.query.get("after")))
+    return _page(rows, limit, lambda r: (r["building"], r["floor"], r["room_number"], r["id"]))
+
+
+def create_room(req: Request):
+    b = req.body
+    room_id = services.add_room(
+        _field(b, "building"), _field(b, "floor", int), _field(b, "room_number"), _field(b, "total_beds", int),
+        _field(b, "status", required=False) or "free", req.user,
+    )
+    return {"id": room_id}
+
+
+def list_stays(req: Request):
+    limit = _limit(req)
+    rows = services.current_stays(limit=limit, after=decode_cursor(req.query.get("after")))
+    return _page(rows, limit, lambda r: (r["checkin_date"], r["id"]))
+
+
+def check_in(req: Request):
+    b = req.body
+    stay_id = services.check_in(_field(b, "student_id", int), _field(b, "room_id", int), _field(b, "checkin_date"), req.user)
+    return {"id": stay_id}
+
+
+def check_out(req: Request):
+    b = req.body
+    services.check_out(int(req.params["id"]), _field(b, "checkout_date"), _field(b, "reason", required=False) or "", req.user)
+    return {"id": int(req.params["id"])}
+
+
+def create_charge(req: Request):
+    b = req.body
+    charge_id = services.add_charge(
+        _field(b, "student_id", int), _field(b, "period"), _field(b, "amount", float),
+        _field(b, "benefit_discount", float, required=False) or 0, req.user,
+    )
+    return {"id": charge_id}
+
+
+def create_payment(req: Request):
+    b = req.body
+    payment_id = services.add_payment(
+        _field(b, "student_id", int), _field(b, "payment_date"), _field(b, "amount", float),
+        _field(b, "method", required=False) or "", req.user,
+    )
+    return {"id": payment_id}
+
+
+def debtors(req: Request):
+    limit = _limit(req)
+    try:
+        min_debt = float(req.query.get("min_debt", 0))
+    except ValueError:
+        raise ApiError(HTTPStatus.BAD_REQUEST, "min_debt должен быть числом")
+    rows = services.debtors_report(min_debt, limit=limit, after=decode_cursor(req.query.get("after")))
+    return _page(rows, limit, lambda r: (r["full_name"], r["id"]))
+
+
+def aging(req: Request):
+    try:
+        rows = finance.aging(req.query.get("as_of"), float(req.query.get("min_debt", 0)))
+    except ValueError:
+        raise ApiError(HTTPStatus.BAD_REQUEST, "Некорректные as_of или min_debt")
+    totals = finance.aging_totals(rows)
+    limit, after = _limit(req), decode_cursor(req.query.get("after"))
+    if after is not None:
+        rows = [r for r in rows if (r["full_name"], r["student_id"]) > after]
+    items = [
+        {"student_id": r["student_id"], "full_name": r["full_name"], "study_group": r["study_group"],
+         "debt": finance.rubles(r["debt_kop"]),
+         "buckets": [finance.rubles(r[f"bucket{i}_kop"]) for i in range(len(finance.AGING_BUCKETS))]}
+        for r in rows[:limit]
+    ]
+    return {
+        "buckets": list(finance.AGING_LABELS),
+        "totals": {"students": totals["students"], "debt": finance.rubles(totals["debt_kop"]),
+                   "buckets": [finance.rubles(kop) for kop in totals["buckets_kop"]]},
+        "items": items,
+        "next": encode_cursor((rows[limit - 1]["full_name"], rows[limit - 1]["student_id"])) if len(rows) > limit else None,
+    }
+
+
+def sync_checkpoint(req: Request):
+    peer = req.query.get("peer")
+    if not peer:
+        raise ApiError(HTTPStatus.BAD_REQUEST, "Не указан peer")
+    return {"node": sync.node_id(), "received": sync.received_seq(peer)}
+
+
+def sync_changes(req: Request):
+    try:
+        since = int(req.query.get("since", 0))
+    except ValueError:
+        raise ApiError(HTTPStatus.BAD_REQUEST, "since должен быть числом")
+    return sync.export_changes(since, peer=req.query.get("peer"))[1]
+
+
+def sync_apply(req: Request):
+    if "batch" not in req.body:
+        raise ApiError(HTTPStatus.UNSUPPORTED_MEDIA_TYPE, "Пакет изменений передается как application/gzip")
+    try:
+        return asdict(sync.apply_changes(req.body["batch"], req.user))
+    except sync.SyncError as e:
+        raise ApiError(HTTPStatus.CONFLICT, str(e))
+
+
+def _route(method: str, path: str, handler, permission: str | None, writes: bool = False) -> Route:
+    pattern = re.compile("^" + re.sub(r"\{(\w+)\}", r"(?P<\1>\\d+)", path) + "$")
+    return Route(method, pattern, handler, permission, writes)
+
+
+ROUTES = (
+    _route("GET", "/api/students", list_students, "students"),
+    _route("POST", "/api/students", create_student, "students", writes=True),
+    _route("GET", "/api/students/{id}", get_student, "students"),
+    _route("GET", "/api/students/{id}/statement", student_statement, "finance"),
+    _route("GET", "/api/rooms", list_rooms, "rooms"),
+    _route("POST", "/api/rooms", create_room, "rooms", writes=True),
+    _route("GET", "/api/stays", list_stays, "stays"),
+    _route("POST", "/api/stays", check_in, "stays", writes=True),
+    _route("POST", "/api/stays/{id}/checkout", check_out, "stays", writes=True),
+    _route("POST", "/api/charges", create_charge, "finance", writes=True),
+    _route("POST", "/api/payments", create_payment, "finance", writes=True),
+    _route("GET", "/api/reports/debtors", debtors, "reports"),
+    _route("GET", "/api/reports/aging", aging, "finance"),
+    _route("GET", "/api/sync/checkpoint", sync_checkpoint, "admin"),
+    _route("GET", "/api/sync/changes", sync_changes, "admin"),
+    _route("POST", "/api/sync/changes", sync_apply, "admin", writes=True),
+)
+
+
+class ApiServer(ThreadingHTTPServer):
+    """HTTP front end: reads run on a pool of threads, each with its own
+    connection, and all writes go through one writer thread, matching
+    SQLite's single-writer model under WAL without lock contention.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], readers: int = DEFAULT_READERS):
+        super().__init__(address, ApiHandler)
+        self.readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix="api-reader")
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="api-writer")
+
+    def call(self, writes: bool, fn: Callable, *args):
+        return (self.writer if writes else self.readers).submit(fn, *args).result(REQUEST_TIMEOUT)
+
+    def server_close(self) -> None:
+        super().server_close()
+        self.readers.shutdown(wait=True)
+        self.writer.shutdown(wait=True)
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; with Nagle on, keep-alive clients wait for a delayed ACK.
+    disable_nagle_algorithm = True
+    server: ApiServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def _dispatch(self, method: str) -> None:
+        try:
+            status, payload, headers = self._handle(method)
+        except ApiError as e:
+            status, payload, headers = e.status, {"error": str(e)}, e.headers
+        except auth.LoginThrottled as e:
+            status, payload = HTTPStatus.TOO_MANY_REQUESTS, {"error": str(e)}
+            headers = {"Retry-After": str(int(e.retry_after) + 1)}
+        except ValueError as e:
+            # services report invalid input (including OccupancyError) as ValueError.
+            status, payload, headers = HTTPStatus.BAD_REQUEST, {"error": str(e)}, {}
+        except sqlite3.IntegrityError as e:
+            # The constraint text names tables and columns, so the client gets a fixed message.
+            if e.sqlite_errorname in ("SQLITE_CONSTRAINT_UNIQUE", "SQLITE_CONSTRAINT_PRIMARYKEY"):
+                status, payload = HTTPStatus.CONFLICT, {"error": "Такая запись уже существует"}
+            else:
+                status, payload = HTTPStatus.BAD_REQUEST, {"error": "Данные нарушают ограничения базы"}
+            headers = {}
+        except Exception:
+            log.exception("%s %s", method, self.path)
+            status, payload, headers = HTTPStatus.INTERNAL_SERVER_ERROR, {"error": "Внутренняя ошибка сервера"}, {}
+        self._send(status, payload, headers)
+
+    def _handle(self, method: str) -> tuple[HTTPStatus, object, dict]:
+        url = urlsplit(self.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        body = self._body() if method == "POST" else {}
+
+        if method == "POST" and url.path == "/api/login":
+            # A successful login may rehash the password, which is a write.
+            user = self.server.call(
+                True, auth.authenticate, str(body.get("username", "")), str(body.get("password", "")),
+                self.client_address[0],
+            )
+            if user is None:
+                raise ApiError(HTTPStatus.UNAUTHORIZED, "Неверный логин или пароль")
+            return HTTPStatus.OK, {"token": auth.open_session(user), "role": user.role}, {}
+        if method == "POST" and url.path == "/api/logout":
+            auth.close_session(self._token())
+            return HTTPStatus.OK, {}, {}
+
+        for route in ROUTES:
+            match = route.pattern.match(url.path)
+            if match and route.method == method:
+                break
+        else:
+            raise ApiError(HTTPStatus.NOT_FOUND, "Нет такого ресурса")
+
+        user = auth.session_user(self._token())
+        if user is None:
+            raise ApiError(HTTPStatus.UNAUTHORIZED, "Требуется вход", {"WWW-Authenticate": "Bearer"})
+        if route.permission and not user.can(route.permission):
+            raise ApiError(HTTPStatus.FORBIDDEN, "Недостаточно прав")
+
+        result = self.server.call(route.writes, route.handler, Request(user, match.groupdict(), query, body))
+        status = HTTPStatus.CREATED if route.writes and method == "POST" and not match.groupdict() else HTTPStatus.OK
+        return status, result, {}
+
+    def _token(self) -> str:
+        header = self.headers.get("Authorization", "")
+        return header[7:].strip() if header.startswith("Bearer ") else ""
+
+    def _body(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        batch = self.headers.get("Content-Type") == "application/gzip"
+        if length > (MAX_BATCH if batch else MAX_BODY):
+            # The body is left unread, so the connection cannot carry another request.
+            self.close_connection = True
+            raise ApiError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "Слишком большой пакет изменений" if batch else "Слишком большой запрос")
+        if batch:
+            # Sync batches are compressed JSON lines, passed through as they are.
+            return {"batch": self.rfile.read(length)}
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            raise ApiError(HTTPStatus.BAD_REQUEST, "Тело запроса должно быть JSON")
+        if not isinstance(body, dict):
+            raise ApiError(HTTPStatus.BAD_REQUEST, "Тело запроса должно быть JSON-объектом")
+        return body
+
+    def _send(self, status: HTTPStatus, payload, headers: dict) -> None:
+        if isinstance(payload, bytes):
+            data, content_type = payload, "application/gzip"
+        else:
+            data, content_type = json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8"), "application/json; charset=utf-8"
+        if self.command == "GET" and status == HTTPStatus.OK:
+            etag = '"' + hashlib.blake2b(data, digest_size=16).hexdigest() + '"'
+            headers = {**headers, "ETag": etag, "Cache-Control": "private, no-cache"}
+            if etag in (tag.strip() for tag in self.headers.get("If-None-Match", "").split(",")):
+                status, data = HTTPStatus.NOT_MODIFIED, b""
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if self.close_connection:
+            self.send_header("Connection", "close")
+        if status != HTTPStatus.NOT_MODIFIED:
+            self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if data:
+            self.wfile.write(data)
+
+
+def serve(host: str = "127.0.0.1", port: int = 8080, readers: int = DEFAULT_READERS) -> None:
+    # Workstations write to the same database without going through this process.
+    cache.set_max_age(cache.SHARED_MAX_AGE)
+    with ApiServer((host, port), readers) as server:
+        print(f"API: http://{host}:{server.server_address[1]}/api (читателей: {readers})")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,178 @@
+import atexit
+import json
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+
+from app import database
+from app.database import get_connection, transaction
+
+FLUSH_INTERVAL = 0.5
+BATCH_SIZE = 500
+RETRY_MAX_DELAY = 30.0
+
+_queue: queue.Queue = queue.Queue()
+_known_partitions: set[tuple[str, str]] = set()
+_writer: threading.Thread | None = None
+_writer_lock = threading.Lock()
+_idle = threading.Condition()
+_pending = 0
+last_error: Exception | None = None
+
+
+def partition_name(moment: datetime) -> str:
+    return f"audit_{moment.year:04d}_{moment.month:02d}"
+
+
+def _ensure_partition(conn, name: str) -> None:
+    if (str(database.DB_PATH), name) in _known_partitions:
+        return
+    conn.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {name} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_at TEXT NOT NULL,
+            user_id INTEGER,
+            username TEXT,
+            action TEXT NOT NULL,
+            entity TEXT NOT NULL,
+            entity_id INTEGER,
+            student_id INTEGER,
+            before_json TEXT,
+            after_json TEXT
+        )
+        """
+    )
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{name}_student ON {name}(student_id, id) WHERE student_id IS NOT NULL")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{name}_user ON {name}(user_id, id)")
+
+
+def forget_partitions() -> None:
+    """Drop the cache of created partitions, e.g. after the database file was restored."""
+    _known_partitions.clear()
+
+
+def record(actor, action: str, entity: str, entity_id: int | None = None, student_id: int | None = None,
+           before: dict | None = None, after: dict | None = None) -> None:
+    global _pending
+    now = datetime.now(timezone.utc)
+    row = (
+        now.isoformat(timespec="seconds"),
+        getattr(actor, "id", None),
+        getattr(actor, "username", None),
+        action,
+        entity,
+        entity_id,
+        student_id,
+        json.dumps(before, ensure_ascii=False, default=str) if before is not None else None,
+        json.dumps(after, ensure_ascii=False, default=str) if after is not None else None,
+    )
+    with _idle:
+        _pending += 1
+    _queue.put((partition_name(now), row))
+    _start_writer()
+
+
+def _start_writer() -> None:
+    global _writer
+    if _writer is not None and _writer.is_alive():
+        return
+    with _writer_lock:
+        if _writer is None or not _writer.is_alive():
+            _writer = threading.Thread(target=_write_loop, name="audit-writer", daemon=True)
+            _writer.start()
+
+
+def _write_loop() -> None:
+    global _pending, last_error
+    while True:
+        batch = [_queue.get()]
+        try:
+            while len(batch) < BATCH_SIZE:
+                batch.append(_queue.get(timeout=FLUSH_INTERVAL))
+        except queue.Empty:
+            pass
+        # Keep retrying the same batch (e.g. while another writer holds the
+        # database past busy_timeout) instead of dropping the entries.
+        delay = FLUSH_INTERVAL
+        while True:
+            try:
+                _write_batch(batch)
+            except Exception as e:
+                last_error = e
+                time.sleep(delay)
+                delay = min(delay * 2, RETRY_MAX_DELAY)
+            else:
+                last_error = None
+                break
+        with _idle:
+            _pending -= len(batch)
+            _idle.notify_all()
+
+
+def _write_batch(batch: list) -> None:
+    by_partition: dict[str, list[tuple]] = {}
+    for name, row in batch:
+        by_partition.setdefault(name, []).append(row)
+    with transaction() as conn:
+        for name, rows in by_partition.items():
+            _ensure_partition(conn, name)
+            conn.executemany(
+                f"""
+                INSERT INTO {name} (created_at, user_id, username, action, entity, entity_id, student_id,
+                                    before_json, after_json)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                rows,
+            )
+    # Only after commit: a rolled back CREATE TABLE must not be remembered.
+    _known_partitions.update((str(database.DB_PATH), name) for name in by_partition)
+
+
+def flush(timeout: float | None = 5.0) -> bool:
+    """Wait until queued entries are written; False if some are still pending."""
+    with _idle:
+        return _idle.wait_for(lambda: _pending == 0, timeout)
+
+
+atexit.register(flush)
+
+
+def partitions() -> list[str]:
+    rows = get_connection().execute(
+        "SELECT name FROM sqlite_master WHERE type='table' AND name GLOB 'audit_[0-9][0-9][0-9][0-9]_[0-9][0-9]'"
+    ).fetchall()
+    return sorted((row["name"] for row in rows), reverse=True)
+
+
+def history(student_id: int | None = None, user_id: int | None = None, limit: int = 100) -> list:
+    if student_id is not None:
+        where, params = "student_id = ?", (student_id,)
+    elif user_id is not None:
+        where, params = "user_id = ?", (user_id,)
+    else:
+        where, params = "1", ()
+    conn = get_connection()
+    result = []
+    for name in partitions():
+        rows = conn.execute(
+            f"SELECT * FROM {name} WHERE {where} ORDER BY id DESC LIMIT ?",
+            (*params, limit - len(result)),
+        ).fetchall()
+        result.extend(rows)
+        if len(result) >= limit:
+            break
+    return result
+
+
+def prune(keep_months: int) -> list[str]:
+    now = datetime.now(timezone.utc)
+    index = now.year * 12 + now.month - 1 - keep_months
+    oldest_kept = f"audit_{index // 12:04d}_{index % 12 + 1:02d}"
+    dropped = [name for name in partitions() if name < oldest_kept]
+    with transaction() as conn:
+        for name in dropped:
+            conn.execute(f"DROP TABLE {name}")
+            _known_partitions.discard((str(database.DB_PATH), name))
+    return dropped
@@ -1,7 +1,34 @@
+import base64
 import hashlib
-from dataclasses import dataclass
+import hmac
+import re
+import secrets
+import threading
+import time
+from dataclasses import dataclass, field
+from functools import lru_cache
 
-from app.database import get_connection
+from app.database import get_connection, transaction
+
+# Stored format: "scrypt$<log2 n>$<r>$<p>$<salt>$<hash>" or
+# "pbkdf2_sha256$<iterations>$<salt>$<hash>"; a bare 64-char hex string is a
+# legacy unsalted SHA-256 hash and is upgraded on the next successful login.
+SCRYPT_LOG_N = 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+PBKDF2_ITERATIONS = 600_000
+SALT_BYTES = 16
+KEY_BYTES = 32
+LEGACY_HASH = re.compile(r"[0-9a-fA-F]{64}")
+
+SESSION_TTL = 8 * 3600
+
+FREE_ATTEMPTS = 3
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 900.0
+# A key's failures are forgotten this long after its lockout ends, and at most this many keys are tracked.
+FAILURE_MEMORY = 900.0
+MAX_TRACKED = 10_000
 
 
 @dataclass
@@ -9,33 +36,208 @@ class AuthUser:
     id: int
     username: str
     role: str
+    permissions: frozenset = field(default_factory=frozenset, compare=False)
+
+    def can(self, module: str) -> bool:
+        return module in self.permissions
+
+
+class LoginThrottled(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__(f"Слишком много неудачных попыток. Повторите через {retry_after:.0f} с")
+        self.retry_after = retry_after
+
+
+def _b64(data: bytes) -> str:
+    return base64.b64encode(data).decode("ascii")
+
+
+def _scrypt(password: str, salt: bytes, log_n: int, r: int, p: int) -> bytes:
+    n = 1 << log_n
+    return hashlib.scrypt(password.encode("utf-8"), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r, dklen=KEY_BYTES)
+
+
+def _pbkdf2(password: str, salt: bytes, iterations: int) -> bytes:
+    return hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, iterations, dklen=KEY_BYTES)
+
+
+def hash_password(password: str, log_n: int = SCRYPT_LOG_N) -> str:
+    salt = secrets.token_bytes(SALT_BYTES)
+    if hasattr(hashlib, "scrypt"):
+        key = _scrypt(password, salt, log_n, SCRYPT_R, SCRYPT_P)
+        return f"scrypt${log_n}${SCRYPT_R}${SCRYPT_P}${_b64(salt)}${_b64(key)}"
+    key = _pbkdf2(password, salt, PBKDF2_ITERATIONS)
+    return f"pbkdf2_sha256${PBKDF2_ITERATIONS}${_b64(salt)}${_b64(key)}"
+
+
+def verify_password(password: str, stored: str) -> tuple[bool, bool]:
+    """Return (matches, needs_rehash) for a stored hash in any supported format.
+
+    A value that cannot be parsed never matches.
+    """
+    scheme, _, rest = stored.partition("$")
+    try:
+        if scheme == "scrypt":
+            log_n, r, p, salt, key = rest.split("$")
+            actual = _scrypt(password, base64.b64decode(salt, validate=True), int(log_n), int(r), int(p))
+            ok = hmac.compare_digest(actual, base64.b64decode(key, validate=True))
+            return ok, (int(log_n), int(r), int(p)) < (SCRYPT_LOG_N, SCRYPT_R, SCRYPT_P)
+        if scheme == "pbkdf2_sha256":
+            iterations, salt, key = rest.split("$")
+            actual = _pbkdf2(password, base64.b64decode(salt, validate=True), int(iterations))
+            ok = hmac.compare_digest(actual, base64.b64decode(key, validate=True))
+            return ok, hasattr(hashlib, "scrypt") or int(iterations) < PBKDF2_ITERATIONS
+    except ValueError:
+        return False, False
+    if not LEGACY_HASH.fullmatch(stored):
+        return False, False
+    legacy = hashlib.sha256(password.encode("utf-8")).hexdigest()
+    return hmac.compare_digest(legacy, stored.lower()), True
+
+
+def benchmark_kdf(target_ms: float = 250, max_log_n: int = 20) -> list[tuple[int, float]]:
+    """Time scrypt for increasing n until one hash exceeds ``target_ms``."""
+    results = []
+    salt = secrets.token_bytes(SALT_BYTES)
+    for log_n in range(10, max_log_n + 1):
+        started = time.perf_counter()
+        _scrypt("benchmark", salt, log_n, SCRYPT_R, SCRYPT_P)
+        elapsed = (time.perf_counter() - started) * 1000
+        results.append((log_n, elapsed))
+        if elapsed > target_ms:
+            break
+    return results
+
+
+class RateLimiter:
+    """In-memory failed-login tracker with exponential backoff per key.
+
+    Failures decay: ``memory`` seconds after a key's lockout ends it starts
+    from scratch. The map is kept in order of the last failure and capped at
+    ``max_keys``, so spraying many names cannot grow it without bound.
+    """
 
+    def __init__(self, free_attempts: int = FREE_ATTEMPTS, base: float = BACKOFF_BASE, maximum: float = BACKOFF_MAX,
+                 memory: float = FAILURE_MEMORY, max_keys: int = MAX_TRACKED):
+        self.free_attempts = free_attempts
+        self.base = base
+        self.maximum = maximum
+        self.memory = memory
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._failures: dict[tuple, tuple[int, float]] = {}
 
-def hash_password(password: str) -> str:
-    return hashlib.sha256(password.encode("utf-8")).hexdigest()
+    def _current(self, key: tuple, now: float) -> tuple[int, float]:
+        count, until = self._failures.get(key, (0, 0.0))
+        return (0, 0.0) if until + self.memory <= now else (count, until)
+
+    def retry_after(self, *keys: tuple) -> float:
+        now = time.monotonic()
+        with self._lock:
+            return max((self._current(k, now)[1] - now for k in keys), default=0.0)
+
+    def failed(self, *keys: tuple) -> None:
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                count = self._current(key, now)[0] + 1
+                delay = 0.0
+                if count > self.free_attempts:
+                    delay = min(self.base * 2 ** (count - self.free_attempts - 1), self.maximum)
+                # Re-inserted so the oldest failures stay at the front.
+                self._failures.pop(key, None)
+                self._failures[key] = (count, now + delay)
+            self._prune(now)
+
+    def _prune(self, now: float) -> None:
+        failures = self._failures
+        while failures:
+            key = next(iter(failures))
+            if len(failures) <= self.max_keys and failures[key][1] + self.memory > now:
+                break
+            del failures[key]
+
+    def succeeded(self, *keys: tuple) -> None:
+        with self._lock:
+            for key in keys:
+                self._failures.pop(key, None)
+
+
+limiter = RateLimiter()
+
+# API sessions: token -> (user, expiry on the monotonic clock); the expiry slides on use.
+_sessions: dict[str, tuple[AuthUser, float]] = {}
+_sessions_lock = threading.Lock()
+
+
+@lru_cache(maxsize=1)
+def _dummy_hash() -> str:
+    # Verified against for unknown usernames so that they take as long as wrong passwords.
+    return hash_password(secrets.token_hex(8))
 
 
 def ensure_default_admin() -> None:
-    conn = get_connection()
-    row = conn.execute("SELECT id FROM users WHERE username='admin'").fetchone()
-    if row is None:
-        conn.execute(
-            "INSERT INTO users (username, password_hash, role) VALUES (?, ?, ?)",
-            ("admin", hash_password("admin123"), "admin"),
-        )
-        conn.commit()
-    conn.close()
-
-
-def authenticate(username: str, password: str) -> AuthUser | None:
-    conn = get_connection()
-    row = conn.execute(
+    with transaction() as conn:
+        row = conn.execute("SELECT id FROM users WHERE username='admin'").fetchone()
+        if row is None:
+            conn.execute(
+                "INSERT INTO users (username, password_hash, role) VALUES (?, ?, ?)",
+                ("admin", hash_password("admin123"), "admin"),
+            )
+
+
+@lru_cache(maxsize=None)
+def role_permissions(role: str) -> frozenset:
+    from app.services import ROLE_PERMISSIONS
+
+    return frozenset(ROLE_PERMISSIONS.get(role, ()))
+
+
+def authenticate(username: str, password: str, host: str = "local") -> AuthUser | None:
+    keys = (("user", username.casefold()), ("host", host))
+    wait = limiter.retry_after(*keys)
+    if wait > 0:
+        raise LoginThrottled(wait)
+
+    row = get_connection().execute(
         "SELECT id, username, role, password_hash FROM users WHERE username=?",
         (username,),
     ).fetchone()
-    conn.close()
-    if not row:
-        return None
-    if row["password_hash"] != hash_password(password):
+    ok, needs_rehash = verify_password(password, row["password_hash"] if row else _dummy_hash())
+    if not row or not ok:
+        limiter.failed(*keys)
         return None
-    return AuthUser(id=row["id"], username=row["username"], role=row["role"])
+    limiter.succeeded(*keys)
+    if needs_rehash:
+        with transaction() as conn:
+            conn.execute("UPDATE users SET password_hash=? WHERE id=?", (hash_password(password), row["id"]))
+    return AuthUser(id=row["id"], username=row["username"], role=row["role"], permissions=role_permissions(row["role"]))
+
+
+def open_session(user: AuthUser) -> str:
+    token = secrets.token_urlsafe(32)
+    now = time.monotonic()
+    with _sessions_lock:
+        for stale in [t for t, (_, expires) in _sessions.items() if expires < now]:
+            del _sessions[stale]
+        _sessions[token] = (user, now + SESSION_TTL)
+    return token
+
+
+def session_user(token: str) -> AuthUser | None:
+    now = time.monotonic()
+    with _sessions_lock:
+        entry = _sessions.get(token)
+        if entry is None:
+            return None
+        user, expires = entry
+        if expires < now:
+            del _sessions[token]
+            return None
+        _sessions[token] = (user, now + SESSION_TTL)
+    return user
+
+
+def close_session(token: str) -> None:
+    with _sessions_lock:
+        _sessions.pop(token, None)
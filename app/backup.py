@@ -0,0 +1,228 @@
+import gzip
+import hashlib
+import re
+import shutil
+import sqlite3
+import tempfile
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Callable
+
+from app import audit, cache, database, documents, sync
+
+PAGES_PER_STEP = 4096
+STEP_SLEEP = 0.001
+KEEP_SNAPSHOTS = 14
+BACKUP_INTERVAL = 24 * 3600
+CHUNK_SIZE = 1 << 20
+SNAPSHOT_GLOB = "skfu-*.db.gz"
+SNAPSHOT_NAME = re.compile(r"skfu-(\d{8}-\d{6})(?:-(\d+))?\.db\.gz")
+
+
+class BackupError(Exception):
+    pass
+
+
+@dataclass
+class BackupResult:
+    path: Path
+    db_bytes: int
+    file_bytes: int
+    sha256: str
+    elapsed: float
+    # Scans copied into (or back from) the backup's documents/ store.
+    documents: int = 0
+
+    @property
+    def throughput(self) -> float:
+        """Source megabytes per second."""
+        return self.db_bytes / (1 << 20) / self.elapsed if self.elapsed else 0.0
+
+
+def backup_dir() -> Path:
+    return Path(database.DB_PATH).resolve().parent / "backups"
+
+
+def _snapshot_key(path: Path) -> tuple[str, int]:
+    match = SNAPSHOT_NAME.fullmatch(path.name)
+    return match.group(1), int(match.group(2) or 0)
+
+
+def snapshots(directory: Path | str | None = None) -> list[Path]:
+    """Snapshot files, newest first."""
+    paths = [p for p in Path(directory or backup_dir()).glob(SNAPSHOT_GLOB) if SNAPSHOT_NAME.fullmatch(p.name)]
+    return sorted(paths, key=_snapshot_key, reverse=True)
+
+
+def _checksum_path(path: Path) -> Path:
+    return path.with_name(path.name + ".sha256")
+
+
+def _copy_pages(source: sqlite3.Connection, target: sqlite3.Connection,
+                progress: Callable[[int, int], None] | None) -> None:
+    def step(_status, remaining, total):
+        if progress is not None:
+            progress(total - remaining, total)
+
+    # A backup restarts from scratch whenever another connection writes to the
+    # source between steps, so under constant writes it might never finish.
+    # Holding one read transaction on the source pins a WAL snapshot for the
+    # whole copy: the steps see no changes and writers are not blocked.
+    source.execute("BEGIN")
+    try:
+        source.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchall()
+        source.backup(target, pages=PAGES_PER_STEP, progress=step, sleep=STEP_SLEEP)
+    finally:
+        source.execute("COMMIT")
+
+
+def _document_digests(db: Path) -> list[str]:
+    conn = sqlite3.connect(db)
+    try:
+        return [row[0] for row in conn.execute("SELECT DISTINCT sha256 FROM documents")]
+    except sqlite3.OperationalError:
+        return []  # a snapshot from before scans were stored
+    finally:
+        conn.close()
+
+
+def _compress(source: Path, target: Path) -> str:
+    digest = hashlib.sha256()
+    with source.open("rb") as src, target.open("wb") as raw:
+        with gzip.GzipFile(filename=source.name, mode="wb", fileobj=raw, compresslevel=6, mtime=0) as gz:
+            while chunk := src.read(CHUNK_SIZE):
+                gz.write(chunk)
+    with target.open("rb") as fh:
+        while chunk := fh.read(CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _decompress(source: Path, target: Path) -> None:
+    with gzip.open(source, "rb") as src, target.open("wb") as dst:
+        shutil.copyfileobj(src, dst, CHUNK_SIZE)
+
+
+def create_snapshot(
+    directory: Path | str | None = None,
+    keep: int = KEEP_SNAPSHOTS,
+    progress: Callable[[int, int], None] | None = None,
+) -> BackupResult:
+    directory = Path(directory or backup_dir())
+    directory.mkdir(parents=True, exist_ok=True)
+    started = time.perf_counter()
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    taken = [suffix for s, suffix in map(_snapshot_key, snapshots(directory)) if s == stamp]
+    path = directory / (f"skfu-{stamp}-{max(taken) + 1}.db.gz" if taken else f"skfu-{stamp}.db.gz")
+
+    with tempfile.TemporaryDirectory(dir=directory) as tmp:
+        raw = Path(tmp) / "snapshot.db"
+        source = database.connect()
+        target = sqlite3.connect(raw)
+        try:
+            _copy_pages(source, target, progress)
+        finally:
+            target.close()
+            source.close()
+        db_bytes = raw.stat().st_size
+        # Scans live outside the database; the ones this snapshot refers to are copied next to it.
+        # Blobs never change, so each is copied once and shared by all snapshots.
+        copied = documents.copy_blobs(_document_digests(raw), documents.store_dir(), directory / "documents")
+        partial = path.with_name(path.name + ".part")
+        sha256 = _compress(raw, partial)
+        partial.replace(path)
+    _checksum_path(path).write_text(f"{sha256}  {path.name}\n", encoding="ascii")
+
+    result = BackupResult(path, db_bytes, path.stat().st_size, sha256, time.perf_counter() - started, copied)
+    rotate(directory, keep)
+    return result
+
+
+def rotate(directory: Path | str | None = None, keep: int = KEEP_SNAPSHOTS) -> list[Path]:
+    removed = snapshots(directory)[keep:]
+    for path in removed:
+        path.unlink()
+        _checksum_path(path).unlink(missing_ok=True)
+    return removed
+
+
+def _file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as fh:
+        while chunk := fh.read(CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _verify_into(path: Path, raw: Path) -> None:
+    checksum = _checksum_path(path)
+    if not checksum.exists():
+        raise BackupError(f"{path.name}: нет файла контрольной суммы {checksum.name}")
+    expected = checksum.read_text(encoding="ascii").split()[0]
+    if _file_sha256(path) != expected:
+        raise BackupError(f"{path.name}: контрольная сумма не совпадает")
+    try:
+        _decompress(path, raw)
+    except (OSError, EOFError) as e:
+        raise BackupError(f"{path.name}: архив поврежден ({e})") from e
+    conn = sqlite3.connect(raw)
+    try:
+        problems = [row[0] for row in conn.execute("PRAGMA integrity_check")]
+    except sqlite3.DatabaseError as e:
+        raise BackupError(f"{path.name}: не является базой SQLite ({e})") from e
+    finally:
+        conn.close()
+    if problems != ["ok"]:
+        raise BackupError(f"{path.name}: integrity_check: " + "; ".join(problems[:5]))
+
+
+def verify(path: Path | str) -> None:
+    """Check the checksum and run PRAGMA integrity_check on a decompressed copy."""
+    path = Path(path)
+    with tempfile.TemporaryDirectory() as tmp:
+        _verify_into(path, Path(tmp) / "verify.db")
+
+
+def restore(path: Path | str, progress: Callable[[int, int], None] | None = None) -> BackupResult:
+    """Verify a snapshot and copy it over the live database.
+
+    The copy goes through the backup API into a regular connection, so other
+    connections of the running application see the restored data instead of
+    a file swapped under them. Migrations are applied afterwards in case the
+    snapshot predates the current schema. The restored database gets a new
+    sync node id (see app/sync.py). Scans the snapshot refers to that the
+    store has lost are copied back first from the backup's documents/.
+    """
+    path = Path(path)
+    started = time.perf_counter()
+    audit.flush()
+    with tempfile.TemporaryDirectory() as tmp:
+        raw = Path(tmp) / "restore.db"
+        _verify_into(path, raw)
+        db_bytes = raw.stat().st_size
+        copied = documents.copy_blobs(_document_digests(raw), path.parent / "documents", documents.store_dir())
+        source = sqlite3.connect(raw)
+        target = database.connect()
+        try:
+            _copy_pages(source, target, progress)
+        finally:
+            target.close()
+            source.close()
+    audit.forget_partitions()
+    cache.clear()
+    database.init_db()
+    # Other nodes have already received this node's changes made after the snapshot; continuing
+    # its change numbers would make them skip new ones, so the restored copy syncs as a new node.
+    sync.init_clone()
+    return BackupResult(path, db_bytes, path.stat().st_size, _file_sha256(path), time.perf_counter() - started, copied)
+
+
+def snapshot_due(directory: Path | str | None = None, interval: float = BACKUP_INTERVAL) -> bool:
+    latest = snapshots(directory)
+    return not latest or time.time() - latest[0].stat().st_mtime >= interval
+
+
+def snapshot_if_due(interval: float = BACKUP_INTERVAL) -> BackupResult | None:
+    return create_snapshot() if snapshot_due(interval=interval) else None
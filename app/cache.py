@@ -0,0 +1,130 @@
+import functools
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from app import database
+
+DEFAULT_SIZE = 256
+# Writes made by other processes do not bump this process's table versions. Processes
+# that share their database with other writers (the API server, sync) call
+# set_max_age(SHARED_MAX_AGE) so such writes show up within that many seconds.
+SHARED_MAX_AGE = 5.0
+
+
+@dataclass
+class CacheStats:
+    name: str
+    size: int
+    hits: int
+    misses: int
+    stale: int
+    evictions: int
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class ReadCache:
+    """LRU of query results keyed by call arguments and the versions of the tables they read."""
+
+    def __init__(self, name: str, tables: tuple[str, ...], maxsize: int = DEFAULT_SIZE, max_age: float | None = None):
+        self.name = name
+        self.tables = tables
+        self.maxsize = maxsize
+        self.max_age = max_age
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.stale = self.evictions = 0
+
+    def _versions(self) -> tuple:
+        return (str(database.DB_PATH), *(database.table_version(t) for t in self.tables))
+
+    def get_or_load(self, key, load):
+        versions = self._versions()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] == versions and (self.max_age is None or now - entry[1] < self.max_age):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[2]
+                del self._entries[key]
+                self.stale += 1
+            self.misses += 1
+        # Versions are read before the query: a commit that lands meanwhile bumps them,
+        # so a result that may predate it is never served as current.
+        value = load()
+        with self._lock:
+            self._entries[key] = (versions, now, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(self.name, len(self._entries), self.hits, self.misses, self.stale, self.evictions)
+
+
+_caches: list[ReadCache] = []
+_max_age: float | None = None
+
+
+def cached(*tables: str, maxsize: int = DEFAULT_SIZE):
+    """Cache a read-only service function until one of ``tables`` is written.
+
+    Writers announce changes with ``database.touch``. Results are shared
+    between callers, so list results are handed out as copies. Calls made
+    inside a transaction go straight to the database: they may see the
+    transaction's own uncommitted rows.
+    """
+    def decorator(fn):
+        cache = ReadCache(fn.__name__, tables, maxsize, _max_age)
+        _caches.append(cache)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if database.get_connection().in_transaction:
+                return fn(*args, **kwargs)
+            key = (args, tuple(sorted(kwargs.items())))
+            value = cache.get_or_load(key, lambda: fn(*args, **kwargs))
+            return list(value) if isinstance(value, list) else value
+
+        wrapper.cache = cache
+        return wrapper
+
+    return decorator
+
+
+def set_max_age(seconds: float | None) -> None:
+    """Re-read entries older than ``seconds``; ``None`` serves them until their tables change."""
+    global _max_age
+    _max_age = seconds
+    for cache in _caches:
+        cache.max_age = seconds
+
+
+def clear() -> None:
+    for cache in _caches:
+        cache.clear()
+
+
+def stats() -> list[CacheStats]:
+    return [cache.stats() for cache in _caches]
+
+
+def report() -> str:
+    lines = [f"{'попаданий':>10} {'промахов':>9} {'устарело':>9} {'вытеснено':>10} {'записей':>8}  кэш"]
+    for s in stats():
+        lines.append(f"{s.hits:>10} {s.misses:>9} {s.stale:>9} {s.evictions:>10} {s.size:>8}  {s.name} ({s.hit_rate:.0%})")
+    return "\n".join(lines)
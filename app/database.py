@@ -1,20 +1,227 @@
 import sqlite3
+import threading
+from contextlib import contextmanager
 from pathlib import Path
+from typing import Iterator
 
 DB_PATH = Path(__file__).resolve().parent.parent / "skfu_dormitory.db"
 
+STATEMENT_CACHE_SIZE = 256
 
-def get_connection() -> sqlite3.Connection:
-    conn = sqlite3.connect(DB_PATH)
+PRAGMAS = (
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA busy_timeout = 5000",
+)
+
+# Connection class for new connections; app.diagnostics swaps in a timing subclass.
+connection_factory: type[sqlite3.Connection] = sqlite3.Connection
+# Bumped to make every thread reopen its connection on next use.
+_generation = 0
+
+# Change counters per table, bumped after each commit that wrote to it; app.cache keys on them.
+_table_versions: dict[str, int] = {}
+_versions_lock = threading.Lock()
+
+_local = threading.local()
+_registry_lock = threading.Lock()
+# connection -> thread that opened it
+_open_connections: dict[sqlite3.Connection, threading.Thread] = {}
+
+
+def connect(path: Path | str | None = None) -> sqlite3.Connection:
+    # isolation_level=None: transactions are opened explicitly by transaction().
+    conn = sqlite3.connect(
+        path or DB_PATH,
+        isolation_level=None,
+        cached_statements=STATEMENT_CACHE_SIZE,
+        check_same_thread=False,
+        factory=connection_factory,
+    )
     conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA foreign_keys = ON")
+    conn.create_function("casefold", 1, _casefold, deterministic=True)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def _casefold(value):
+    return value.casefold() if isinstance(value, str) else value
+
+
+def get_connection() -> sqlite3.Connection:
+    key = (str(DB_PATH), _generation)
+    conn = getattr(_local, "conn", None)
+    # A connection inside a transaction is kept until it ends, even if asked to reconnect.
+    if conn is not None and conn in _open_connections and (_local.key == key or conn.in_transaction):
+        return conn
+    if conn is not None:
+        close_connection()
+    conn = connect(key[0])
+    _local.conn = conn
+    _local.key = key
+    with _registry_lock:
+        _open_connections[conn] = threading.current_thread()
     return conn
 
 
-def init_db() -> None:
+def close_connection() -> None:
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        return
+    _local.conn = None
+    with _registry_lock:
+        _open_connections.pop(conn, None)
+    conn.close()
+
+
+def close_all() -> None:
+    """Close this thread's connection and those left behind by finished threads.
+
+    Connections of threads that are still running are left alone: closing them
+    here could interrupt a statement or transaction in progress.
+    """
+    current = threading.current_thread()
+    with _registry_lock:
+        conns = [conn for conn, owner in _open_connections.items() if owner is current or not owner.is_alive()]
+        for conn in conns:
+            del _open_connections[conn]
+    _local.conn = None
+    for conn in conns:
+        conn.close()
+
+
+def reconnect_all() -> None:
+    """Make every thread open a fresh connection the next time it asks for one."""
+    global _generation
+    _generation += 1
+
+
+def table_version(table: str) -> int:
+    return _table_versions.get(table, 0)
+
+
+def _bump(tables) -> None:
+    with _versions_lock:
+        for table in tables:
+            _table_versions[table] = _table_versions.get(table, 0) + 1
+
+
+def touch(*tables: str) -> None:
+    """Record that the current transaction changed ``tables``; their versions move on commit.
+
+    Bumping only after the commit keeps another thread from caching the old
+    rows under the new version.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is not None and conn.in_transaction:
+        _local.touched = getattr(_local, "touched", set()) | set(tables)
+    else:
+        _bump(tables)
+
+
+@contextmanager
+def transaction(mode: str = "IMMEDIATE") -> Iterator[sqlite3.Connection]:
     conn = get_connection()
-    cur = conn.cursor()
+    if conn.in_transaction:
+        # Nested call: join the outer transaction.
+        yield conn
+        return
+    conn.execute(f"BEGIN {mode}")
+    _local.touched = set()
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        touched, _local.touched = _local.touched, set()
+    conn.commit()
+    _bump(touched)
+
+
+BALANCE_TRIGGERS = (
+    """
+    CREATE TRIGGER IF NOT EXISTS charges_balance_ai AFTER INSERT ON charges BEGIN
+        INSERT INTO student_balances (student_id, total_charges, balance)
+        VALUES (NEW.student_id, NEW.amount - COALESCE(NEW.benefit_discount, 0),
+                ROUND(NEW.amount - COALESCE(NEW.benefit_discount, 0), 2))
+        ON CONFLICT(student_id) DO UPDATE SET
+            total_charges = total_charges + excluded.total_charges,
+            balance = ROUND(total_charges + excluded.total_charges - total_payments, 2);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS charges_balance_ad AFTER DELETE ON charges BEGIN
+        UPDATE student_balances
+        SET total_charges = total_charges - (OLD.amount - COALESCE(OLD.benefit_discount, 0)),
+            balance = ROUND(total_charges - (OLD.amount - COALESCE(OLD.benefit_discount, 0)) - total_payments, 2)
+        WHERE student_id = OLD.student_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS charges_balance_au AFTER UPDATE OF student_id, amount, benefit_discount ON charges BEGIN
+        UPDATE student_balances
+        SET total_charges = total_charges - (OLD.amount - COALESCE(OLD.benefit_discount, 0)),
+            balance = ROUND(total_charges - (OLD.amount - COALESCE(OLD.benefit_discount, 0)) - total_payments, 2)
+        WHERE student_id = OLD.student_id;
+        INSERT INTO student_balances (student_id, total_charges, balance)
+        VALUES (NEW.student_id, NEW.amount - COALESCE(NEW.benefit_discount, 0),
+                ROUND(NEW.amount - COALESCE(NEW.benefit_discount, 0), 2))
+        ON CONFLICT(student_id) DO UPDATE SET
+            total_charges = total_charges + excluded.total_charges,
+            balance = ROUND(total_charges + excluded.total_charges - total_payments, 2);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS payments_balance_ai AFTER INSERT ON payments BEGIN
+        INSERT INTO student_balances (student_id, total_payments, balance)
+        VALUES (NEW.student_id, NEW.amount, ROUND(-NEW.amount, 2))
+        ON CONFLICT(student_id) DO UPDATE SET
+            total_payments = total_payments + excluded.total_payments,
+            balance = ROUND(total_charges - total_payments - excluded.total_payments, 2);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS payments_balance_ad AFTER DELETE ON payments BEGIN
+        UPDATE student_balances
+        SET total_payments = total_payments - OLD.amount,
+            balance = ROUND(total_charges - total_payments + OLD.amount, 2)
+        WHERE student_id = OLD.student_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS payments_balance_au AFTER UPDATE OF student_id, amount ON payments BEGIN
+        UPDATE student_balances
+        SET total_payments = total_payments - OLD.amount,
+            balance = ROUND(total_charges - total_payments + OLD.amount, 2)
+        WHERE student_id = OLD.student_id;
+        INSERT INTO student_balances (student_id, total_payments, balance)
+        VALUES (NEW.student_id, NEW.amount, ROUND(-NEW.amount, 2))
+        ON CONFLICT(student_id) DO UPDATE SET
+            total_payments = total_payments + excluded.total_payments,
+            balance = ROUND(total_charges - total_payments - excluded.total_payments, 2);
+    END
+    """,
+)
+
+BALANCES_FROM_HISTORY = """
+    SELECT student_id, SUM(charged) AS total_charges, SUM(paid) AS total_payments,
+           ROUND(SUM(charged) - SUM(paid), 2) AS balance
+    FROM (
+        SELECT student_id, amount - COALESCE(benefit_discount, 0) AS charged, 0 AS paid FROM charges
+        UNION ALL
+        SELECT student_id, 0, amount FROM payments
+    )
+    GROUP BY student_id
+"""
 
+
+def _migration_base_schema(cur: sqlite3.Cursor) -> None:
     cur.execute(
         """
         CREATE TABLE IF NOT EXISTS users (
@@ -104,5 +311,408 @@ def init_db() -> None:
         """
     )
 
-    conn.commit()
-    conn.close()
+
+def _migration_balance_ledger(cur: sqlite3.Cursor) -> None:
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS student_balances (
+            student_id INTEGER PRIMARY KEY,
+            total_charges REAL NOT NULL DEFAULT 0,
+            total_payments REAL NOT NULL DEFAULT 0,
+            balance REAL NOT NULL DEFAULT 0,
+            FOREIGN KEY(student_id) REFERENCES students(id) ON DELETE CASCADE
+        )
+        """
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_student_balances_debt ON student_balances(balance) WHERE balance > 0")
+    for trigger in BALANCE_TRIGGERS:
+        cur.execute(trigger)
+    cur.execute(
+        f"INSERT OR REPLACE INTO student_balances (student_id, total_charges, total_payments, balance) {BALANCES_FROM_HISTORY}"
+    )
+
+
+def _migration_query_indexes(cur: sqlite3.Cursor) -> None:
+    for statement in (
+        "CREATE INDEX IF NOT EXISTS idx_students_full_name ON students(full_name)",
+        "CREATE INDEX IF NOT EXISTS idx_stays_student ON stays(student_id, checkin_date)",
+        "CREATE INDEX IF NOT EXISTS idx_stays_active_room ON stays(room_id) WHERE checkout_date IS NULL",
+        """
+        CREATE INDEX IF NOT EXISTS idx_stays_active_checkin
+        ON stays(checkin_date DESC, student_id, room_id) WHERE checkout_date IS NULL
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_rooms_location ON rooms(building, floor, room_number)",
+        "CREATE INDEX IF NOT EXISTS idx_charges_student ON charges(student_id, period)",
+        "CREATE INDEX IF NOT EXISTS idx_payments_student ON payments(student_id, payment_date)",
+    ):
+        cur.execute(statement)
+
+
+STUDENT_SEARCH_COLUMNS = ("full_name", "study_group", "faculty", "phone", "email")
+
+
+def _migration_student_search(cur: sqlite3.Cursor) -> None:
+    columns = ", ".join(STUDENT_SEARCH_COLUMNS)
+    new_values = ", ".join(f"NEW.{c}" for c in STUDENT_SEARCH_COLUMNS)
+    old_values = ", ".join(f"OLD.{c}" for c in STUDENT_SEARCH_COLUMNS)
+    try:
+        cur.execute(
+            f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS students_fts USING fts5(
+                {columns}, content='students', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2'
+            )
+            """
+        )
+    except sqlite3.OperationalError:
+        # SQLite built without FTS5: services.list_students falls back to LIKE.
+        return
+    cur.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS students_fts_ai AFTER INSERT ON students BEGIN
+            INSERT INTO students_fts (rowid, {columns}) VALUES (NEW.id, {new_values});
+        END
+        """
+    )
+    cur.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS students_fts_ad AFTER DELETE ON students BEGIN
+            INSERT INTO students_fts (students_fts, rowid, {columns}) VALUES ('delete', OLD.id, {old_values});
+        END
+        """
+    )
+    cur.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS students_fts_au AFTER UPDATE OF {columns} ON students BEGIN
+            INSERT INTO students_fts (students_fts, rowid, {columns}) VALUES ('delete', OLD.id, {old_values});
+            INSERT INTO students_fts (rowid, {columns}) VALUES (NEW.id, {new_values});
+        END
+        """
+    )
+    cur.execute("INSERT INTO students_fts (students_fts) VALUES ('rebuild')")
+
+
+# Statuses that can be set by hand; 'partial' and 'full' follow from rooms.occupied.
+ROOM_STATUSES = ("free", "repair")
+
+ROOM_STATUS_SQL = """
+    CASE
+        WHEN status = 'repair' THEN 'repair'
+        WHEN occupied >= total_beds THEN 'full'
+        WHEN occupied > 0 THEN 'partial'
+        ELSE 'free'
+    END
+"""
+
+
+def _migration_room_occupancy(cur: sqlite3.Cursor) -> None:
+    cur.execute("ALTER TABLE rooms ADD COLUMN occupied INTEGER NOT NULL DEFAULT 0")
+    cur.execute(
+        """
+        UPDATE rooms SET occupied = (
+            SELECT COUNT(*) FROM stays s WHERE s.room_id = rooms.id AND s.checkout_date IS NULL
+        )
+        """
+    )
+    cur.execute(f"UPDATE rooms SET status = {ROOM_STATUS_SQL}")
+    # Two statements so that the status CASE sees the already-updated counter.
+    cur.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS stays_occupancy_ai AFTER INSERT ON stays
+        WHEN NEW.checkout_date IS NULL BEGIN
+            UPDATE rooms SET occupied = occupied + 1 WHERE id = NEW.room_id;
+            UPDATE rooms SET status = {ROOM_STATUS_SQL} WHERE id = NEW.room_id;
+        END
+        """
+    )
+    cur.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS stays_occupancy_ad AFTER DELETE ON stays
+        WHEN OLD.checkout_date IS NULL BEGIN
+            UPDATE rooms SET occupied = occupied - 1 WHERE id = OLD.room_id;
+            UPDATE rooms SET status = {ROOM_STATUS_SQL} WHERE id = OLD.room_id;
+        END
+        """
+    )
+    cur.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS stays_occupancy_au AFTER UPDATE OF room_id, checkout_date ON stays BEGIN
+            UPDATE rooms SET occupied = occupied - 1 WHERE id = OLD.room_id AND OLD.checkout_date IS NULL;
+            UPDATE rooms SET occupied = occupied + 1 WHERE id = NEW.room_id AND NEW.checkout_date IS NULL;
+            UPDATE rooms SET status = {ROOM_STATUS_SQL} WHERE id IN (OLD.room_id, NEW.room_id);
+        END
+        """
+    )
+
+
+def _migration_free_beds_index(cur: sqlite3.Cursor) -> None:
+    cur.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_rooms_free_beds ON rooms(building, floor, room_number)
+        WHERE status != 'repair' AND occupied < total_beds
+        """
+    )
+
+
+def _migration_billing(cur: sqlite3.Cursor) -> None:
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS tariffs (
+            valid_from TEXT PRIMARY KEY,
+            monthly_rate REAL NOT NULL,
+            benefit_discount REAL NOT NULL DEFAULT 0 CHECK(benefit_discount BETWEEN 0 AND 1)
+        )
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS billing_runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            period TEXT NOT NULL,
+            created INTEGER NOT NULL,
+            total_amount REAL NOT NULL,
+            elapsed REAL NOT NULL,
+            run_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+    cur.execute("ALTER TABLE charges ADD COLUMN stay_id INTEGER REFERENCES stays(id) ON DELETE SET NULL")
+    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_charges_stay_period ON charges(stay_id, period) WHERE stay_id IS NOT NULL")
+
+
+# Money is stored as REAL rubles; these expressions give exact integer kopecks for sums that must not drift.
+CHARGE_KOPECKS_SQL = "CAST(ROUND((amount - COALESCE(benefit_discount, 0)) * 100) AS INTEGER)"
+PAYMENT_KOPECKS_SQL = "CAST(ROUND(amount * 100) AS INTEGER)"
+
+
+def _migration_kopecks(cur: sqlite3.Cursor) -> None:
+    cur.execute(f"ALTER TABLE charges ADD COLUMN due_kop INTEGER GENERATED ALWAYS AS ({CHARGE_KOPECKS_SQL}) VIRTUAL")
+    cur.execute(f"ALTER TABLE payments ADD COLUMN amount_kop INTEGER GENERATED ALWAYS AS ({PAYMENT_KOPECKS_SQL}) VIRTUAL")
+    # Covering, in window order: the aging pass reads them without touching the tables or sorting.
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_charges_fifo ON charges(student_id, period, id, due_kop)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_payments_paid ON payments(student_id, payment_date, amount_kop)")
+
+
+def _occupancy_delta(room: str, day: str, delta: int) -> str:
+    # Rows that cancel out are dropped, so the table only holds days when something changed.
+    return f"""
+        INSERT INTO occupancy_deltas (room_id, day, delta) SELECT {room}, {day}, {delta} WHERE {day} IS NOT NULL
+        ON CONFLICT (room_id, day) DO UPDATE SET delta = delta + excluded.delta;
+        DELETE FROM occupancy_deltas WHERE room_id = {room} AND day = {day} AND delta = 0;
+    """
+
+
+def _migration_occupancy_history(cur: sqlite3.Cursor) -> None:
+    # Beds taken (+1 on the check-in day) and freed (-1 on the check-out day) per room and day;
+    # the running sum over days is the room's occupancy, see app/occupancy.py.
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS occupancy_deltas (
+            room_id INTEGER NOT NULL REFERENCES rooms(id) ON DELETE CASCADE,
+            day TEXT NOT NULL,
+            delta INTEGER NOT NULL,
+            PRIMARY KEY (room_id, day)
+        ) WITHOUT ROWID
+        """
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_occupancy_deltas_day ON occupancy_deltas(day, room_id, delta)")
+    cur.execute(
+        """
+        INSERT INTO occupancy_deltas (room_id, day, delta)
+        SELECT room_id, day, SUM(delta) FROM (
+            SELECT room_id, checkin_date AS day, 1 AS delta FROM stays
+            UNION ALL
+            SELECT room_id, checkout_date, -1 FROM stays WHERE checkout_date IS NOT NULL
+        )
+        GROUP BY room_id, day
+        HAVING SUM(delta) != 0
+        """
+    )
+    take_new = _occupancy_delta("NEW.room_id", "NEW.checkin_date", 1) + _occupancy_delta("NEW.room_id", "NEW.checkout_date", -1)
+    undo_old = _occupancy_delta("OLD.room_id", "OLD.checkin_date", -1) + _occupancy_delta("OLD.room_id", "OLD.checkout_date", 1)
+    cur.execute(f"CREATE TRIGGER IF NOT EXISTS stays_history_ai AFTER INSERT ON stays BEGIN {take_new} END")
+    cur.execute(f"CREATE TRIGGER IF NOT EXISTS stays_history_ad AFTER DELETE ON stays BEGIN {undo_old} END")
+    cur.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS stays_history_au AFTER UPDATE OF room_id, checkin_date, checkout_date ON stays BEGIN
+            {undo_old}
+            {take_new}
+        END
+        """
+    )
+
+
+DOCUMENT_KINDS = ("passport", "contract", "other")
+
+
+def _migration_documents(cur: sqlite3.Cursor) -> None:
+    # Only the SHA-256 of a scan is kept here; the file itself is in the blob store (app/documents.py).
+    kinds = ", ".join(f"'{kind}'" for kind in DOCUMENT_KINDS)
+    cur.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS documents (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            student_id INTEGER NOT NULL REFERENCES students(id) ON DELETE CASCADE,
+            kind TEXT NOT NULL CHECK(kind IN ({kinds})),
+            file_name TEXT NOT NULL,
+            sha256 TEXT NOT NULL CHECK(length(sha256) = 64),
+            size INTEGER NOT NULL,
+            mime TEXT NOT NULL,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_documents_student ON documents(student_id, id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_documents_sha256 ON documents(sha256)")
+
+
+# Replicated between nodes, parents first: columns sent and foreign keys (column -> table). See app/sync.py.
+SYNC_TABLES = {
+    "students": (
+        ("full_name", "birth_date", "passport_data", "phone", "email", "study_group", "faculty", "study_mode",
+         "has_benefits", "notes", "created_at"),
+        {},
+    ),
+    "rooms": (("building", "floor", "room_number", "total_beds", "status"), {}),
+    "stays": (
+        ("student_id", "room_id", "checkin_date", "checkout_date", "checkout_reason", "created_at"),
+        {"student_id": "students", "room_id": "rooms"},
+    ),
+    "charges": (
+        ("student_id", "period", "amount", "benefit_discount", "comment", "stay_id"),
+        {"student_id": "students", "stay_id": "stays"},
+    ),
+    "payments": (("student_id", "payment_date", "amount", "method", "comment"), {"student_id": "students"}),
+}
+
+# Change stamps never go back behind the newest stamp received from another node.
+CHANGE_STAMP_SQL = (
+    "MAX(strftime('%Y-%m-%dT%H:%M:%fZ', 'now'), COALESCE((SELECT value FROM sync_state WHERE key = 'clock'), ''))"
+)
+
+
+def sync_column(table: str, column: str, row: str) -> str:
+    # 'partial' and 'full' follow from the stays each node applies; only a hand-set 'repair' is replicated.
+    if (table, column) == ("rooms", "status"):
+        return f"CASE WHEN {row}.status = 'repair' THEN 'repair' ELSE 'free' END"
+    return f"{row}.{column}"
+
+
+def _migration_change_log(cur: sqlite3.Cursor) -> None:
+    cur.execute("CREATE TABLE IF NOT EXISTS sync_state (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+    cur.execute("INSERT OR IGNORE INTO sync_state (key, value) VALUES ('node', lower(hex(randomblob(6))))")
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS change_log (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            tbl TEXT NOT NULL,
+            row_id INTEGER NOT NULL,
+            op TEXT NOT NULL CHECK(op IN ('upsert', 'delete')),
+            stamp TEXT NOT NULL,
+            origin TEXT NOT NULL
+        )
+        """
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_change_log_row ON change_log(tbl, row_id, seq)")
+    # Rows created on another node: their identity there and their id here.
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS sync_ids (
+            tbl TEXT NOT NULL,
+            origin TEXT NOT NULL,
+            origin_id INTEGER NOT NULL,
+            local_id INTEGER NOT NULL,
+            PRIMARY KEY (tbl, origin, origin_id)
+        ) WITHOUT ROWID
+        """
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_sync_ids_local ON sync_ids(tbl, local_id)")
+    # A database copied from another node: rows up to max_id that are not in sync_ids came from origin.
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS sync_bases (
+            tbl TEXT NOT NULL,
+            origin TEXT NOT NULL,
+            max_id INTEGER NOT NULL,
+            PRIMARY KEY (tbl, origin)
+        ) WITHOUT ROWID
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS sync_peers (
+            peer TEXT PRIMARY KEY,
+            received_seq INTEGER NOT NULL DEFAULT 0,
+            last_sync TEXT
+        )
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS sync_conflicts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            peer TEXT NOT NULL,
+            tbl TEXT NOT NULL,
+            origin TEXT NOT NULL,
+            origin_id INTEGER NOT NULL,
+            reason TEXT NOT NULL,
+            change_json TEXT NOT NULL,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+    # Changes applied from another node are logged by app/sync.py with their original stamp and origin.
+    local = "NOT EXISTS (SELECT 1 FROM sync_state WHERE key = 'applying')"
+    for table, (columns, _) in SYNC_TABLES.items():
+        def log(row: str, op: str) -> str:
+            return f"""
+                INSERT INTO change_log (tbl, row_id, op, stamp, origin)
+                VALUES ('{table}', {row}.id, '{op}', {CHANGE_STAMP_SQL}, (SELECT value FROM sync_state WHERE key = 'node'));
+            """
+
+        changed = " OR ".join(f"{sync_column(table, c, 'NEW')} IS NOT {sync_column(table, c, 'OLD')}" for c in columns)
+        cur.execute(f"CREATE TRIGGER IF NOT EXISTS {table}_log_ai AFTER INSERT ON {table} WHEN {local} BEGIN {log('NEW', 'upsert')} END")
+        cur.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_log_au AFTER UPDATE ON {table} WHEN {local} AND ({changed}) BEGIN
+                {log('NEW', 'upsert')}
+            END
+            """
+        )
+        cur.execute(f"CREATE TRIGGER IF NOT EXISTS {table}_log_ad AFTER DELETE ON {table} WHEN {local} BEGIN {log('OLD', 'delete')} END")
+
+
+# Applied in order; a database at PRAGMA user_version = N has run the first N steps.
+# Never edit or reorder a released step — append a new one instead.
+MIGRATIONS = (
+    _migration_base_schema,
+    _migration_balance_ledger,
+    _migration_query_indexes,
+    _migration_student_search,
+    _migration_room_occupancy,
+    _migration_free_beds_index,
+    _migration_billing,
+    _migration_kopecks,
+    _migration_occupancy_history,
+    _migration_documents,
+    _migration_change_log,
+)
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def schema_version(conn: sqlite3.Connection | None = None) -> int:
+    return (conn or get_connection()).execute("PRAGMA user_version").fetchone()[0]
+
+
+def init_db() -> int:
+    if schema_version() >= SCHEMA_VERSION:
+        return 0
+    with transaction() as conn:
+        current = schema_version(conn)
+        cur = conn.cursor()
+        for version, migration in enumerate(MIGRATIONS[current:], start=current + 1):
+            migration(cur)
+            cur.execute(f"PRAGMA user_version = {version}")
+    conn.execute("PRAGMA optimize")
+    return SCHEMA_VERSION - current
@@ -0,0 +1,260 @@
+import bisect
+import logging
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from functools import lru_cache
+
+from app import database
+
+SLOW_QUERY_MS = float(os.environ.get("SKFU_SLOW_QUERY_MS", 100))
+SLOW_LOG_SIZE = 200
+# Upper bounds of the latency histogram buckets, ms; the last bucket is open-ended.
+BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 1000)
+CALLER_DEPTH = 12
+# Statements built with inlined literals would otherwise grow the shape cache without bound.
+SHAPE_CACHE_SIZE = 1024
+_PLANNABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "REPLACE", "WITH")
+
+log = logging.getLogger("skfu.sql")
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACES = re.compile(r"\s+")
+
+
+def query_shape(sql: str) -> str:
+    """SQL with literals replaced by ``?`` and whitespace collapsed, to group equal queries."""
+    shape = _STRING.sub("?", sql)
+    shape = _NUMBER.sub("?", shape)
+    shape = _IN_LIST.sub("(?, ...)", shape)
+    return _SPACES.sub(" ", shape).strip()
+
+
+_shape = lru_cache(maxsize=SHAPE_CACHE_SIZE)(query_shape)
+
+
+@dataclass
+class QueryStats:
+    shape: str
+    count: int = 0
+    total_ms: float = 0.0
+    max_ms: float = 0.0
+    rows: int = 0
+    histogram: list[int] = field(default_factory=lambda: [0] * (len(BUCKETS_MS) + 1))
+    callers: set[str] = field(default_factory=set)
+
+    @property
+    def mean_ms(self) -> float:
+        return self.total_ms / self.count if self.count else 0.0
+
+    def percentile_ms(self, q: float) -> float:
+        """Upper bound of the histogram bucket holding the ``q`` quantile."""
+        target = q * self.count
+        seen = 0
+        for bound, hits in zip((*BUCKETS_MS, self.max_ms), self.histogram):
+            seen += hits
+            if seen >= target and hits:
+                return min(bound, self.max_ms)
+        return self.max_ms
+
+
+@dataclass
+class SlowQuery:
+    at: float
+    ms: float
+    sql: str
+    params: str
+    caller: str
+    plan: list[str]
+
+
+_lock = threading.Lock()
+_stats: dict[str, QueryStats] = {}
+slow_queries: deque[SlowQuery] = deque(maxlen=SLOW_LOG_SIZE)
+
+
+def _caller() -> str:
+    frame = sys._getframe(2)
+    for _ in range(CALLER_DEPTH):
+        if frame is None:
+            break
+        module = frame.f_globals.get("__name__", "")
+        if module.startswith(("app.", "benchmarks.")) and module not in ("app.database", __name__):
+            return f"{module.removeprefix('app.')}.{frame.f_code.co_name}"
+        frame = frame.f_back
+    return "?"
+
+
+def _plan(conn: sqlite3.Connection, sql: str, params) -> list[str]:
+    if not sql.lstrip().upper().startswith(_PLANNABLE):
+        return []
+    try:
+        # A plain sqlite3.Cursor so that the plan query itself is not instrumented.
+        rows = sqlite3.Cursor(conn).execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+    except sqlite3.Error as e:
+        return [f"(план недоступен: {e})"]
+    return [row[-1] for row in rows]
+
+
+def _record(conn: sqlite3.Connection, sql: str, params, elapsed_ms: float, rows: int = 0,
+            previous_ms: float | None = None) -> None:
+    """Count one statement taking ``elapsed_ms``; with ``previous_ms``, re-time an already counted one."""
+    shape = _shape(sql)
+    with _lock:
+        stats = _stats.get(shape)
+        if stats is None:
+            stats = _stats[shape] = QueryStats(shape)
+        if previous_ms is None:
+            stats.count += 1
+            stats.callers.add(_caller())
+            stats.total_ms += elapsed_ms
+        else:
+            stats.histogram[bisect.bisect_left(BUCKETS_MS, previous_ms)] -= 1
+            stats.total_ms += elapsed_ms - previous_ms
+        stats.max_ms = max(stats.max_ms, elapsed_ms)
+        stats.rows += rows
+        stats.histogram[bisect.bisect_left(BUCKETS_MS, elapsed_ms)] += 1
+    if elapsed_ms >= SLOW_QUERY_MS and (previous_ms is None or previous_ms < SLOW_QUERY_MS):
+        caller = _caller()
+        plan = _plan(conn, sql, params)
+        slow_queries.append(SlowQuery(time.time(), elapsed_ms, sql, repr(params)[:200], caller, plan))
+        log.warning("медленный запрос %.1f мс (%s): %s\n  %s", elapsed_ms, caller, shape, "\n  ".join(plan))
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor that reports every statement, including fetching its rows, to the stats."""
+
+    _sql: str | None = None
+    _params = ()
+    _elapsed_ms = 0.0
+
+    def execute(self, sql, parameters=(), /):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._sql, self._params = sql, parameters
+            self._elapsed_ms = (time.perf_counter() - started) * 1000
+            _record(self.connection, sql, parameters, self._elapsed_ms)
+
+    def executemany(self, sql, seq_of_parameters, /):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._sql = None
+            _record(self.connection, sql, (), (time.perf_counter() - started) * 1000, max(self.rowcount, 0))
+
+    def executescript(self, sql_script, /):
+        started = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            self._sql = None
+            _record(self.connection, sql_script, (), (time.perf_counter() - started) * 1000)
+
+    def _fetched(self, started: float, rows: int) -> None:
+        if self._sql is not None:
+            previous = self._elapsed_ms
+            self._elapsed_ms += (time.perf_counter() - started) * 1000
+            _record(self.connection, self._sql, self._params, self._elapsed_ms, rows, previous)
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(started, len(rows))
+        return rows
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._fetched(started, len(rows))
+        return rows
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(started, row is not None)
+        return row
+
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._fetched(started, 0)
+            raise
+        self._fetched(started, 1)
+        return row
+
+
+class TimedConnection(sqlite3.Connection):
+    # Connection.execute() does not go through cursor(), so the shortcuts are overridden too.
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=(), /):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters, /):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script, /):
+        return self.cursor().executescript(sql_script)
+
+
+def enabled() -> bool:
+    return database.connection_factory is TimedConnection
+
+
+def enable() -> None:
+    """Instrument connections opened from now on; threads reconnect on their next query."""
+    if not enabled():
+        database.connection_factory = TimedConnection
+        database.reconnect_all()
+
+
+def disable() -> None:
+    if enabled():
+        database.connection_factory = sqlite3.Connection
+        database.reconnect_all()
+
+
+def reset() -> None:
+    with _lock:
+        _stats.clear()
+    slow_queries.clear()
+
+
+def snapshot() -> list[QueryStats]:
+    """Copies of the per-shape stats, most total time first."""
+    with _lock:
+        items = [
+            QueryStats(s.shape, s.count, s.total_ms, s.max_ms, s.rows, list(s.histogram), set(s.callers))
+            for s in _stats.values()
+        ]
+    return sorted(items, key=lambda s: s.total_ms, reverse=True)
+
+
+def report(limit: int = 20) -> str:
+    lines = [f"{'запросов':>9} {'всего, мс':>11} {'сред.':>8} {'p95≤':>8} {'макс.':>8}  запрос"]
+    for s in snapshot()[:limit]:
+        lines.append(
+            f"{s.count:>9} {s.total_ms:>11.1f} {s.mean_ms:>8.2f} {s.percentile_ms(0.95):>8.2f} {s.max_ms:>8.2f}  "
+            f"{s.shape[:160]}"
+        )
+    for q in list(slow_queries)[-limit:]:
+        lines.append(f"\nмедленный {q.ms:.1f} мс в {q.caller}: {query_shape(q.sql)[:300]}")
+        lines.extend(f"    {step}" for step in q.plan)
+    return "\n".join(lines)
+
+
+if os.environ.get("SKFU_SQL_TRACE"):
+    enable()
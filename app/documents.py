@@ -0,0 +1,306 @@
+import hashlib
+import os
+import re
+import tempfile
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO, Callable, Iterable, Iterator
+
+from app import audit, database, png
+from app.cache import cached
+from app.database import DOCUMENT_KINDS, get_connection, touch, transaction
+
+CHUNK_SIZE = 1 << 20
+MAX_SIZE = 64 << 20
+THUMBNAIL_SIZE = 160
+# Blobs younger than this are never collected: an upload stores its blob
+# before the row that references it is committed.
+GC_GRACE = 3600
+DIGEST = re.compile(r"[0-9a-f]{64}")
+KIND_LABELS = {"passport": "Паспорт", "contract": "Договор", "other": "Прочее"}
+MAGIC = (
+    (b"%PDF", "application/pdf"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF8", "image/gif"),
+    (b"II*\0", "image/tiff"),
+    (b"MM\0*", "image/tiff"),
+)
+
+
+class DocumentError(Exception):
+    pass
+
+
+@dataclass
+class GcResult:
+    kept: int
+    removed: int
+    freed_bytes: int
+    thumbnails: int
+
+
+def store_dir() -> Path:
+    return Path(database.DB_PATH).resolve().parent / "documents"
+
+
+def blob_path(sha256: str, root: Path | None = None) -> Path:
+    # Two levels of fan-out keep directories small with hundreds of thousands of scans.
+    return (root or store_dir()) / "blobs" / sha256[:2] / sha256[2:4] / sha256
+
+
+def thumbnail_path(sha256: str, size: int = THUMBNAIL_SIZE) -> Path:
+    return store_dir() / "thumbnails" / sha256[:2] / f"{sha256}-{size}.png"
+
+
+def _mime(head: bytes) -> str:
+    for magic, mime in MAGIC:
+        if head.startswith(magic):
+            return mime
+    return "application/octet-stream"
+
+
+def put(source: BinaryIO, progress: Callable[[int], None] | None = None) -> tuple[str, int, str]:
+    """Stream ``source`` into the store; returns its SHA-256, size and MIME type.
+
+    The data goes to a temporary file while it is hashed and is then renamed
+    to its digest, so a reader never sees a partial blob. Content that is
+    already stored is not written twice.
+    """
+    tmp_dir = store_dir() / "tmp"
+    tmp_dir.mkdir(parents=True, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    head = b""
+    with tempfile.NamedTemporaryFile(dir=tmp_dir, delete=False) as tmp:
+        try:
+            while chunk := source.read(CHUNK_SIZE):
+                if not head:
+                    head = chunk[:16]
+                size += len(chunk)
+                if size > MAX_SIZE:
+                    raise DocumentError(f"Файл больше {MAX_SIZE >> 20} МБ")
+                digest.update(chunk)
+                tmp.write(chunk)
+                if progress is not None:
+                    progress(size)
+            tmp.flush()
+            os.fsync(tmp.fileno())
+        except BaseException:
+            tmp.close()
+            os.unlink(tmp.name)
+            raise
+    sha256 = digest.hexdigest()
+    target = blob_path(sha256)
+    try:
+        # Already stored: a fresh mtime keeps gc() from taking the blob before our row is committed.
+        os.utime(target)
+        os.unlink(tmp.name)
+    except FileNotFoundError:
+        target.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(tmp.name, target)
+    return sha256, size, _mime(head)
+
+
+def read_chunks(sha256: str, chunk_size: int = CHUNK_SIZE, root: Path | None = None) -> Iterator[bytes]:
+    """The blob's content in chunks; raises DocumentError if it does not match its digest."""
+    if not DIGEST.fullmatch(sha256):
+        raise DocumentError(f"Некорректный хэш документа: {sha256}")
+    digest = hashlib.sha256()
+    try:
+        with open(blob_path(sha256, root), "rb") as f:
+            while chunk := f.read(chunk_size):
+                digest.update(chunk)
+                yield chunk
+    except FileNotFoundError:
+        raise DocumentError(f"Файл документа {sha256} отсутствует в хранилище") from None
+    if digest.hexdigest() != sha256:
+        raise DocumentError(f"Файл документа {sha256} поврежден")
+
+
+def copy_blobs(digests: Iterable[str], source: Path, target: Path) -> int:
+    """Copy blobs from the store at ``source`` to the one at ``target``; returns how many were copied.
+
+    Blobs never change, so those the target already has are skipped. Missing
+    or damaged ones are skipped too and left for verify() to report.
+    """
+    tmp_dir = target / "tmp"
+    copied = 0
+    for sha256 in digests:
+        dest = blob_path(sha256, target)
+        if dest.exists() or not blob_path(sha256, source).exists():
+            continue
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=tmp_dir, delete=False) as tmp:
+            try:
+                for chunk in read_chunks(sha256, root=source):
+                    tmp.write(chunk)
+            except DocumentError:
+                tmp.close()
+                os.unlink(tmp.name)
+                continue
+            except BaseException:
+                tmp.close()
+                os.unlink(tmp.name)
+                raise
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(tmp.name, dest)
+        copied += 1
+    return copied
+
+
+def attach(student_id: int, source: Path | str, kind: str = "other", actor=None,
+           progress: Callable[[int], None] | None = None) -> int:
+    if kind not in DOCUMENT_KINDS:
+        raise ValueError(f"Неизвестный вид документа: {kind}")
+    source = Path(source)
+    with open(source, "rb") as f:
+        sha256, size, mime = put(f, progress)
+    with transaction() as conn:
+        touch("documents")
+        document_id = conn.execute(
+            "INSERT INTO documents (student_id, kind, file_name, sha256, size, mime) VALUES (?, ?, ?, ?, ?, ?)",
+            (student_id, kind, source.name, sha256, size, mime),
+        ).lastrowid
+    audit.record(
+        actor, "attach", "document", document_id, student_id,
+        after={"kind": kind, "file_name": source.name, "sha256": sha256, "size": size},
+    )
+    return document_id
+
+
+def get_document(document_id: int):
+    row = get_connection().execute("SELECT * FROM documents WHERE id=?", (document_id,)).fetchone()
+    if row is None:
+        raise DocumentError(f"Документ #{document_id} не найден")
+    return row
+
+
+@cached("documents")
+def list_documents(student_id: int) -> list:
+    return get_connection().execute(
+        "SELECT id, kind, file_name, sha256, size, mime, created_at FROM documents WHERE student_id=? ORDER BY id",
+        (student_id,),
+    ).fetchall()
+
+
+def save_copy(document_id: int, target: Path | str, progress: Callable[[int], None] | None = None) -> Path:
+    """Copy a document out of the store, checking its digest on the way."""
+    row = get_document(document_id)
+    target = Path(target)
+    tmp = target.with_name(target.name + ".part")
+    done = 0
+    try:
+        with open(tmp, "wb") as f:
+            for chunk in read_chunks(row["sha256"]):
+                f.write(chunk)
+                done += len(chunk)
+                if progress is not None:
+                    progress(done)
+        os.replace(tmp, target)
+    finally:
+        tmp.unlink(missing_ok=True)
+    return target
+
+
+def detach(document_id: int, actor=None) -> None:
+    """Unlink a document from its student; the blob goes at the next gc() if nothing else uses it."""
+    row = get_document(document_id)
+    with transaction() as conn:
+        touch("documents")
+        conn.execute("DELETE FROM documents WHERE id=?", (document_id,))
+    audit.record(actor, "detach", "document", document_id, row["student_id"], before=dict(row))
+
+
+def thumbnail(sha256: str, size: int = THUMBNAIL_SIZE) -> Path | None:
+    """Path of a cached PNG preview of the blob, made on first request; None if it is not an image we can read."""
+    path = thumbnail_path(sha256, size)
+    if path.exists():
+        return path
+    try:
+        with open(blob_path(sha256), "rb") as f:
+            data = png.thumbnail(f, size)
+    except (ValueError, OSError):
+        return None
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=path.parent, delete=False) as tmp:
+        tmp.write(data)
+    os.replace(tmp.name, path)
+    return path
+
+
+def _referenced() -> set[str]:
+    return {row[0] for row in get_connection().execute("SELECT DISTINCT sha256 FROM documents")}
+
+
+def gc(grace: float = GC_GRACE, dry_run: bool = False) -> GcResult:
+    """Remove blobs no document refers to, their thumbnails and abandoned temporary files.
+
+    Candidates are first moved to ``trash/``. From then on put() cannot
+    refresh them and stores a new copy instead, so a second look at their
+    mtime and at the references after the move catches any upload that
+    raced with the scan; those blobs are moved back.
+    """
+    root = store_dir()
+    trash = root / "trash"
+    # Left over from an interrupted run: put back and judged again below.
+    for path in trash.glob("*"):
+        target = blob_path(path.name, root)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(path, target)
+    referenced = _referenced()
+    cutoff = time.time() - grace
+    result = GcResult(0, 0, 0, 0)
+    moved = []
+    for path in root.glob("blobs/*/*/*"):
+        if path.name in referenced:
+            result.kept += 1
+            continue
+        stat = path.stat()
+        if stat.st_mtime > cutoff:
+            result.kept += 1
+            continue
+        if dry_run:
+            result.removed += 1
+            result.freed_bytes += stat.st_size
+            continue
+        trash.mkdir(exist_ok=True)
+        try:
+            os.replace(path, trash / path.name)
+        except FileNotFoundError:
+            continue
+        moved.append(path)
+    if moved:
+        referenced = _referenced()
+    for path in moved:
+        trashed = trash / path.name
+        stat = trashed.stat()
+        if path.name in referenced or stat.st_mtime > cutoff:
+            os.replace(trashed, path)
+            result.kept += 1
+            continue
+        result.removed += 1
+        result.freed_bytes += stat.st_size
+        trashed.unlink()
+    for path in root.glob("thumbnails/*/*.png"):
+        if path.name.partition("-")[0] not in referenced and path.stat().st_mtime <= cutoff:
+            result.thumbnails += 1
+            if not dry_run:
+                path.unlink(missing_ok=True)
+    for path in root.glob("tmp/*"):
+        if path.stat().st_mtime <= cutoff and not dry_run:
+            path.unlink(missing_ok=True)
+    return result
+
+
+def verify() -> list[tuple[str, str]]:
+    """Referenced blobs that are missing or do not match their digest, with the reason."""
+    problems = []
+    for sha256 in sorted(_referenced()):
+        try:
+            for _ in read_chunks(sha256):
+                pass
+        except DocumentError as e:
+            problems.append((sha256, str(e)))
+    return problems
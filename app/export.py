@@ -0,0 +1,262 @@
+import csv
+import re
+import zipfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Iterable, Iterator
+from xml.sax.saxutils import escape
+
+from app import finance
+from app.database import get_connection
+from app.pdf import A4, PdfWriter
+
+FETCH_SIZE = 1000
+FORMATS = ("csv", "xlsx", "pdf")
+
+
+@dataclass
+class Report:
+    title: str
+    headers: tuple[str, ...]
+    sql: str
+    pdf_widths: tuple[float, ...]
+    needs_student: bool = False
+    # Extra query parameters, computed at export time.
+    params: Callable[[], dict] | None = None
+
+
+REPORTS = {
+    "debtors": Report(
+        "Должники",
+        ("ID", "Студент", "Группа", "Начислено", "Оплачено", "Задолженность"),
+        """
+        SELECT st.id, st.full_name, st.study_group, ROUND(b.total_charges, 2), ROUND(b.total_payments, 2), b.balance
+        FROM student_balances b
+        JOIN students st ON st.id = b.student_id
+        WHERE b.balance > 0
+        ORDER BY st.full_name, st.id
+        """,
+        (0.07, 0.38, 0.13, 0.14, 0.14, 0.14),
+    ),
+    "stays": Report(
+        "Текущие проживающие",
+        ("ID", "Студент", "Группа", "Корпус", "Этаж", "Комната", "Дата заселения"),
+        """
+        SELECT s.id, st.full_name, st.study_group, r.building, r.floor, r.room_number, s.checkin_date
+        FROM stays s
+        JOIN students st ON st.id = s.student_id
+        JOIN rooms r ON r.id = s.room_id
+        WHERE s.checkout_date IS NULL
+        ORDER BY r.building, r.floor, r.room_number, st.full_name
+        """,
+        (0.07, 0.35, 0.12, 0.1, 0.07, 0.11, 0.18),
+    ),
+    "rooms": Report(
+        "Занятость комнат",
+        ("ID", "Корпус", "Этаж", "Комната", "Мест", "Занято", "Свободно", "Статус"),
+        """
+        SELECT id, building, floor, room_number, total_beds, occupied, MAX(total_beds - occupied, 0), status
+        FROM rooms
+        ORDER BY building, floor, room_number
+        """,
+        (0.08, 0.16, 0.1, 0.14, 0.1, 0.12, 0.14, 0.16),
+    ),
+    "statement": Report(
+        "Выписка по лицевому счету",
+        ("Дата", "Операция", "Сумма", "Остаток", "Комментарий"),
+        f"SELECT op_date, kind, amount_kop / 100.0, balance_kop / 100.0, note FROM ({finance.STATEMENT_SQL})",
+        (0.16, 0.18, 0.16, 0.16, 0.34),
+        needs_student=True,
+        params=lambda: {"as_of": "9999-12-31"},
+    ),
+    "aging": Report(
+        "Задолженность по срокам",
+        ("ID", "Студент", "Группа", "Долг", *finance.AGING_LABELS),
+        f"""
+        SELECT student_id, full_name, study_group, debt_kop / 100.0,
+               {", ".join(f"bucket{i}_kop / 100.0" for i in range(len(finance.AGING_BUCKETS)))}
+        FROM ({finance.AGING_SQL})
+        """,
+        (0.06, 0.26, 0.1, 0.1, 0.12, 0.12, 0.12, 0.12),
+        params=finance.aging_params,
+    ),
+}
+
+
+def stream_rows(sql: str, params: dict | tuple = (), size: int = FETCH_SIZE) -> Iterator[tuple]:
+    cursor = get_connection().cursor()
+    try:
+        cursor.execute(sql, params)
+        while True:
+            batch = cursor.fetchmany(size)
+            if not batch:
+                break
+            for row in batch:
+                yield tuple(row)
+    finally:
+        cursor.close()
+
+
+def write_csv(path: Path, title: str, headers: tuple, rows: Iterable[tuple]) -> int:
+    count = 0
+    with path.open("w", encoding="utf-8-sig", newline="") as fh:
+        writer = csv.writer(fh, delimiter=";")
+        writer.writerow(headers)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
+
+
+_XML_ILLEGAL = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+_XLSX_PARTS = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        "</Types>"
+    ),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        "</Relationships>"
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        "</Relationships>"
+    ),
+}
+
+
+def _xlsx_cell(value) -> str:
+    if value is None:
+        return "<c/>"
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return f"<c><v>{value}</v></c>"
+    text = escape(_XML_ILLEGAL.sub("", str(value)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def write_xlsx(path: Path, title: str, headers: tuple, rows: Iterable[tuple]) -> int:
+    count = 0
+    sheet_name = escape(title[:31])
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for name, content in _XLSX_PARTS.items():
+            zf.writestr(name, content)
+        zf.writestr(
+            "xl/workbook.xml",
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+            'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+            f'<sheets><sheet name="{sheet_name}" sheetId="1" r:id="rId1"/></sheets></workbook>',
+        )
+        with zf.open("xl/worksheets/sheet1.xml", "w", force_zip64=True) as sheet:
+            sheet.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+            )
+            sheet.write(("<row>" + "".join(_xlsx_cell(h) for h in headers) + "</row>").encode())
+            for row in rows:
+                sheet.write(("<row>" + "".join(_xlsx_cell(v) for v in row) + "</row>").encode())
+                count += 1
+            sheet.write(b"</sheetData></worksheet>")
+    return count
+
+
+PDF_MARGIN = 36
+PDF_FONT_SIZE = 8
+PDF_LINE = 11
+
+
+def _fit(pdf: PdfWriter, text: str, width: float) -> str:
+    if pdf.font.text_width(text, PDF_FONT_SIZE) <= width:
+        return text
+    while text and pdf.font.text_width(text + "…", PDF_FONT_SIZE) > width:
+        text = text[:-1]
+    return text + "…"
+
+
+def write_pdf(path: Path, title: str, headers: tuple, rows: Iterable[tuple], widths: tuple[float, ...]) -> int:
+    page_width, page_height = A4
+    usable = page_width - 2 * PDF_MARGIN
+    columns = []
+    x = PDF_MARGIN
+    for share in widths:
+        columns.append((x, usable * share - 4))
+        x += usable * share
+
+    count = 0
+    with path.open("wb") as fh:
+        pdf = PdfWriter(fh, title=title)
+        ops: list[str] = []
+        y = 0.0
+
+        def start_page():
+            nonlocal ops, y
+            if ops:
+                pdf.add_page(ops)
+            y = page_height - PDF_MARGIN
+            ops = [pdf.text_op(PDF_MARGIN, y, f"{title} — стр. {pdf.page_count + 1}", 11)]
+            y -= PDF_LINE * 2
+            ops.extend(pdf.text_op(cx, y, _fit(pdf, h, cw), PDF_FONT_SIZE) for (cx, cw), h in zip(columns, headers))
+            ops.append(f"{PDF_MARGIN} {y - 3:.2f} m {page_width - PDF_MARGIN} {y - 3:.2f} l S")
+            y -= PDF_LINE + 2
+
+        start_page()
+        for row in rows:
+            if y < PDF_MARGIN:
+                start_page()
+            for (cx, cw), value in zip(columns, row):
+                if value is not None:
+                    ops.append(pdf.text_op(cx, y, _fit(pdf, str(value), cw), PDF_FONT_SIZE))
+            y -= PDF_LINE
+            count += 1
+        pdf.add_page(ops)
+        pdf.close()
+    return count
+
+
+def export_report(
+    name: str,
+    path: Path | str,
+    fmt: str | None = None,
+    student_id: int | None = None,
+    progress: Callable[[int], None] | None = None,
+) -> int:
+    report = REPORTS[name]
+    path = Path(path)
+    fmt = (fmt or path.suffix.lstrip(".")).lower()
+    if fmt not in FORMATS:
+        raise ValueError(f"Неизвестный формат {fmt!r}, доступны: {', '.join(FORMATS)}")
+    if report.needs_student and student_id is None:
+        raise ValueError("Для выписки нужен ID студента")
+    title = f"{report.title} (студент {student_id})" if report.needs_student else report.title
+    rows = stream_rows(report.sql, {"student_id": student_id, **(report.params() if report.params else {})})
+    if progress is not None:
+        rows = _with_progress(rows, progress)
+    if fmt == "pdf":
+        return write_pdf(path, title, report.headers, rows, report.pdf_widths)
+    writer = write_csv if fmt == "csv" else write_xlsx
+    return writer(path, title, report.headers, rows)
+
+
+def _with_progress(rows: Iterable[tuple], progress: Callable[[int], None], every: int = 10000) -> Iterator[tuple]:
+    count = 0
+    for row in rows:
+        yield row
+        count += 1
+        if count % every == 0:
+            progress(count)
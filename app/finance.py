@@ -0,0 +1,132 @@
+from datetime import date
+from itertools import pairwise
+
+from app.database import get_connection
+
+# Lower bounds of the aging buckets, days since the start of the charged month.
+AGING_BUCKETS = (0, 30, 60, 90)
+AGING_LABELS = ("до 30 дней", "30–59 дней", "60–89 дней", "90+ дней")
+
+# Payments are allocated FIFO: the oldest charges are paid off first, so what
+# is still open is always the newest ``debt`` kopecks of charges. The open part
+# of the charges younger than a cutoff is therefore min(debt, their sum), which
+# lets the whole dormitory be aged in one grouped pass over the covering index
+# instead of a running total per charge. All sums are integer kopecks.
+AGING_SQL = """
+    WITH charged AS (
+        SELECT student_id, SUM(due_kop) AS charged_kop,
+               {younger_sums}
+        FROM charges
+        WHERE period <= :as_of
+        GROUP BY student_id
+    ),
+    paid AS (
+        SELECT student_id, SUM(amount_kop) AS paid_kop
+        FROM payments
+        WHERE payment_date <= :as_of
+        GROUP BY student_id
+    ),
+    debt AS (
+        SELECT c.*, c.charged_kop - COALESCE(p.paid_kop, 0) AS debt_kop
+        FROM charged c
+        LEFT JOIN paid p ON p.student_id = c.student_id
+    )
+    SELECT d.student_id, st.full_name, st.study_group, d.debt_kop,
+           {bucket_sums}
+    FROM debt d
+    JOIN students st ON st.id = d.student_id
+    WHERE d.debt_kop >= :min_debt_kop
+    ORDER BY st.full_name, st.id
+""".format(
+    # A month is younger than N days when it starts after the cutoff day as_of - N.
+    younger_sums=",\n".join(
+        f"SUM(CASE WHEN period > :cutoff{days} THEN due_kop ELSE 0 END) AS younger{days}_kop" for days in AGING_BUCKETS[1:]
+    ),
+    # Open debt in charges younger than each bound; consecutive differences are the buckets.
+    bucket_sums=",\n".join(
+        f"{newer} - {older} AS bucket{i}_kop"
+        for i, (older, newer) in enumerate(pairwise(
+            ["0", *(f"MIN(d.debt_kop, d.younger{days}_kop)" for days in AGING_BUCKETS[1:]), "d.debt_kop"]
+        ))
+    ),
+)
+
+# The same allocation charge by charge, for one student's statement.
+ALLOCATION_SQL = """
+    WITH charged AS (
+        SELECT id, period, due_kop,
+               SUM(due_kop) OVER (ORDER BY period, id ROWS UNBOUNDED PRECEDING) AS cum_kop
+        FROM charges
+        WHERE student_id = :student_id AND period <= :as_of
+    ),
+    paid AS (
+        SELECT COALESCE(SUM(amount_kop), 0) AS paid_kop
+        FROM payments
+        WHERE student_id = :student_id AND payment_date <= :as_of
+    )
+    SELECT c.id, c.period, c.due_kop,
+           c.due_kop - MAX(MIN(c.due_kop, c.cum_kop - p.paid_kop), 0) AS paid_kop,
+           MAX(MIN(c.due_kop, c.cum_kop - p.paid_kop), 0) AS open_kop,
+           CAST(julianday(:as_of) - julianday(substr(c.period, 1, 7) || '-01') AS INTEGER) AS age_days
+    FROM charged c
+    CROSS JOIN paid p
+    ORDER BY c.period, c.id
+"""
+
+STATEMENT_SQL = """
+    SELECT op_date, kind, amount_kop,
+           SUM(amount_kop) OVER (ORDER BY op_date, seq ROWS UNBOUNDED PRECEDING) AS balance_kop, note
+    FROM (
+        SELECT period AS op_date, 'Начисление' AS kind, due_kop AS amount_kop, comment AS note, id AS seq
+        FROM charges WHERE student_id = :student_id AND period <= :as_of
+        UNION ALL
+        SELECT payment_date, 'Оплата', -amount_kop, method, id
+        FROM payments WHERE student_id = :student_id AND payment_date <= :as_of
+    )
+    ORDER BY op_date, seq
+"""
+
+
+def kopecks(rubles: float) -> int:
+    return round(rubles * 100)
+
+
+def rubles(kop: int) -> float:
+    return kop / 100
+
+
+def aging_bucket(age_days: int) -> int:
+    return sum(age_days >= low for low in AGING_BUCKETS[1:])
+
+
+def _as_of(as_of: str | None) -> str:
+    return as_of or date.today().isoformat()
+
+
+def aging_params(as_of: str | None = None, min_debt: float = 0) -> dict:
+    as_of = _as_of(as_of)
+    day = date.fromisoformat(as_of)
+    params = {"as_of": as_of, "min_debt_kop": max(kopecks(min_debt), 1)}
+    for days in AGING_BUCKETS[1:]:
+        params[f"cutoff{days}"] = date.fromordinal(day.toordinal() - days).isoformat()[:7]
+    return params
+
+
+def aging(as_of: str | None = None, min_debt: float = 0) -> list:
+    """Open debt of every student split into aging buckets, as of ``as_of`` (default today)."""
+    return get_connection().execute(AGING_SQL, aging_params(as_of, min_debt)).fetchall()
+
+
+def aging_totals(rows: list) -> dict:
+    buckets = [sum(row[f"bucket{i}_kop"] for row in rows) for i in range(len(AGING_BUCKETS))]
+    return {"students": len(rows), "debt_kop": sum(buckets), "buckets_kop": buckets}
+
+
+def allocations(student_id: int, as_of: str | None = None) -> list:
+    """The student's charges with the part paid off FIFO and what is still open."""
+    return get_connection().execute(ALLOCATION_SQL, {"student_id": student_id, "as_of": _as_of(as_of)}).fetchall()
+
+
+def statement(student_id: int, as_of: str | None = None) -> list:
+    """Charges and payments in date order with the running balance."""
+    return get_connection().execute(STATEMENT_SQL, {"student_id": student_id, "as_of": _as_of(as_of)}).fetchall()
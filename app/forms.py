@@ -0,0 +1,493 @@
+import os
+import re
+import time
+import zipfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache
+from io import BytesIO
+from itertools import groupby, repeat
+from pathlib import Path
+from typing import Callable, Iterable, Iterator
+
+from app.database import get_connection
+from app.pdf import A4, GlyphMap, PdfWriter, TrueTypeFont, find_font, load_font
+
+MARGIN = 56.0
+LEADING = 1.35
+HEADING_SCALE = 1.2
+# Documents per process-pool task: enough to outweigh pickling, few enough to keep every worker busy.
+CHUNK = 200
+WIDTH_CACHE = 100_000
+METHOD_LABELS = {"cash": "Наличные", "card": "Банковская карта", "transfer": "Перевод"}
+
+CONTRACT = """\
+= ДОГОВОР № {stay_id}
+= найма жилого помещения в студенческом общежитии
+г. Ставрополь\t\t{checkin}
+
+Федеральное государственное автономное образовательное учреждение высшего образования «Северо-Кавказский федеральный университет», именуемое в дальнейшем «Наймодатель», с одной стороны, и {full_name}, {birth} г. р., паспорт {passport_data}, именуемый(ая) в дальнейшем «Наниматель», с другой стороны, заключили настоящий договор о нижеследующем.
+
+1. Предмет договора
+1.1. Наймодатель предоставляет Нанимателю на период обучения место в жилом помещении студенческого общежития: {building}, этаж {floor}, комната {room_number}.
+1.2. Наниматель обучается: {faculty}, группа {study_group}, форма обучения — {study_mode}.
+1.3. Дата заселения — {checkin}.
+
+2. Плата за проживание
+2.1. Плата за проживание составляет {rate} в месяц{benefit}.
+2.2. Плата вносится ежемесячно не позднее 10-го числа месяца, следующего за расчетным, наличными, банковской картой или переводом.
+2.3. Изменение тарифа доводится до Нанимателя не позднее чем за месяц; плата за последующие месяцы начисляется по новому тарифу.
+
+3. Права и обязанности сторон
+3.1. Наниматель обязуется соблюдать правила внутреннего распорядка общежития, правила пожарной безопасности и санитарные нормы, бережно относиться к помещению и имуществу, своевременно вносить плату за проживание.
+3.2. Наниматель не вправе без согласия Наймодателя переселяться в другую комнату, вселять других лиц и производить переустройство помещения.
+3.3. Наймодатель обязуется предоставить место в помещении, пригодном для проживания, обеспечить предоставление коммунальных услуг и проведение текущего ремонта мест общего пользования.
+3.4. При выселении Наниматель сдает место и полученное имущество в надлежащем состоянии.
+
+4. Срок действия и расторжение договора
+4.1. Договор вступает в силу с {checkin} и действует до окончания обучения Нанимателя.
+4.2. Договор расторгается по соглашению сторон, при отчислении Нанимателя, а также при нарушении им правил проживания или невнесении платы более двух месяцев подряд.
+4.3. Договор составлен в двух экземплярах, имеющих равную юридическую силу, по одному для каждой из сторон.
+
+5. Подписи сторон
+Наймодатель\tНаниматель
+ФГАОУ ВО «СКФУ»\t{full_name}
+\tТелефон: {phone}
+
+___________________ / ___________________\t___________________ / ___________________
+"""
+
+RECEIPT = """\
+= КВИТАНЦИЯ № {payment_id}
+= об оплате проживания в студенческом общежитии
+ФГАОУ ВО «Северо-Кавказский федеральный университет»
+
+Дата оплаты:\t{date}
+Плательщик:\t{full_name}
+Группа:\t{study_group}
+Место проживания:\t{place}
+Способ оплаты:\t{method}
+Назначение:\tплата за проживание{comment}
+Сумма:\t{amount}
+Сумма прописью: {amount_words}.
+
+Принял: ___________________ / ___________________          Плательщик: ___________________
+"""
+
+
+class Template:
+    """A form compiled for one font: lines without fields are wrapped and glyph-encoded once.
+
+    Filled-in lines are encoded with a shared ``GlyphMap``, so ``glyphs.used``
+    covers everything this template has output in the process.
+
+    Lines starting with ``=`` are centered headings, tabs split a line into
+    columns, an empty line is half a line of space and anything else is a
+    paragraph wrapped to the page width. ``{name}`` fields are filled in by
+    ``render``.
+    """
+
+    def __init__(self, source: str, font: TrueTypeFont, size: float = 10, tab: float | None = None):
+        self.font = font
+        self.size = size
+        self.tab = tab
+        self.width = A4[0] - 2 * MARGIN
+        self.glyphs = GlyphMap(font)
+        self._widths: dict[str, int] = {}
+        self.blocks = []
+        for line in source.splitlines():
+            if not line.strip():
+                self.blocks.append(("gap", None))
+                continue
+            if line.startswith("="):
+                kind, parts = "center", [line[1:].strip()]
+            elif "\t" in line:
+                kind, parts = "columns", line.split("\t")
+            else:
+                kind, parts = "paragraph", [line]
+            if any("{" in part for part in parts):
+                self.blocks.append(("fields", (kind, parts)))
+            else:
+                self.blocks.append(("static", self._layout(kind, parts)))
+
+    def _measure(self, text: str, size: float) -> float:
+        # Field values repeat a lot (groups, buildings, dates), so widths are kept per word.
+        width = self._widths.get(text)
+        if width is None:
+            if len(self._widths) >= WIDTH_CACHE:
+                self._widths.clear()
+            font = self.font
+            width = self._widths[text] = sum(font.advance(font.glyph(char)) for char in text)
+        return width * size / 1000
+
+    def _wrap(self, text: str, size: float) -> list[str]:
+        # Split on plain spaces only, so that no-break spaces in amounts hold.
+        lines, line, width = [], "", 0.0
+        space = self._measure(" ", size)
+        for word in filter(None, text.split(" ")):
+            word_width = self._measure(word, size)
+            if line and width + space + word_width > self.width:
+                lines.append(line)
+                line, width = word, word_width
+            elif line:
+                line, width = f"{line} {word}", width + space + word_width
+            else:
+                line, width = word, word_width
+        return lines + [line] if line else lines
+
+    def _fit(self, text: str, width: float, size: float) -> str:
+        if self._measure(text, size) <= width:
+            return text
+        while text and self._measure(text + "…", size) > width:
+            text = text[:-1]
+        return text + "…"
+
+    def _layout(self, kind: str, parts: list[str]) -> list[tuple[float, list[tuple[float, str]]]]:
+        """Rows of (font size, [(x, encoded text)])."""
+        if kind == "columns":
+            step = self.tab or self.width / len(parts)
+            cells = []
+            for i, text in enumerate(parts):
+                x = MARGIN + i * step
+                room = step if i < len(parts) - 1 else self.width - i * step
+                if text:
+                    cells.append((x, self.glyphs.encode(self._fit(text, room - 6, self.size))))
+            return [(self.size, cells)]
+        size = self.size * HEADING_SCALE if kind == "center" else self.size
+        rows = []
+        for line in self._wrap(parts[0], size):
+            x = MARGIN + (self.width - self._measure(line, size)) / 2 if kind == "center" else MARGIN
+            rows.append((size, [(x, self.glyphs.encode(line))]))
+        return rows
+
+    def render(self, values: dict, top: float, bottom: float = MARGIN) -> list[list[str]]:
+        """Content operations of the filled form, one list per page; a long document continues on a new page."""
+        pages: list[list[str]] = [[]]
+        y = top
+        for kind, block in self.blocks:
+            if kind == "gap":
+                y -= self.size * LEADING / 2
+                continue
+            if kind == "fields":
+                layout, parts = block
+                block = self._layout(layout, [part.format_map(values) for part in parts])
+            for size, cells in block:
+                y -= size * LEADING
+                if y < bottom:
+                    pages.append([])
+                    y = A4[1] - MARGIN - size * LEADING
+                ops = pages[-1]
+                for x, text in cells:
+                    ops.append(f"BT /F1 {size:g} Tf {x:.2f} {y:.2f} Td {text} Tj ET")
+        return pages
+
+
+def _date(value: str | None) -> str:
+    if value and re.match(r"\d{4}-\d{2}-\d{2}", value):
+        return f"{value[8:10]}.{value[5:7]}.{value[:4]}"
+    return value or "—"
+
+
+def _blank(row: dict) -> dict:
+    return {key: "—" if value is None or value == "" else value for key, value in row.items()}
+
+
+def money(kop: int) -> str:
+    """``1234550`` -> ``12 345,50 руб.`` with no-break spaces, so an amount is never wrapped."""
+    return f"{kop // 100:,}".replace(",", " ") + f",{kop % 100:02d} руб."
+
+
+_UNITS = ("", "один", "два", "три", "четыре", "пять", "шесть", "семь", "восемь", "девять")
+_TEENS = ("десять", "одиннадцать", "двенадцать", "тринадцать", "четырнадцать", "пятнадцать", "шестнадцать",
+          "семнадцать", "восемнадцать", "девятнадцать")
+_TENS = ("", "", "двадцать", "тридцать", "сорок", "пятьдесят", "шестьдесят", "семьдесят", "восемьдесят", "девяносто")
+_HUNDREDS = ("", "сто", "двести", "триста", "четыреста", "пятьсот", "шестьсот", "семьсот", "восемьсот", "девятьсот")
+# Word forms for 1, 2-4 and 5+ and whether the numeral is feminine, from rubles up.
+_SCALES = (
+    (("рубль", "рубля", "рублей"), False),
+    (("тысяча", "тысячи", "тысяч"), True),
+    (("миллион", "миллиона", "миллионов"), False),
+    (("миллиард", "миллиарда", "миллиардов"), False),
+)
+
+
+def _plural(n: int, forms: tuple[str, str, str]) -> str:
+    if 11 <= n % 100 <= 19:
+        return forms[2]
+    return forms[0] if n % 10 == 1 else forms[1] if 2 <= n % 10 <= 4 else forms[2]
+
+
+def amount_in_words(kop: int) -> str:
+    """``123450`` -> ``Одна тысяча двести тридцать четыре рубля 50 копеек``."""
+    rubles, kopecks = divmod(kop, 100)
+    words = []
+    for power in range(len(_SCALES) - 1, -1, -1):
+        forms, feminine = _SCALES[power]
+        group = rubles // 1000 ** power % 1000
+        if not group:
+            if not power:
+                words.append("ноль" if not rubles else "")
+                words.append(forms[2])
+            continue
+        words += [_HUNDREDS[group // 100]]
+        if 10 <= group % 100 <= 19:
+            words.append(_TEENS[group % 10])
+        else:
+            unit = group % 10
+            words += [_TENS[group // 10 % 10], ("одна", "две")[unit - 1] if feminine and unit in (1, 2) else _UNITS[unit]]
+        words.append(_plural(group, forms))
+    text = " ".join(filter(None, words)) + f" {kopecks:02d} " + _plural(kopecks, ("копейка", "копейки", "копеек"))
+    return text[0].upper() + text[1:]
+
+
+def _contract_values(row: dict) -> dict:
+    values = _blank(row)
+    rate = row["monthly_rate"]
+    values["checkin"] = _date(row["checkin_date"])
+    values["birth"] = _date(row["birth_date"])
+    values["rate"] = money(round(rate * 100)) if rate is not None else "сумму по действующему тарифу"
+    values["benefit"] = " с учетом льготы" if row["has_benefits"] and rate is not None else ""
+    return values
+
+
+def _receipt_values(row: dict) -> dict:
+    values = _blank(row)
+    values["date"] = _date(row["payment_date"])
+    values["place"] = f"{row['building']}, комната {row['room_number']}" if row["building"] else "—"
+    values["method"] = METHOD_LABELS.get(row["method"], row["method"] or "—")
+    values["comment"] = f" ({row['comment']})" if row["comment"] else ""
+    values["amount"] = money(row["amount_kop"])
+    values["amount_words"] = amount_in_words(row["amount_kop"])
+    return values
+
+
+@dataclass(frozen=True)
+class Form:
+    title: str
+    source: str
+    sql: str
+    values: Callable[[dict], dict]
+    # SQL for the selection filters.
+    date_column: str
+    id_column: str
+    current: str
+    size: float = 10
+    tab: float | None = None
+    per_page: int = 1
+
+
+FORMS = {
+    "contract": Form(
+        "Договоры найма",
+        CONTRACT,
+        """
+        SELECT s.id AS stay_id, s.checkin_date, st.id AS student_id, st.full_name, st.birth_date, st.passport_data,
+               st.phone, st.faculty, st.study_group, st.study_mode, st.has_benefits, r.building, r.floor, r.room_number,
+               (SELECT t.monthly_rate * (CASE WHEN st.has_benefits THEN 1 - t.benefit_discount ELSE 1 END)
+                FROM tariffs t WHERE t.valid_from <= s.checkin_date ORDER BY t.valid_from DESC LIMIT 1) AS monthly_rate
+        FROM stays s
+        JOIN students st ON st.id = s.student_id
+        JOIN rooms r ON r.id = s.room_id
+        WHERE {where}
+        ORDER BY st.full_name, st.id, s.id
+        """,
+        _contract_values,
+        date_column="s.checkin_date",
+        id_column="s.id",
+        current="s.checkout_date IS NULL",
+    ),
+    "receipt": Form(
+        "Квитанции об оплате",
+        RECEIPT,
+        """
+        SELECT p.id AS payment_id, p.payment_date, p.amount_kop, p.method, p.comment, st.id AS student_id,
+               st.full_name, st.study_group, r.building, r.room_number
+        FROM payments p
+        JOIN students st ON st.id = p.student_id
+        LEFT JOIN stays s ON s.student_id = p.student_id AND s.checkout_date IS NULL
+        LEFT JOIN rooms r ON r.id = s.room_id
+        WHERE {where}
+        ORDER BY st.full_name, st.id, p.payment_date, p.id
+        """,
+        _receipt_values,
+        date_column="p.payment_date",
+        id_column="p.id",
+        current="s.id IS NOT NULL",
+        size=9.5,
+        tab=110,
+        per_page=2,
+    ),
+}
+
+
+@dataclass
+class BatchResult:
+    documents: int
+    pages: int
+    files: int
+    size: int
+    workers: int
+    elapsed: float
+
+    @property
+    def per_second(self) -> float:
+        return self.documents / self.elapsed if self.elapsed else 0.0
+
+
+@lru_cache(maxsize=None)
+def compiled(kind: str, font_path: str) -> Template:
+    """The form's template, compiled once per process and font."""
+    form = FORMS[kind]
+    return Template(form.source, load_font(font_path), form.size, form.tab)
+
+
+def select(kind: str, ids: Iterable[int] | None = None, student_id: int | None = None, since: str | None = None,
+           until: str | None = None, current: bool = False) -> tuple[tuple[str, ...], list[tuple]]:
+    """Column names and rows of the documents to print, grouped by student."""
+    form = FORMS[kind]
+    where, params = ["1"], {}
+    if ids is not None:
+        ids = [int(i) for i in ids]
+        where.append(f"{form.id_column} IN ({','.join(map(str, ids)) or 'NULL'})")
+    if student_id is not None:
+        where.append("st.id = :student_id")
+        params["student_id"] = student_id
+    if since:
+        where.append(f"{form.date_column} >= :since")
+        params["since"] = since
+    if until:
+        where.append(f"{form.date_column} <= :until")
+        params["until"] = until
+    if current:
+        where.append(form.current)
+    cursor = get_connection().execute(form.sql.format(where=" AND ".join(where)), params)
+    columns = tuple(d[0] for d in cursor.description)
+    return columns, [tuple(row) for row in cursor]
+
+
+def _content(ops: list[str]) -> bytes:
+    return zlib.compress("\n".join(ops).encode("latin-1"))
+
+
+def _pages(form: Form, template: Template, rows: Iterable[dict]) -> Iterator[bytes]:
+    """Compressed page contents; ``per_page`` short documents share a sheet, divided by cut lines."""
+    width, height = A4
+    step = height / form.per_page
+    ops: list[str] = []
+    slot = 0
+    for row in rows:
+        if slot == form.per_page:
+            yield _content(ops)
+            ops, slot = [], 0
+        top = height - slot * step - MARGIN
+        pages = template.render(form.values(row), top, top - step + 2 * MARGIN)
+        if slot:
+            y = height - slot * step
+            ops.append(f"[4 4] 0 d 0.5 w {MARGIN / 2:.2f} {y:.2f} m {width - MARGIN / 2:.2f} {y:.2f} l S [] 0 d")
+        ops += pages[0]
+        slot += 1
+        for extra in pages[1:]:
+            yield _content(ops)
+            ops, slot = extra, form.per_page
+    if ops:
+        yield _content(ops)
+
+
+def _render_pages(kind: str, font_path: str, columns: tuple[str, ...], rows: list[tuple]) -> tuple[dict[int, str], list[bytes]]:
+    """Worker task for a merged print file: page contents and the glyphs they use."""
+    template = compiled(kind, font_path)
+    pages = list(_pages(FORMS[kind], template, (dict(zip(columns, row)) for row in rows)))
+    return dict(template.glyphs.used), pages
+
+
+def file_name(student_id: int, full_name: str) -> str:
+    name = re.sub(r"[^\w.-]+", "_", full_name).strip("_")
+    return f"{student_id:06d}_{name}.pdf"
+
+
+def _render_files(kind: str, font_path: str, columns: tuple[str, ...], rows: list[tuple]) -> list[tuple[str, bytes, int]]:
+    """Worker task for a per-student archive: (file name, PDF, pages) for each student in the chunk."""
+    form = FORMS[kind]
+    template = compiled(kind, font_path)
+    files = []
+    records = (dict(zip(columns, row)) for row in rows)
+    for student_id, group in groupby(records, key=lambda r: r["student_id"]):
+        group = list(group)
+        buffer = BytesIO()
+        pdf = PdfWriter(buffer, template.font, title=f"{form.title}: {group[0]['full_name']}")
+        for content in _pages(form, template, group):
+            pdf.add_content(content)
+        # Every glyph the worker has output so far: a little larger than this file
+        # needs, but consecutive files then embed the same, already built subset.
+        pdf.use_glyphs(template.glyphs.used)
+        pdf.close()
+        files.append((file_name(student_id, group[0]["full_name"]), buffer.getvalue(), pdf.page_count))
+    return files
+
+
+def _chunks(rows: list[tuple], size: int, key: int | None = None) -> Iterator[list[tuple]]:
+    """Runs of ``size`` rows; with ``key`` a run is extended so that one student's rows stay together."""
+    chunk: list[tuple] = []
+    for row in rows:
+        if len(chunk) >= size and (key is None or row[key] != chunk[-1][key]):
+            yield chunk
+            chunk = []
+        chunk.append(row)
+    if chunk:
+        yield chunk
+
+
+def generate(kind: str, path: Path | str, archive: bool | None = None, workers: int | None = None,
+             progress: Callable[[int], None] | None = None, **filters) -> BatchResult:
+    """Render the selected documents into one print file, or a zip with a PDF per student.
+
+    ``archive`` defaults to the extension of ``path``. Chunks of documents are
+    rendered by a pool of ``workers`` processes (the CPU count by default),
+    each with its own compiled template; the pages are written here in order.
+    Nothing is written when no documents match ``filters`` (see ``select``).
+    """
+    form = FORMS[kind]
+    path = Path(path)
+    archive = path.suffix.lower() == ".zip" if archive is None else archive
+    started = time.perf_counter()
+    columns, rows = select(kind, **filters)
+    if not rows:
+        return BatchResult(0, 0, 0, 0, 0, time.perf_counter() - started)
+    # Resolved here so every worker loads the same file.
+    font_path = str(find_font())
+    chunks = list(_chunks(rows, CHUNK, columns.index("student_id") if archive else None))
+    workers = max(1, min(workers or os.cpu_count() or 1, len(chunks)))
+    pool = ProcessPoolExecutor(workers) if workers > 1 else None
+    pages = files = done = 0
+    try:
+        results = (pool.map if pool else map)(
+            _render_files if archive else _render_pages, repeat(kind), repeat(font_path), repeat(columns), chunks
+        )
+        if archive:
+            # The PDFs are compressed already.
+            with zipfile.ZipFile(path, "w", zipfile.ZIP_STORED) as zf:
+                for chunk, result in zip(chunks, results):
+                    for name, data, count in result:
+                        zf.writestr(name, data)
+                        pages += count
+                        files += 1
+                    done += len(chunk)
+                    if progress is not None:
+                        progress(done)
+        else:
+            with path.open("wb") as fh:
+                pdf = PdfWriter(fh, load_font(font_path), title=form.title)
+                for chunk, (used, contents) in zip(chunks, results):
+                    pdf.use_glyphs(used)
+                    for content in contents:
+                        pdf.add_content(content)
+                    done += len(chunk)
+                    if progress is not None:
+                        progress(done)
+                pdf.close()
+                pages, files = pdf.page_count, 1
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+    return BatchResult(len(rows), pages, files, path.stat().st_size, workers, time.perf_counter() - started)
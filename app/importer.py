@@ -0,0 +1,218 @@
+import csv
+import json
+import math
+import sqlite3
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Iterable, Iterator
+
+from app.database import ROOM_STATUSES, touch, transaction
+
+DEFAULT_BATCH_SIZE = 1000
+
+TRUE_VALUES = {"1", "true", "yes", "y", "да", "+"}
+FALSE_VALUES = {"0", "false", "no", "n", "нет", "-", ""}
+
+
+def _text(value):
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def _int(value):
+    if value is None or str(value).strip() == "":
+        return None
+    return int(str(value).strip())
+
+
+def _positive_int(value):
+    number = _int(value)
+    if number is not None and number <= 0:
+        raise ValueError(f"должно быть больше нуля: {value!r}")
+    return number
+
+
+def _float(value):
+    if value is None or str(value).strip() == "":
+        return None
+    number = float(str(value).strip().replace(",", "."))
+    if not math.isfinite(number):
+        raise ValueError(f"не конечное число: {value!r}")
+    return number
+
+
+def _bool(value):
+    if isinstance(value, bool):
+        return int(value)
+    text = str(value if value is not None else "").strip().lower()
+    if text in TRUE_VALUES:
+        return 1
+    if text in FALSE_VALUES:
+        return 0
+    raise ValueError(f"не булево значение: {value!r}")
+
+
+def _room_status(value):
+    status = _text(value) or "free"
+    if status not in ROOM_STATUSES:
+        raise ValueError(f"недопустимый статус: {status!r}")
+    return status
+
+
+# column -> (converter, required, default)
+SCHEMAS = {
+    "students": {
+        "full_name": (_text, True, None),
+        "birth_date": (_text, False, None),
+        "passport_data": (_text, False, None),
+        "phone": (_text, False, None),
+        "email": (_text, False, None),
+        "study_group": (_text, False, None),
+        "faculty": (_text, False, None),
+        "study_mode": (_text, False, None),
+        "has_benefits": (_bool, False, 0),
+        "notes": (_text, False, None),
+    },
+    "rooms": {
+        "building": (_text, True, None),
+        "floor": (_positive_int, True, None),
+        "room_number": (_text, True, None),
+        "total_beds": (_positive_int, True, None),
+        "status": (_room_status, False, "free"),
+    },
+    "charges": {
+        "student_id": (_int, True, None),
+        "period": (_text, True, None),
+        "amount": (_float, True, None),
+        "benefit_discount": (_float, False, 0),
+        "comment": (_text, False, None),
+    },
+}
+
+
+@dataclass
+class RowError:
+    line: int
+    message: str
+
+
+@dataclass
+class ImportResult:
+    table: str
+    processed: int = 0
+    inserted: int = 0
+    errors: list[RowError] = field(default_factory=list)
+    elapsed: float = 0.0
+
+    @property
+    def rows_per_sec(self) -> float:
+        return self.processed / self.elapsed if self.elapsed else 0.0
+
+
+def read_rows(path: Path | str) -> Iterator[tuple[int, dict]]:
+    path = Path(path)
+    with path.open(encoding="utf-8-sig", newline="") as fh:
+        if path.suffix.lower() in (".jsonl", ".ndjson"):
+            for line_no, line in enumerate(fh, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield line_no, {"__error__": f"некорректный JSON: {e.msg}"}
+                    continue
+                yield line_no, record if isinstance(record, dict) else {"__error__": "ожидался JSON-объект"}
+        else:
+            reader = csv.DictReader(fh)
+            for record in reader:
+                yield reader.line_num, record
+
+
+def validate_row(table: str, record: dict) -> tuple:
+    if "__error__" in record:
+        raise ValueError(record["__error__"])
+    values = []
+    for column, (convert, required, default) in SCHEMAS[table].items():
+        raw = record.get(column)
+        try:
+            value = convert(raw)
+        except ValueError as e:
+            raise ValueError(f"{column}: {e}") from None
+        if value is None:
+            if required:
+                raise ValueError(f"{column}: обязательное поле")
+            value = default
+        values.append(value)
+    return tuple(values)
+
+
+def _insert_sql(table: str) -> str:
+    columns = list(SCHEMAS[table])
+    placeholders = ", ".join("?" for _ in columns)
+    return f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})"
+
+
+def _flush(sql: str, batch: list[tuple[int, tuple]], result: ImportResult) -> None:
+    with transaction() as conn:
+        touch(result.table)
+        conn.execute("SAVEPOINT import_batch")
+        try:
+            conn.executemany(sql, [values for _, values in batch])
+            conn.execute("RELEASE import_batch")
+            result.inserted += len(batch)
+            return
+        except sqlite3.Error:
+            conn.execute("ROLLBACK TO import_batch")
+            conn.execute("RELEASE import_batch")
+        # Some row violates a constraint: retry one by one to isolate it.
+        for line_no, values in batch:
+            try:
+                conn.execute(sql, values)
+                result.inserted += 1
+            except sqlite3.Error as e:
+                result.errors.append(RowError(line_no, str(e)))
+
+
+def import_rows(
+    table: str,
+    rows: Iterable[tuple[int, dict]],
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    progress: Callable[[ImportResult], None] | None = None,
+) -> ImportResult:
+    if table not in SCHEMAS:
+        raise ValueError(f"Импорт в таблицу {table!r} не поддерживается")
+    sql = _insert_sql(table)
+    result = ImportResult(table)
+    started = time.perf_counter()
+    batch: list[tuple[int, tuple]] = []
+    for line_no, record in rows:
+        result.processed += 1
+        try:
+            batch.append((line_no, validate_row(table, record)))
+        except ValueError as e:
+            result.errors.append(RowError(line_no, str(e)))
+        if len(batch) >= batch_size:
+            _flush(sql, batch, result)
+            batch.clear()
+            result.elapsed = time.perf_counter() - started
+            if progress:
+                progress(result)
+    if batch:
+        _flush(sql, batch, result)
+    result.errors.sort(key=lambda e: e.line)
+    result.elapsed = time.perf_counter() - started
+    if progress:
+        progress(result)
+    return result
+
+
+def import_file(
+    table: str,
+    path: Path | str,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    progress: Callable[[ImportResult], None] | None = None,
+) -> ImportResult:
+    return import_rows(table, read_rows(path), batch_size, progress)
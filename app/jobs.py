@@ -0,0 +1,137 @@
+import queue
+import threading
+import tkinter as tk
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable
+
+POLL_MS = 30
+DEFAULT_WORKERS = 2
+
+
+@dataclass(eq=False)
+class Job:
+    key: tuple
+    channel: str | None
+    on_done: Callable | None
+    on_error: Callable | None
+    future: Future | None = None
+    started: threading.Event = field(default_factory=threading.Event)
+
+
+class JobRunner:
+    """Runs service calls on worker threads and hands results back to Tk.
+
+    Each worker uses its own thread-local connection from app.database.
+    Jobs submitted on the same ``channel`` supersede each other: a newer
+    job cancels an older one that has not started and drops its result
+    otherwise, while an identical call that is still queued is reused.
+    """
+
+    def __init__(self, root, workers: int = DEFAULT_WORKERS, on_busy: Callable[[bool], None] | None = None,
+                 on_error: Callable[[Exception], None] | None = None):
+        self.root = root
+        self.on_busy = on_busy
+        self.on_error = on_error
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="db-worker")
+        self._results: queue.Queue = queue.Queue()
+        self._channels: dict[str, Job] = {}
+        self._active = 0
+        self._closed = False
+        self._poll_id = self.root.after(POLL_MS, self._poll)
+
+    def submit(self, fn: Callable, *args, on_done: Callable | None = None, on_error: Callable | None = None,
+               channel: str | None = None) -> Job:
+        key = (fn, args)
+        if channel is not None:
+            previous = self._channels.get(channel)
+            if previous is not None:
+                if previous.key == key and not previous.started.is_set():
+                    previous.on_done, previous.on_error = on_done, on_error
+                    return previous
+                previous.future.cancel()
+        job = Job(key, channel, on_done, on_error)
+        if channel is not None:
+            self._channels[channel] = job
+        self._set_active(self._active + 1)
+        job.future = self._executor.submit(self._run, job, fn, args)
+        job.future.add_done_callback(lambda future: self._on_cancelled(job, future))
+        return job
+
+    @property
+    def busy(self) -> bool:
+        return self._active > 0
+
+    def cancel(self, channel: str) -> None:
+        job = self._channels.pop(channel, None)
+        if job is not None:
+            job.future.cancel()
+
+    def shutdown(self, wait: bool = True) -> None:
+        # Queued jobs are dropped; running ones finish so their transactions are not cut off.
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self.root.after_cancel(self._poll_id)
+        except tk.TclError:
+            pass  # the window is already destroyed, and its timers with it
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+    def _run(self, job: Job, fn: Callable, args: tuple) -> None:
+        job.started.set()
+        result, error = None, None
+        try:
+            result = fn(*args)
+        except BaseException as e:
+            error = e
+        finally:
+            # Every started job reports back, or the busy count would never drop to zero.
+            self._results.put((job, result, error))
+
+    def _on_cancelled(self, job: Job, future: Future) -> None:
+        if future.cancelled():
+            self._results.put((job, None, CancelledError()))
+
+    def _poll(self) -> None:
+        try:
+            while True:
+                try:
+                    job, result, error = self._results.get_nowait()
+                except queue.Empty:
+                    break
+                try:
+                    self._deliver(job, result, error)
+                except Exception as e:
+                    self._report(e)
+        finally:
+            # A failing callback must not stop the loop, or every later result would be lost.
+            if not self._closed:
+                self._poll_id = self.root.after(POLL_MS, self._poll)
+
+    def _deliver(self, job: Job, result, error: BaseException | None) -> None:
+        self._set_active(self._active - 1)
+        if job.channel is not None:
+            if self._channels.get(job.channel) is not job:
+                return
+            del self._channels[job.channel]
+        if isinstance(error, CancelledError):
+            return
+        if error is not None:
+            handler = job.on_error or self.on_error
+            if handler is None:
+                self._report(error)
+            else:
+                handler(error)
+        elif job.on_done is not None:
+            job.on_done(result)
+
+    def _report(self, error: BaseException) -> None:
+        # Tk's default handler prints the traceback, like an exception in any other callback.
+        self.root.report_callback_exception(type(error), error, error.__traceback__)
+
+    def _set_active(self, active: int) -> None:
+        was_busy = self._active > 0
+        self._active = active
+        if self.on_busy is not None and was_busy != (active > 0):
+            self.on_busy(active > 0)
@@ -0,0 +1,126 @@
+import re
+from dataclasses import dataclass
+
+from app.database import get_connection
+
+GROUPINGS = {
+    "building": ("r.building",),
+    "floor": ("r.building", "r.floor"),
+    "room": ("r.building", "r.floor", "r.room_number", "r.id"),
+}
+
+
+@dataclass
+class MonthUtilization:
+    period: str
+    days: int
+    beds: int
+    bed_days: int
+
+    @property
+    def average_occupied(self) -> float:
+        return self.bed_days / self.days
+
+    @property
+    def utilization(self) -> float:
+        return self.bed_days / (self.beds * self.days) if self.beds else 0.0
+
+
+def _scope(building: str | None, floor: int | None, room_id: int | None) -> tuple[str, dict]:
+    params = {
+        name: value
+        for name, value in (("building", building), ("floor", floor), ("room_id", room_id))
+        if value is not None
+    }
+    columns = {"building": "r.building", "floor": "r.floor", "room_id": "r.id"}
+    return " AND ".join(f"{columns[name]} = :{name}" for name in params) or "1", params
+
+
+def occupied_on(day: str, building: str | None = None, floor: int | None = None, room_id: int | None = None) -> int:
+    """Beds taken on ``day`` (a stay occupies its check-in day but not its check-out day)."""
+    where, params = _scope(building, floor, room_id)
+    return get_connection().execute(
+        f"""
+        SELECT COALESCE(SUM(d.delta), 0)
+        FROM occupancy_deltas d
+        JOIN rooms r ON r.id = d.room_id
+        WHERE {where} AND d.day <= :day
+        """,
+        {**params, "day": day},
+    ).fetchone()[0]
+
+
+def snapshot(day: str, by: str = "building", building: str | None = None, floor: int | None = None) -> list:
+    """Beds and occupied beds on ``day`` per building, floor or room."""
+    columns = ", ".join(GROUPINGS[by])
+    where, params = _scope(building, floor, None)
+    return get_connection().execute(
+        f"""
+        SELECT {columns}, SUM(r.total_beds) AS beds, COALESCE(SUM(o.occupied), 0) AS occupied
+        FROM rooms r
+        LEFT JOIN (
+            SELECT room_id, SUM(delta) AS occupied FROM occupancy_deltas WHERE day <= :day GROUP BY room_id
+        ) o ON o.room_id = r.id
+        WHERE {where}
+        GROUP BY {columns}
+        ORDER BY {columns}
+        """,
+        {**params, "day": day},
+    ).fetchall()
+
+
+def buildings() -> list[str]:
+    return [row[0] for row in get_connection().execute("SELECT DISTINCT building FROM rooms ORDER BY building")]
+
+
+def capacity(building: str | None = None, floor: int | None = None, room_id: int | None = None) -> int:
+    where, params = _scope(building, floor, room_id)
+    return get_connection().execute(f"SELECT COALESCE(SUM(total_beds), 0) FROM rooms r WHERE {where}", params).fetchone()[0]
+
+
+def monthly(first: str, last: str, building: str | None = None, floor: int | None = None,
+            room_id: int | None = None) -> list[MonthUtilization]:
+    """Occupied bed-days against capacity for each month from ``first`` to ``last`` ('YYYY-MM').
+
+    The daily deltas of the scope are folded into segments of constant
+    occupancy, which are then cut at month boundaries. Capacity is the rooms'
+    current number of beds.
+    """
+    for period in (first, last):
+        if not re.fullmatch(r"\d{4}-(0[1-9]|1[0-2])", period):
+            raise ValueError(f"Период должен быть в формате ГГГГ-ММ: {period!r}")
+    if first > last:
+        raise ValueError(f"Начало периода {first} позже конца {last}")
+    where, params = _scope(building, floor, room_id)
+    rows = get_connection().execute(
+        f"""
+        WITH RECURSIVE months(start, end_excl) AS (
+            SELECT date(:first || '-01'), date(:first || '-01', '+1 month')
+            UNION ALL
+            SELECT end_excl, date(end_excl, '+1 month') FROM months WHERE end_excl <= date(:last || '-01')
+        ),
+        days AS (
+            SELECT d.day, SUM(d.delta) AS delta
+            FROM occupancy_deltas d
+            JOIN rooms r ON r.id = d.room_id
+            WHERE {where} AND d.day < (SELECT MAX(end_excl) FROM months)
+            GROUP BY d.day
+        ),
+        levels AS (
+            SELECT day, LEAD(day, 1, '9999-12-31') OVER (ORDER BY day) AS next_day,
+                   SUM(delta) OVER (ORDER BY day ROWS UNBOUNDED PRECEDING) AS occupied
+            FROM days
+        )
+        SELECT strftime('%Y-%m', m.start) AS period,
+               COALESCE(SUM(l.occupied * (julianday(MIN(l.next_day, m.end_excl)) - julianday(MAX(l.day, m.start)))), 0)
+                   AS bed_days,
+               CAST(julianday(m.end_excl) - julianday(m.start) AS INTEGER) AS days
+        FROM months m
+        LEFT JOIN levels l ON l.day < m.end_excl AND l.next_day > m.start
+        GROUP BY m.start
+        ORDER BY m.start
+        """,
+        {**params, "first": first, "last": last},
+    ).fetchall()
+    beds = capacity(building, floor, room_id)
+    return [MonthUtilization(row["period"], row["days"], beds, int(row["bed_days"])) for row in rows]
@@ -0,0 +1,391 @@
+import os
+import struct
+import zlib
+from functools import lru_cache
+from pathlib import Path
+
+A4 = (595.28, 841.89)
+
+FONT_CANDIDATES = (
+    "C:/Windows/Fonts/arial.ttf",
+    "C:/Windows/Fonts/tahoma.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/TTF/DejaVuSans.ttf",
+    "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf",
+    "/System/Library/Fonts/Supplemental/Arial.ttf",
+    "/Library/Fonts/Arial.ttf",
+)
+# What a PDF viewer needs of an embedded TrueType font; layout tables (GSUB, GPOS, kern) and names are dropped.
+SUBSET_TABLES = ("cvt ", "fpgm", "glyf", "head", "hhea", "hmtx", "loca", "maxp", "prep")
+
+
+class TrueTypeFont:
+    def __init__(self, path: Path | str):
+        self.path = Path(path)
+        self.data = self.path.read_bytes()
+        tables = {}
+        (num_tables,) = struct.unpack_from(">H", self.data, 4)
+        for i in range(num_tables):
+            tag, _, offset, length = struct.unpack_from(">4sLLL", self.data, 12 + 16 * i)
+            tables[tag.decode("latin-1")] = (offset, length)
+        self.tables = tables
+        for required in ("head", "hhea", "hmtx", "cmap"):
+            if required not in tables:
+                raise ValueError(f"{self.path}: нет таблицы {required}, это не TrueType-шрифт")
+
+        head = tables["head"][0]
+        (self.units_per_em,) = struct.unpack_from(">H", self.data, head + 18)
+        self.bbox = [self._scale(v) for v in struct.unpack_from(">hhhh", self.data, head + 36)]
+        hhea = tables["hhea"][0]
+        ascender, descender = struct.unpack_from(">hh", self.data, hhea + 4)
+        (metrics_count,) = struct.unpack_from(">H", self.data, hhea + 34)
+        self.ascent, self.descent = self._scale(ascender), self._scale(descender)
+
+        hmtx = tables["hmtx"][0]
+        self.advances = [struct.unpack_from(">H", self.data, hmtx + 4 * i)[0] for i in range(metrics_count)]
+        self.cmap = self._read_cmap(tables["cmap"][0])
+
+    def _scale(self, value: int) -> int:
+        return round(value * 1000 / self.units_per_em)
+
+    def _read_cmap(self, base: int) -> dict[int, int]:
+        (count,) = struct.unpack_from(">H", self.data, base + 2)
+        subtables = {}
+        for i in range(count):
+            platform, encoding, offset = struct.unpack_from(">HHL", self.data, base + 4 + 8 * i)
+            subtables[(platform, encoding)] = base + offset
+        for key in ((3, 10), (0, 4), (3, 1), (0, 3)):
+            if key in subtables:
+                offset = subtables[key]
+                (fmt,) = struct.unpack_from(">H", self.data, offset)
+                if fmt == 12:
+                    return self._cmap_format12(offset)
+                if fmt == 4:
+                    return self._cmap_format4(offset)
+        raise ValueError(f"{self.path}: нет Unicode-таблицы cmap")
+
+    def _cmap_format4(self, offset: int) -> dict[int, int]:
+        (seg_x2,) = struct.unpack_from(">H", self.data, offset + 6)
+        segs = seg_x2 // 2
+        ends = struct.unpack_from(f">{segs}H", self.data, offset + 14)
+        starts = struct.unpack_from(f">{segs}H", self.data, offset + 16 + seg_x2)
+        deltas = struct.unpack_from(f">{segs}h", self.data, offset + 16 + 2 * seg_x2)
+        range_base = offset + 16 + 3 * seg_x2
+        range_offsets = struct.unpack_from(f">{segs}H", self.data, range_base)
+        mapping = {}
+        for i in range(segs):
+            for code in range(starts[i], min(ends[i], 0xFFFE) + 1):
+                if range_offsets[i] == 0:
+                    glyph = (code + deltas[i]) & 0xFFFF
+                else:
+                    address = range_base + 2 * i + range_offsets[i] + 2 * (code - starts[i])
+                    (glyph,) = struct.unpack_from(">H", self.data, address)
+                    if glyph:
+                        glyph = (glyph + deltas[i]) & 0xFFFF
+                if glyph:
+                    mapping[code] = glyph
+        return mapping
+
+    def _cmap_format12(self, offset: int) -> dict[int, int]:
+        (groups,) = struct.unpack_from(">L", self.data, offset + 12)
+        mapping = {}
+        for i in range(groups):
+            start, end, glyph = struct.unpack_from(">LLL", self.data, offset + 16 + 12 * i)
+            for code in range(start, end + 1):
+                mapping[code] = glyph + code - start
+        return mapping
+
+    def glyph(self, char: str) -> int:
+        return self.cmap.get(ord(char), 0)
+
+    def advance(self, glyph: int) -> int:
+        return self._scale(self.advances[min(glyph, len(self.advances) - 1)])
+
+    def text_width(self, text: str, size: float) -> float:
+        return sum(self.advance(self.glyph(c)) for c in text) * size / 1000
+
+    @property
+    def can_subset(self) -> bool:
+        return "glyf" in self.tables and "loca" in self.tables
+
+    @lru_cache(maxsize=32)
+    def subset(self, glyphs: frozenset[int]) -> bytes:
+        """The font with outlines only for ``glyphs`` (plus .notdef and composite parts).
+
+        Glyph ids are kept, so the Identity CID mapping still holds: the other
+        outlines are just emptied. Fonts without ``glyf`` are returned whole.
+        """
+        if not self.can_subset:
+            return self.data
+        data = self.data
+        head = self.tables["head"][0]
+        (long_loca,) = struct.unpack_from(">h", data, head + 50)
+        loca, loca_length = self.tables["loca"]
+        count = loca_length // (4 if long_loca else 2) - 1
+        if long_loca:
+            offsets = struct.unpack_from(f">{count + 1}L", data, loca)
+        else:
+            offsets = [2 * v for v in struct.unpack_from(f">{count + 1}H", data, loca)]
+        glyf = self.tables["glyf"][0]
+
+        keep = {0} | {g for g in glyphs if g < count}
+        pending = list(keep)
+        while pending:
+            start, end = offsets[pending[-1]], offsets[pending.pop() + 1]
+            if end - start < 10 or struct.unpack_from(">h", data, glyf + start)[0] >= 0:
+                continue
+            pos = glyf + start + 10
+            while True:  # components of a composite glyph
+                flags, component = struct.unpack_from(">HH", data, pos)
+                if component not in keep:
+                    keep.add(component)
+                    pending.append(component)
+                pos += 8 if flags & 0x0001 else 6
+                pos += 2 if flags & 0x0008 else 4 if flags & 0x0040 else 8 if flags & 0x0080 else 0
+                if not flags & 0x0020:
+                    break
+
+        outlines = bytearray()
+        new_offsets = []
+        for g in range(count):
+            new_offsets.append(len(outlines))
+            if g in keep:
+                outlines += data[glyf + offsets[g]:glyf + offsets[g + 1]]
+                outlines += bytes(-len(outlines) % 4)
+        new_offsets.append(len(outlines))
+
+        hmtx, hmtx_length = self.tables["hmtx"]
+        metrics = bytearray(hmtx_length)  # viewers take widths from /W; zeros compress away
+        pairs = len(self.advances)
+        for g in keep:
+            # (advance, lsb) pairs come first, then bare lsb values for the remaining glyphs.
+            start = 4 * g if g < pairs else 4 * pairs + 2 * (g - pairs)
+            end = start + (4 if g < pairs else 2)
+            metrics[start:end] = data[hmtx + start:hmtx + end]
+
+        tables = {tag: data[o:o + n] for tag, (o, n) in self.tables.items() if tag in SUBSET_TABLES}
+        tables["hmtx"] = bytes(metrics)
+        tables["glyf"] = bytes(outlines)
+        tables["loca"] = struct.pack(f">{count + 1}L", *new_offsets)
+        # Zero checksum adjustment, long loca offsets.
+        tables["head"] = tables["head"][:8] + bytes(4) + tables["head"][12:50] + b"\0\1" + tables["head"][52:]
+        return _sfnt(tables)
+
+
+def find_font() -> Path:
+    override = os.environ.get("SKFU_PDF_FONT")
+    for candidate in ((override,) if override else ()) + FONT_CANDIDATES:
+        if Path(candidate).is_file():
+            return Path(candidate)
+    raise RuntimeError(
+        "Не найден TrueType-шрифт с кириллицей для PDF. Укажите путь к .ttf в переменной окружения SKFU_PDF_FONT."
+    )
+
+
+def _checksum(data: bytes) -> int:
+    data += bytes(-len(data) % 4)
+    return sum(struct.unpack(f">{len(data) // 4}L", data)) & 0xFFFFFFFF
+
+
+def _sfnt(tables: dict[str, bytes]) -> bytes:
+    count = len(tables)
+    selector = count.bit_length() - 1
+    header = struct.pack(">LHHHH", 0x00010000, count, 16 << selector, selector, 16 * count - (16 << selector))
+    offset = len(header) + 16 * count
+    directory, body, offsets = [], [], {}
+    for tag in sorted(tables):
+        table = tables[tag]
+        directory.append(struct.pack(">4sLLL", tag.encode("latin-1"), _checksum(table), offset, len(table)))
+        body.append(table + bytes(-len(table) % 4))
+        offsets[tag] = offset
+        offset += len(body[-1])
+    font = bytearray(header + b"".join(directory) + b"".join(body))
+    if "head" in offsets:
+        struct.pack_into(">L", font, offsets["head"] + 8, (0xB1B0AFBA - _checksum(bytes(font))) & 0xFFFFFFFF)
+    return bytes(font)
+
+
+@lru_cache(maxsize=4)
+def load_font(path: Path | str | None = None) -> TrueTypeFont:
+    return TrueTypeFont(path or find_font())
+
+
+class GlyphMap(dict):
+    """``str.translate`` table from characters to hex glyph ids, filled on first use of each character.
+
+    ``used`` collects the glyphs met so far (with a character for ToUnicode),
+    which is what the embedded font subset has to contain.
+    """
+
+    def __init__(self, font: TrueTypeFont):
+        super().__init__()
+        self.font = font
+        self.used: dict[int, str] = {}
+
+    def __missing__(self, code: int) -> str:
+        char = chr(code)
+        glyph = self.font.glyph(char)
+        if glyph:
+            self.used.setdefault(glyph, char)
+        hex_id = self[code] = f"{glyph:04X}"
+        return hex_id
+
+    def encode(self, text: str) -> str:
+        return "<" + text.translate(self) + ">"
+
+
+@lru_cache(maxsize=8)
+def _deflate(data: bytes) -> bytes:
+    # Batches of small files mostly embed the same subset.
+    return zlib.compress(data)
+
+
+def _pdf_string(value: str) -> str:
+    return "<FEFF" + value.encode("utf-16-be").hex().upper() + ">"
+
+
+class PdfWriter:
+    """Minimal streaming PDF writer: pages go to disk as soon as they are added.
+
+    Text is set in one embedded TrueType font (Identity-H encoding), which is
+    enough for Cyrillic reports and printable forms without extra dependencies.
+    """
+
+    def __init__(self, fh, font: TrueTypeFont | None = None, page_size: tuple[float, float] = A4, title: str = ""):
+        self.fh = fh
+        self.font = font or load_font()
+        self.page_size = page_size
+        self.title = title
+        self._offsets: dict[int, int] = {}
+        self._next_id = 1
+        self._catalog_id = self._reserve()
+        self._pages_id = self._reserve()
+        self._font_id = self._reserve()
+        self._page_ids: list[int] = []
+        self._glyphs = GlyphMap(self.font)
+        self._used = self._glyphs.used
+        self._write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    @property
+    def page_count(self) -> int:
+        return len(self._page_ids)
+
+    def _reserve(self) -> int:
+        obj_id = self._next_id
+        self._next_id += 1
+        return obj_id
+
+    def _write(self, data: bytes) -> None:
+        self.fh.write(data)
+
+    def _object(self, obj_id: int, body: bytes, stream: bytes | None = None) -> int:
+        self._offsets[obj_id] = self.fh.tell()
+        self._write(f"{obj_id} 0 obj\n".encode())
+        self._write(body)
+        if stream is not None:
+            self._write(b"\nstream\n" + stream + b"\nendstream")
+        self._write(b"\nendobj\n")
+        return obj_id
+
+    def encode(self, text: str) -> str:
+        return self._glyphs.encode(text)
+
+    def use_glyphs(self, used: dict[int, str]) -> None:
+        """Register glyphs that went into content encoded elsewhere (see ``add_content``)."""
+        for glyph, char in used.items():
+            self._used.setdefault(glyph, char)
+
+    def text_op(self, x: float, y: float, text: str, size: float = 10) -> str:
+        return f"BT /F1 {size:g} Tf {x:.2f} {y:.2f} Td {self.encode(text)} Tj ET"
+
+    def add_page(self, operations: list[str]) -> None:
+        self.add_content(zlib.compress("\n".join(operations).encode("latin-1")))
+
+    def add_content(self, content: bytes) -> None:
+        """Add a page from an already compressed content stream, e.g. one rendered in another process."""
+        content_id = self._object(
+            self._reserve(), f"<< /Length {len(content)} /Filter /FlateDecode >>".encode(), content
+        )
+        width, height = self.page_size
+        page_id = self._object(
+            self._reserve(),
+            (
+                f"<< /Type /Page /Parent {self._pages_id} 0 R /MediaBox [0 0 {width:.2f} {height:.2f}] "
+                f"/Resources << /Font << /F1 {self._font_id} 0 R >> >> /Contents {content_id} 0 R >>"
+            ).encode(),
+        )
+        self._page_ids.append(page_id)
+
+    def _write_font(self) -> None:
+        font = self.font
+        data = font.subset(frozenset(self._used))
+        packed = _deflate(data)
+        # A subset's name carries a six-letter tag (PDF 1.7, 9.6.4).
+        name = "SKFUSB+SKFUEmbedded" if font.can_subset else "SKFUEmbedded"
+        file_id = self._object(
+            self._reserve(),
+            f"<< /Length {len(packed)} /Length1 {len(data)} /Filter /FlateDecode >>".encode(),
+            packed,
+        )
+        descriptor_id = self._object(
+            self._reserve(),
+            (
+                f"<< /Type /FontDescriptor /FontName /{name} /Flags 32 /FontBBox [{' '.join(map(str, font.bbox))}] "
+                f"/ItalicAngle 0 /Ascent {font.ascent} /Descent {font.descent} /CapHeight {font.ascent} /StemV 80 "
+                f"/FontFile2 {file_id} 0 R >>"
+            ).encode(),
+        )
+        widths = " ".join(f"{g} [{font.advance(g)}]" for g in sorted(self._used))
+        cid_id = self._object(
+            self._reserve(),
+            (
+                f"<< /Type /Font /Subtype /CIDFontType2 /BaseFont /{name} "
+                f"/CIDSystemInfo << /Registry (Adobe) /Ordering (Identity) /Supplement 0 >> "
+                f"/FontDescriptor {descriptor_id} 0 R /CIDToGIDMap /Identity /W [{widths}] >>"
+            ).encode(),
+        )
+        to_unicode = self._to_unicode()
+        to_unicode_id = self._object(self._reserve(), f"<< /Length {len(to_unicode)} >>".encode(), to_unicode)
+        self._object(
+            self._font_id,
+            (
+                f"<< /Type /Font /Subtype /Type0 /BaseFont /{name} /Encoding /Identity-H "
+                f"/DescendantFonts [{cid_id} 0 R] /ToUnicode {to_unicode_id} 0 R >>"
+            ).encode(),
+        )
+
+    def _to_unicode(self) -> bytes:
+        lines = [
+            "/CIDInit /ProcSet findresource begin 12 dict begin begincmap",
+            "/CIDSystemInfo << /Registry (Adobe) /Ordering (UCS) /Supplement 0 >> def",
+            "/CMapName /Adobe-Identity-UCS def /CMapType 2 def",
+            "1 begincodespacerange <0000> <FFFF> endcodespacerange",
+        ]
+        items = sorted(self._used.items())
+        for i in range(0, len(items), 100):
+            chunk = items[i : i + 100]
+            lines.append(f"{len(chunk)} beginbfchar")
+            for glyph, char in chunk:
+                utf16 = char.encode("utf-16-be").hex().upper()
+                lines.append(f"<{glyph:04X}> <{utf16}>")
+            lines.append("endbfchar")
+        lines.append("endcmap CMapName currentdict /CMap defineresource pop end end")
+        return "\n".join(lines).encode("latin-1")
+
+    def close(self) -> None:
+        if not self._page_ids:
+            self.add_page([])
+        self._write_font()
+        kids = " ".join(f"{page_id} 0 R" for page_id in self._page_ids)
+        self._object(self._pages_id, f"<< /Type /Pages /Kids [{kids}] /Count {len(self._page_ids)} >>".encode())
+        info_id = self._object(self._reserve(), f"<< /Title {_pdf_string(self.title)} /Producer (SKFU) >>".encode())
+        self._object(self._catalog_id, f"<< /Type /Catalog /Pages {self._pages_id} 0 R >>".encode())
+        xref = self.fh.tell()
+        self._write(f"xref\n0 {self._next_id}\n0000000000 65535 f \n".encode())
+        for obj_id in range(1, self._next_id):
+            self._write(f"{self._offsets[obj_id]:010d} 00000 n \n".encode())
+        self._write(
+            f"trailer\n<< /Size {self._next_id} /Root {self._catalog_id} 0 R /Info {info_id} 0 R >>\n"
+            f"startxref\n{xref}\n%%EOF\n".encode()
+        )
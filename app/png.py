@@ -0,0 +1,146 @@
+import struct
+import zlib
+from itertools import accumulate
+from typing import BinaryIO, Iterator
+
+SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# Channels per color type: gray, RGB, palette index, gray + alpha, RGBA.
+CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+
+_low_byte = (255).__and__
+
+
+def _chunks(stream: BinaryIO) -> Iterator[tuple[bytes, bytes]]:
+    if stream.read(len(SIGNATURE)) != SIGNATURE:
+        raise ValueError("Файл не является изображением PNG")
+    while True:
+        head = stream.read(8)
+        if len(head) < 8:
+            raise ValueError("Изображение PNG обрезано")
+        length, kind = struct.unpack(">L4s", head)
+        data = stream.read(length)
+        stream.read(4)  # CRC: damage shows up as a zlib error in the image data anyway
+        yield kind, data
+        if kind == b"IEND":
+            return
+
+
+class PngReader:
+    """Row-by-row PNG decoder: memory use is one row, however large the image."""
+
+    def __init__(self, stream: BinaryIO):
+        self._chunks = _chunks(stream)
+        self.palette = b""
+        kind, data = next(self._chunks)
+        if kind != b"IHDR":
+            raise ValueError("Изображение PNG без заголовка")
+        self.width, self.height, self.depth, self.color, _, _, interlace = struct.unpack(">LLBBBBB", data)
+        if self.color not in CHANNELS or self.depth not in (8, 16) or interlace:
+            raise ValueError(f"Формат PNG не поддерживается: тип {self.color}, {self.depth} бит, чересстрочный {interlace}")
+        self.bpp = CHANNELS[self.color] * self.depth // 8
+        self.stride = self.width * self.bpp
+        for kind, data in self._chunks:
+            if kind == b"PLTE":
+                self.palette = data
+            elif kind == b"IDAT":
+                self._first_data = data
+                break
+        else:
+            raise ValueError("Изображение PNG без данных")
+
+    @property
+    def output_channels(self) -> int:
+        return 3 if self.color in (2, 3, 6) else 1
+
+    def rows(self) -> Iterator[bytes]:
+        """Unfiltered rows, top to bottom."""
+        decompressor = zlib.decompressobj()
+        pending = bytearray()
+        prev = bytes(self.stride)
+        # Masks for adding two rows bytewise in one big-integer operation (the Up filter).
+        low = int.from_bytes(b"\x7f" * self.stride, "little")
+        high = int.from_bytes(b"\x80" * self.stride, "little")
+        left = self.height
+        data = self._first_data
+        while left:
+            pending += decompressor.decompress(data)
+            while left and len(pending) > self.stride:
+                kind, line = pending[0], bytes(pending[1:self.stride + 1])
+                del pending[:self.stride + 1]
+                prev = self._unfilter(kind, line, prev, low, high)
+                left -= 1
+                yield prev
+            if not left:
+                break
+            kind, data = next(self._chunks)
+            if kind != b"IDAT":
+                raise ValueError("Изображение PNG обрезано")
+
+    def _unfilter(self, kind: int, line: bytes, prev: bytes, low: int, high: int) -> bytes:
+        bpp = self.bpp
+        if kind == 0:
+            return line
+        if kind == 1:
+            out = bytearray(line)
+            for lane in range(bpp):
+                out[lane::bpp] = bytes(map(_low_byte, accumulate(line[lane::bpp])))
+            return bytes(out)
+        if kind == 2:
+            a, b = int.from_bytes(line, "little"), int.from_bytes(prev, "little")
+            return (((a & low) + (b & low)) ^ ((a ^ b) & high)).to_bytes(len(line), "little")
+        out = bytearray(line)
+        n = len(out)
+        if kind == 3:
+            for i in range(bpp):
+                out[i] = (out[i] + prev[i] // 2) & 255
+            for i in range(bpp, n):
+                out[i] = (out[i] + (out[i - bpp] + prev[i]) // 2) & 255
+            return bytes(out)
+        if kind == 4:
+            # Left and upper-left are zero in the first pixel, so the predictor is the byte above.
+            for i in range(bpp):
+                out[i] = (out[i] + prev[i]) & 255
+            for i in range(bpp, n):
+                a, b, c = out[i - bpp], prev[i], prev[i - bpp]
+                pa, pb, pc = abs(b - c), abs(a - c), abs(a + b - c - c)
+                out[i] = (out[i] + (a if pa <= pb and pa <= pc else b if pb <= pc else c)) & 255
+            return bytes(out)
+        raise ValueError(f"Неизвестный фильтр строки PNG: {kind}")
+
+    def sample(self, row: bytes, columns: list[int]) -> bytes:
+        """Pixels at ``columns`` as 8-bit gray or RGB, transparency flattened onto white."""
+        step = self.depth // 8
+        out = bytearray()
+        for x in columns:
+            px = row[x * self.bpp:(x + 1) * self.bpp:step]
+            if self.color == 3:
+                px = self.palette[3 * px[0]:3 * px[0] + 3] or b"\0\0\0"
+            elif self.color in (4, 6):
+                alpha = px[-1]
+                px = bytes(c * alpha // 255 + 255 - alpha for c in px[:-1])
+            out += px
+        return bytes(out)
+
+
+def _chunk(kind: bytes, data: bytes) -> bytes:
+    return struct.pack(">L", len(data)) + kind + data + struct.pack(">L", zlib.crc32(kind + data))
+
+
+def encode(width: int, channels: int, rows: list[bytes]) -> bytes:
+    """8-bit gray (``channels`` = 1) or RGB PNG from unfiltered rows."""
+    header = struct.pack(">LLBBBBB", width, len(rows), 8, 0 if channels == 1 else 2, 0, 0, 0)
+    data = zlib.compress(b"".join(b"\0" + row for row in rows), 9)
+    return SIGNATURE + _chunk(b"IHDR", header) + _chunk(b"IDAT", data) + _chunk(b"IEND", b"")
+
+
+def thumbnail(stream: BinaryIO, size: int) -> bytes:
+    """A PNG at most ``size`` pixels on the long side, sampled from the PNG in ``stream``."""
+    reader = PngReader(stream)
+    step = max(1, -(-max(reader.width, reader.height) // size))
+    centre = step // 2
+    columns = [min(x + centre, reader.width - 1) for x in range(0, reader.width, step)]
+    rows = []
+    for y, row in enumerate(reader.rows()):
+        if y == min(y - y % step + centre, reader.height - 1):
+            rows.append(reader.sample(row, columns))
+    return encode(len(columns), reader.output_channels, rows)
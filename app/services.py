@@ -1,4 +1,10 @@
-from app.database import get_connection
+import re
+from datetime import date
+
+from app import audit
+from app.auth import role_permissions
+from app.cache import cached
+from app.database import BALANCES_FROM_HISTORY, ROOM_STATUSES, STUDENT_SEARCH_COLUMNS, get_connection, touch, transaction
 
 
 ROLE_PERMISSIONS = {
@@ -8,150 +14,280 @@ ROLE_PERMISSIONS = {
     "viewer": {"reports"},
 }
 
+SEARCH_LIMIT = 200
+
 
 def has_access(role: str, module: str) -> bool:
-    return module in ROLE_PERMISSIONS.get(role, set())
+    # Same lookup as AuthUser.can(), for callers that only have a role name.
+    return module in role_permissions(role)
 
 
-def add_student(data: dict) -> None:
-    conn = get_connection()
-    conn.execute(
-        """
-        INSERT INTO students (
-            full_name, birth_date, passport_data, phone, email, study_group,
-            faculty, study_mode, has_benefits, notes
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """,
-        (
-            data["full_name"],
-            data.get("birth_date"),
-            data.get("passport_data"),
-            data.get("phone"),
-            data.get("email"),
-            data.get("study_group"),
-            data.get("faculty"),
-            data.get("study_mode"),
-            int(data.get("has_benefits", False)),
-            data.get("notes"),
-        ),
-    )
-    conn.commit()
-    conn.close()
+def add_student(data: dict, actor=None) -> int:
+    with transaction() as conn:
+        touch("students")
+        student_id = conn.execute(
+            """
+            INSERT INTO students (
+                full_name, birth_date, passport_data, phone, email, study_group,
+                faculty, study_mode, has_benefits, notes
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                data["full_name"],
+                data.get("birth_date"),
+                data.get("passport_data"),
+                data.get("phone"),
+                data.get("email"),
+                data.get("study_group"),
+                data.get("faculty"),
+                data.get("study_mode"),
+                int(data.get("has_benefits", False)),
+                data.get("notes"),
+            ),
+        ).lastrowid
+    audit.record(actor, "create", "student", student_id, student_id, after=data)
+    return student_id
+
+
+@cached("students")
+def get_student(student_id: int):
+    return get_connection().execute("SELECT * FROM students WHERE id=?", (student_id,)).fetchone()
+
+
+def _fts_query(query: str) -> str:
+    return " ".join(f'"{token}"*' for token in re.findall(r"\w+", query))
+
 
+def _has_student_search(conn) -> bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name='students_fts'").fetchone() is not None
 
-def list_students(query: str = "") -> list:
+
+def _page(after: tuple | None, key: str, limit: int | None, descending: bool = False) -> tuple[str, str, list]:
+    where = f"({key}) {'<' if descending else '>'} ({', '.join('?' * len(after))})" if after else "1"
+    return where, "LIMIT ?", [*(after or ()), -1 if limit is None else limit]
+
+
+@cached("students")
+def list_students(query: str = "", limit: int | None = None, after: tuple | None = None) -> list:
+    """Students by name or, with ``query``, by search relevance; page with ``after=student_page_key(last_row)``."""
     conn = get_connection()
-    if query:
-        rows = conn.execute(
-            """
-            SELECT * FROM students
-            WHERE full_name LIKE ? OR study_group LIKE ?
-            ORDER BY full_name
+    if not query.strip():
+        where, limit_sql, params = _page(after, "full_name, id", limit)
+        return conn.execute(f"SELECT * FROM students WHERE {where} ORDER BY full_name, id {limit_sql}", params).fetchall()
+    limit = limit or SEARCH_LIMIT
+    if _has_student_search(conn):
+        match = _fts_query(query)
+        if not match:
+            return []
+        where, limit_sql, params = _page(after, "f.rank, st.id", limit)
+        return conn.execute(
+            f"""
+            SELECT st.*, f.rank AS rank FROM students_fts f
+            JOIN students st ON st.id = f.rowid
+            WHERE students_fts MATCH ? AND {where}
+            ORDER BY f.rank, st.id
+            {limit_sql}
             """,
-            (f"%{query}%", f"%{query}%"),
+            (match, *params),
         ).fetchall()
-    else:
-        rows = conn.execute("SELECT * FROM students ORDER BY full_name").fetchall()
-    conn.close()
-    return rows
+    pattern = f"%{query.strip().casefold()}%"
+    search = " OR ".join(f"casefold({column}) LIKE ?" for column in STUDENT_SEARCH_COLUMNS)
+    where, limit_sql, params = _page(after, "full_name, id", limit)
+    return conn.execute(
+        f"SELECT * FROM students WHERE ({search}) AND {where} ORDER BY full_name, id {limit_sql}",
+        (*[pattern] * len(STUDENT_SEARCH_COLUMNS), *params),
+    ).fetchall()
 
 
-def add_room(building: str, floor: int, room_number: str, total_beds: int, status: str = "free") -> None:
-    conn = get_connection()
-    conn.execute(
-        "INSERT INTO rooms(building, floor, room_number, total_beds, status) VALUES (?, ?, ?, ?, ?)",
-        (building, floor, room_number, total_beds, status),
+def student_page_key(row) -> tuple:
+    return (row["rank"], row["id"]) if "rank" in row.keys() else (row["full_name"], row["id"])
+
+
+def add_room(building: str, floor: int, room_number: str, total_beds: int, status: str = "free", actor=None) -> int:
+    if status not in ROOM_STATUSES:
+        raise ValueError(f"Недопустимый статус комнаты: {status!r}, доступны: {', '.join(ROOM_STATUSES)}")
+    with transaction() as conn:
+        touch("rooms")
+        room_id = conn.execute(
+            "INSERT INTO rooms(building, floor, room_number, total_beds, status) VALUES (?, ?, ?, ?, ?)",
+            (building, floor, room_number, total_beds, status),
+        ).lastrowid
+    audit.record(
+        actor, "create", "room", room_id,
+        after={"building": building, "floor": floor, "room_number": room_number, "total_beds": total_beds, "status": status},
     )
-    conn.commit()
-    conn.close()
+    return room_id
 
 
-def list_rooms() -> list:
-    conn = get_connection()
-    rows = conn.execute(
-        """
-        SELECT r.*, (
-            SELECT COUNT(*) FROM stays s WHERE s.room_id = r.id AND s.checkout_date IS NULL
-        ) AS occupied
+@cached("rooms")
+def list_rooms(limit: int | None = None, after: tuple | None = None) -> list:
+    where, limit_sql, params = _page(after, "r.building, r.floor, r.room_number, r.id", limit)
+    return get_connection().execute(
+        f"""
+        SELECT r.*
         FROM rooms r
-        ORDER BY building, floor, room_number
-        """
+        WHERE {where}
+        ORDER BY r.building, r.floor, r.room_number, r.id
+        {limit_sql}
+        """,
+        params,
     ).fetchall()
-    conn.close()
-    return rows
 
 
-def check_in(student_id: int, room_id: int, checkin_date: str) -> None:
-    conn = get_connection()
-    conn.execute(
+class OccupancyError(ValueError):
+    pass
+
+
+def _iso_date(value: str, what: str) -> str:
+    # Stay dates feed billing proration and occupancy history, so only plain YYYY-MM-DD gets in.
+    value = (value or "").strip()
+    try:
+        if not re.fullmatch(r"\d{4}-\d{2}-\d{2}", value):
+            raise ValueError
+        date.fromisoformat(value)
+    except ValueError:
+        raise OccupancyError(f"Некорректная дата {what}: {value!r}, нужен формат ГГГГ-ММ-ДД") from None
+    return value
+
+
+def _check_in(conn, student_id: int, room_id: int, checkin_date: str) -> int:
+    checkin_date = _iso_date(checkin_date, "заселения")
+    room = conn.execute("SELECT total_beds, occupied, status FROM rooms WHERE id=?", (room_id,)).fetchone()
+    if room is None:
+        raise OccupancyError(f"Комната {room_id} не найдена")
+    if room["status"] == "repair":
+        raise OccupancyError(f"Комната {room_id} на ремонте")
+    if room["occupied"] >= room["total_beds"]:
+        raise OccupancyError(f"В комнате {room_id} нет свободных мест")
+    if conn.execute("SELECT 1 FROM students WHERE id=?", (student_id,)).fetchone() is None:
+        raise OccupancyError(f"Студент {student_id} не найден")
+    if conn.execute("SELECT 1 FROM stays WHERE student_id=? AND checkout_date IS NULL", (student_id,)).fetchone():
+        raise OccupancyError(f"Студент {student_id} уже заселен")
+    # The stays triggers also update rooms.occupied and rooms.status.
+    touch("stays", "rooms")
+    return conn.execute(
         "INSERT INTO stays(student_id, room_id, checkin_date) VALUES (?, ?, ?)",
         (student_id, room_id, checkin_date),
-    )
-    conn.commit()
-    conn.close()
+    ).lastrowid
 
 
-def check_out(stay_id: int, checkout_date: str, reason: str) -> None:
-    conn = get_connection()
-    conn.execute(
-        "UPDATE stays SET checkout_date=?, checkout_reason=? WHERE id=?",
-        (checkout_date, reason, stay_id),
+def check_in(student_id: int, room_id: int, checkin_date: str, actor=None) -> int:
+    checkin_date = _iso_date(checkin_date, "заселения")
+    with transaction() as conn:
+        stay_id = _check_in(conn, student_id, room_id, checkin_date)
+    audit.record(actor, "check_in", "stay", stay_id, student_id, after={"room_id": room_id, "checkin_date": checkin_date})
+    return stay_id
+
+
+def check_in_many(assignments: list[tuple[int, int]], checkin_date: str, actor=None) -> int:
+    checkin_date = _iso_date(checkin_date, "заселения")
+    with transaction() as conn:
+        stay_ids = [_check_in(conn, student_id, room_id, checkin_date) for student_id, room_id in assignments]
+    for stay_id, (student_id, room_id) in zip(stay_ids, assignments):
+        audit.record(actor, "check_in", "stay", stay_id, student_id, after={"room_id": room_id, "checkin_date": checkin_date})
+    return len(assignments)
+
+
+def check_out(stay_id: int, checkout_date: str, reason: str, actor=None) -> None:
+    checkout_date = _iso_date(checkout_date, "выселения")
+    with transaction() as conn:
+        before = conn.execute(
+            "SELECT student_id, room_id, checkin_date FROM stays WHERE id=? AND checkout_date IS NULL", (stay_id,)
+        ).fetchone()
+        if before is None:
+            raise OccupancyError(f"Проживание {stay_id} не найдено или уже закрыто")
+        if checkout_date < before["checkin_date"]:
+            raise OccupancyError(f"Дата выселения {checkout_date} раньше даты заселения {before['checkin_date']}")
+        touch("stays", "rooms")
+        conn.execute(
+            "UPDATE stays SET checkout_date=?, checkout_reason=? WHERE id=?",
+            (checkout_date, reason, stay_id),
+        )
+    audit.record(
+        actor, "check_out", "stay", stay_id, before["student_id"],
+        before=dict(before), after={"checkout_date": checkout_date, "checkout_reason": reason},
     )
-    conn.commit()
-    conn.close()
 
 
-def current_stays() -> list:
-    conn = get_connection()
-    rows = conn.execute(
-        """
+@cached("stays", "students", "rooms")
+def current_stays(limit: int | None = None, after: tuple | None = None) -> list:
+    where, limit_sql, params = _page(after, "s.checkin_date, s.id", limit, descending=True)
+    return get_connection().execute(
+        f"""
         SELECT s.id, st.full_name, r.building, r.room_number, s.checkin_date
         FROM stays s
         JOIN students st ON st.id=s.student_id
         JOIN rooms r ON r.id=s.room_id
-        WHERE s.checkout_date IS NULL
-        ORDER BY s.checkin_date DESC
-        """
+        WHERE s.checkout_date IS NULL AND {where}
+        ORDER BY s.checkin_date DESC, s.id DESC
+        {limit_sql}
+        """,
+        params,
     ).fetchall()
-    conn.close()
-    return rows
 
 
-def add_charge(student_id: int, period: str, amount: float, benefit_discount: float = 0) -> None:
-    conn = get_connection()
-    conn.execute(
-        "INSERT INTO charges(student_id, period, amount, benefit_discount) VALUES (?, ?, ?, ?)",
-        (student_id, period, amount, benefit_discount),
+def add_charge(student_id: int, period: str, amount: float, benefit_discount: float = 0, actor=None) -> int:
+    with transaction() as conn:
+        charge_id = conn.execute(
+            "INSERT INTO charges(student_id, period, amount, benefit_discount) VALUES (?, ?, ?, ?)",
+            (student_id, period, amount, benefit_discount),
+        ).lastrowid
+    audit.record(
+        actor, "create", "charge", charge_id, student_id,
+        after={"period": period, "amount": amount, "benefit_discount": benefit_discount},
     )
-    conn.commit()
-    conn.close()
+    return charge_id
 
 
-def add_payment(student_id: int, payment_date: str, amount: float, method: str) -> None:
-    conn = get_connection()
-    conn.execute(
-        "INSERT INTO payments(student_id, payment_date, amount, method) VALUES (?, ?, ?, ?)",
-        (student_id, payment_date, amount, method),
+def add_payment(student_id: int, payment_date: str, amount: float, method: str, actor=None) -> int:
+    with transaction() as conn:
+        payment_id = conn.execute(
+            "INSERT INTO payments(student_id, payment_date, amount, method) VALUES (?, ?, ?, ?)",
+            (student_id, payment_date, amount, method),
+        ).lastrowid
+    audit.record(
+        actor, "create", "payment", payment_id, student_id,
+        after={"payment_date": payment_date, "amount": amount, "method": method},
     )
-    conn.commit()
-    conn.close()
+    return payment_id
 
 
-def debtors_report() -> list:
-    conn = get_connection()
-    rows = conn.execute(
-        """
-        SELECT st.id, st.full_name,
-               COALESCE((SELECT SUM(c.amount - c.benefit_discount) FROM charges c WHERE c.student_id=st.id), 0) AS total_charges,
-               COALESCE((SELECT SUM(p.amount) FROM payments p WHERE p.student_id=st.id), 0) AS total_payments
-        FROM students st
-        ORDER BY st.full_name
+def debtors_report(min_debt: float = 0, limit: int | None = None, after: tuple | None = None) -> list:
+    where, limit_sql, params = _page(after, "st.full_name, st.id", limit)
+    return get_connection().execute(
+        f"""
+        SELECT st.id, st.full_name, b.balance AS debt
+        FROM student_balances b
+        JOIN students st ON st.id = b.student_id
+        WHERE b.balance > 0 AND b.balance > ? AND {where}
+        ORDER BY st.full_name, st.id
+        {limit_sql}
+        """,
+        (min_debt, *params),
+    ).fetchall()
+
+
+def verify_balances() -> list:
+    return get_connection().execute(
+        f"""
+        SELECT student_id, SUM(stored) AS stored, SUM(actual) AS actual
+        FROM (
+            SELECT student_id, balance AS stored, 0 AS actual FROM student_balances
+            UNION ALL
+            SELECT student_id, 0, balance FROM ({BALANCES_FROM_HISTORY})
+        )
+        GROUP BY student_id
+        HAVING ABS(SUM(stored) - SUM(actual)) >= 0.005
+        ORDER BY student_id
         """
     ).fetchall()
-    conn.close()
-    result = []
-    for row in rows:
-        debt = float(row["total_charges"] or 0) - float(row["total_payments"] or 0)
-        if debt > 0:
-            result.append((row["full_name"], round(debt, 2)))
-    return result
+
+
+def rebuild_balances() -> int:
+    with transaction() as conn:
+        drift = len(verify_balances())
+        conn.execute("DELETE FROM student_balances")
+        conn.execute(
+            f"INSERT INTO student_balances (student_id, total_charges, total_payments, balance) {BALANCES_FROM_HISTORY}"
+        )
+    return drift
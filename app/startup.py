@@ -0,0 +1,33 @@
+import sys
+import time
+
+# Imported first by main.py, so the clock covers the remaining imports too.
+STARTED = time.perf_counter()
+
+enabled = False
+marks: list[tuple[float, str]] = []
+
+
+def mark(event: str) -> None:
+    """Record ``event`` with the milliseconds elapsed since the process started."""
+    elapsed = (time.perf_counter() - STARTED) * 1000
+    marks.append((elapsed, event))
+    if enabled:
+        print(f"{elapsed:8.1f} мс  {event}", file=sys.stderr)
+
+
+def on_first_frame(widget, event: str, then=None) -> None:
+    """Mark ``event`` when ``widget`` is first drawn on screen, then call ``then``."""
+    done = False
+
+    def exposed(_event):
+        nonlocal done
+        if done:
+            return
+        done = True
+        mark(event)
+        if then is not None:
+            then()
+
+    # unbind() would drop every <Expose> handler of the widget, so the flag guards instead.
+    widget.bind("<Expose>", exposed, add="+")
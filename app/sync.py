@@ -0,0 +1,481 @@
+import gzip
+import json
+import os
+import secrets
+import sqlite3
+import tempfile
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from urllib.parse import quote
+from urllib.request import Request, urlopen
+
+from app import audit
+from app.database import ROOM_STATUS_SQL, SYNC_TABLES, get_connection, sync_column, touch, transaction
+
+FORMAT = 1
+BATCH_LIMIT = 5000
+HTTP_TIMEOUT = 60
+BATCH_NAME = "{since:012d}-{upto:012d}.jsonl.gz"
+ACK_SUFFIX = ".ack.json"
+ORDER = {table: rank for rank, table in enumerate(SYNC_TABLES)}
+# Unique keys: a row created on two nodes with the same key is one row, and its changes are merged.
+NATURAL_KEYS = {"rooms": ("building", "room_number"), "charges": ("stay_id", "period")}
+
+
+class SyncError(Exception):
+    pass
+
+
+@dataclass
+class ApplyResult:
+    origin: str
+    upto: int
+    more: bool
+    applied: int = 0
+    skipped: int = 0
+    conflicts: int = 0
+
+
+def node_id(conn: sqlite3.Connection | None = None) -> str:
+    return (conn or get_connection()).execute("SELECT value FROM sync_state WHERE key = 'node'").fetchone()[0]
+
+
+def received_seq(peer: str, conn: sqlite3.Connection | None = None) -> int:
+    row = (conn or get_connection()).execute("SELECT received_seq FROM sync_peers WHERE peer = ?", (peer,)).fetchone()
+    return row[0] if row else 0
+
+
+def _base_origin(conn, table: str, local_id: int) -> str | None:
+    # Copies of copies have nested bases; the narrowest one covering the id is where the row was made.
+    row = conn.execute(
+        "SELECT origin FROM sync_bases WHERE tbl = ? AND max_id >= ? ORDER BY max_id LIMIT 1", (table, local_id)
+    ).fetchone()
+    return row[0] if row else None
+
+
+def _global_id(conn, table: str, local_id: int, node: str) -> list:
+    # A merged row may be known under several identities; any of them resolves to it on every node.
+    row = conn.execute(
+        "SELECT origin, origin_id FROM sync_ids WHERE tbl = ? AND local_id = ? ORDER BY origin, origin_id LIMIT 1",
+        (table, local_id),
+    ).fetchone()
+    if row:
+        return [row[0], row[1]]
+    return [_base_origin(conn, table, local_id) or node, local_id]
+
+
+def _local_id(conn, table: str, origin: str, origin_id: int, node: str) -> int | None:
+    if origin == node:
+        return origin_id
+    row = conn.execute(
+        "SELECT local_id FROM sync_ids WHERE tbl = ? AND origin = ? AND origin_id = ?", (table, origin, origin_id)
+    ).fetchone()
+    if row:
+        return row[0]
+    return origin_id if _base_origin(conn, table, origin_id) == origin else None
+
+
+def export_changes(since: int, peer: str | None = None, own_only: bool = False,
+                   limit: int = BATCH_LIMIT) -> tuple[dict, bytes]:
+    """Rows changed after local change #``since``, each in its latest state, as a gzip batch.
+
+    Several changes of one row collapse into one record, so a batch carries
+    deltas rather than history. Rows are identified by the node that created
+    them and their id there, foreign keys likewise. Changes made by ``peer``
+    itself are left out, and with ``own_only`` everything this node did not
+    make itself.
+    """
+    conn = get_connection()
+    # One read snapshot for the log and the rows it points to.
+    conn.execute("BEGIN")
+    try:
+        node = node_id(conn)
+        changes = conn.execute(
+            """
+            SELECT tbl, row_id, op, stamp, origin, MAX(seq) AS last_seq
+            FROM change_log
+            WHERE seq > ?
+            GROUP BY tbl, row_id
+            ORDER BY last_seq
+            LIMIT ?
+            """,
+            (since, limit),
+        ).fetchall()
+        more = len(changes) == limit
+        if more:
+            upto = changes[-1]["last_seq"]
+        else:
+            upto = conn.execute("SELECT COALESCE(MAX(seq), ?) FROM change_log", (since,)).fetchone()[0]
+        records = []
+        for change in changes:
+            if change["origin"] == peer or (own_only and change["origin"] != node):
+                continue
+            table = change["tbl"]
+            columns, refs = SYNC_TABLES[table]
+            record = {
+                "table": table,
+                "gid": _global_id(conn, table, change["row_id"], node),
+                "op": change["op"],
+                "stamp": change["stamp"],
+                "origin": change["origin"],
+            }
+            if change["op"] == "upsert":
+                select = ", ".join(f"{sync_column(table, c, 'r')} AS {c}" for c in columns)
+                row = conn.execute(f"SELECT {select} FROM {table} r WHERE id = ?", (change["row_id"],)).fetchone()
+                if row is None:
+                    continue
+                values = dict(row)
+                for column, parent in refs.items():
+                    if values[column] is not None:
+                        values[column] = _global_id(conn, parent, values[column], node)
+                record["row"] = values
+            records.append(record)
+    finally:
+        conn.execute("COMMIT")
+    header = {"format": FORMAT, "node": node, "since": since, "upto": upto, "more": more, "count": len(records)}
+    lines = [json.dumps(header)] + [json.dumps(r, ensure_ascii=False, separators=(",", ":")) for r in records]
+    return header, gzip.compress("\n".join(lines).encode("utf-8"), compresslevel=6)
+
+
+def read_batch(data: bytes) -> tuple[dict, list[dict]]:
+    try:
+        lines = gzip.decompress(data).decode("utf-8").split("\n")
+        header = json.loads(lines[0])
+        records = [json.loads(line) for line in lines[1:] if line]
+    except (OSError, EOFError, ValueError) as e:
+        raise SyncError(f"Поврежденный пакет изменений: {e}") from None
+    if not isinstance(header, dict):
+        raise SyncError("Поврежденный заголовок пакета изменений")
+    if header.get("format") != FORMAT:
+        raise SyncError(f"Неподдерживаемый формат пакета: {header.get('format')}")
+    if not (_is_text(header.get("node")) and _is_seq(header.get("since")) and _is_seq(header.get("upto"))
+            and isinstance(header.get("more"), bool) and header["since"] <= header["upto"]):
+        raise SyncError("Поврежденный заголовок пакета изменений")
+    for number, record in enumerate(records, 1):
+        if not _valid_record(record):
+            raise SyncError(f"Поврежденная запись #{number} в пакете изменений")
+    return header, records
+
+
+def _is_text(value) -> bool:
+    return isinstance(value, str) and value != ""
+
+
+def _is_seq(value) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 0
+
+
+def _is_gid(value) -> bool:
+    return isinstance(value, list) and len(value) == 2 and _is_text(value[0]) and _is_seq(value[1])
+
+
+def _valid_record(record) -> bool:
+    # Everything _apply() reads from a record, checked before any of it is written.
+    if not isinstance(record, dict) or record.get("table") not in SYNC_TABLES:
+        return False
+    if not (_is_gid(record.get("gid")) and _is_text(record.get("stamp")) and _is_text(record.get("origin"))):
+        return False
+    if record.get("op") == "delete":
+        return True
+    if record.get("op") != "upsert":
+        return False
+    columns, refs = SYNC_TABLES[record["table"]]
+    row = record.get("row")
+    return (
+        isinstance(row, dict) and all(c in row for c in columns)
+        and all(row[c] is None or _is_gid(row[c]) for c in refs)
+    )
+
+
+def _apply_order(record: dict) -> tuple:
+    # Parents are written before their children and deleted after them.
+    rank = ORDER[record["table"]]
+    return (1, -rank) if record["op"] == "delete" else (0, rank)
+
+
+def _conflict(conn, peer: str, record: dict, reason: str, result: ApplyResult) -> None:
+    conn.execute(
+        "INSERT INTO sync_conflicts (peer, tbl, origin, origin_id, reason, change_json) VALUES (?, ?, ?, ?, ?, ?)",
+        (peer, record["table"], *record["gid"], reason, json.dumps(record, ensure_ascii=False)),
+    )
+    result.conflicts += 1
+
+
+def _apply(conn, node: str, peer: str, record: dict, result: ApplyResult) -> None:
+    table, op = record["table"], record["op"]
+    columns, refs = SYNC_TABLES[table]
+    origin, origin_id = record["gid"]
+    local_id = _local_id(conn, table, origin, origin_id, node)
+    if op == "upsert":
+        values = dict(record["row"])
+        for column, parent in refs.items():
+            if values[column] is not None:
+                values[column] = _local_id(conn, parent, *values[column], node)
+                if values[column] is None:
+                    _conflict(conn, peer, record, f"нет связанной записи {parent} для {column}", result)
+                    return
+        key = NATURAL_KEYS.get(table)
+        if local_id is None and key and all(values[c] is not None for c in key):
+            match = conn.execute(
+                f"SELECT id FROM {table} WHERE " + " AND ".join(f"{c} = ?" for c in key), [values[c] for c in key]
+            ).fetchone()
+            if match is not None:
+                local_id = match[0]
+                conn.execute(
+                    "INSERT INTO sync_ids (tbl, origin, origin_id, local_id) VALUES (?, ?, ?, ?)",
+                    (table, origin, origin_id, local_id),
+                )
+    version = (record["stamp"], record["origin"])
+    if local_id is not None:
+        # Last writer wins; equal stamps are settled by node id, so every node picks the same change.
+        current = conn.execute(
+            "SELECT stamp, origin FROM change_log WHERE tbl = ? AND row_id = ? ORDER BY seq DESC LIMIT 1", (table, local_id)
+        ).fetchone()
+        if current is not None and tuple(current) >= version:
+            result.skipped += 1
+            return
+    if op == "delete":
+        if local_id is None:
+            result.skipped += 1
+            return
+        conn.execute(f"DELETE FROM {table} WHERE id = ?", (local_id,))
+    else:
+        exists = local_id is not None and conn.execute(f"SELECT 1 FROM {table} WHERE id = ?", (local_id,)).fetchone()
+        try:
+            if exists:
+                assignments = ", ".join(f"{c} = :{c}" for c in columns)
+                conn.execute(f"UPDATE {table} SET {assignments} WHERE id = :id", {**values, "id": local_id})
+            else:
+                # A row deleted here comes back under its old id; a new one gets the next id and a mapping.
+                names = ", ".join(("id", *columns))
+                placeholders = ", ".join(f":{c}" for c in ("id", *columns))
+                new_id = conn.execute(
+                    f"INSERT INTO {table} ({names}) VALUES ({placeholders})", {**values, "id": local_id}
+                ).lastrowid
+                if local_id is None:
+                    local_id = new_id
+                    conn.execute(
+                        "INSERT INTO sync_ids (tbl, origin, origin_id, local_id) VALUES (?, ?, ?, ?)",
+                        (table, origin, origin_id, local_id),
+                    )
+        except sqlite3.IntegrityError as e:
+            _conflict(conn, peer, record, str(e), result)
+            return
+        if table == "rooms":
+            conn.execute(f"UPDATE rooms SET status = {ROOM_STATUS_SQL} WHERE id = ?", (local_id,))
+    conn.execute(
+        "INSERT INTO change_log (tbl, row_id, op, stamp, origin) VALUES (?, ?, ?, ?, ?)", (table, local_id, op, *version)
+    )
+    result.applied += 1
+
+
+def apply_changes(data: bytes, actor=None) -> ApplyResult:
+    """Apply a batch from another node in one transaction and move that node's checkpoint to its end.
+
+    A batch that is already applied changes nothing; one that starts past the
+    checkpoint is refused, since the changes in between would be lost.
+    Changes that cannot be applied (a parent row that is missing, a
+    constraint the row breaks here) are skipped and kept in sync_conflicts.
+    """
+    header, records = read_batch(data)
+    peer = header["node"]
+    result = ApplyResult(peer, header["upto"], header["more"])
+    with transaction() as conn:
+        node = node_id(conn)
+        if peer == node:
+            raise SyncError("Пакет создан этим же узлом")
+        received = received_seq(peer, conn)
+        if header["since"] > received:
+            raise SyncError(
+                f"Пропущены изменения узла {peer}: получены до #{received}, пакет начинается после #{header['since']}"
+            )
+        if header["upto"] <= received:
+            return result
+        # Set inside the transaction, so the triggers of other connections never see it.
+        conn.execute("INSERT INTO sync_state (key, value) VALUES ('applying', ?)", (peer,))
+        for record in sorted(records, key=_apply_order):
+            _apply(conn, node, peer, record, result)
+        conn.execute("DELETE FROM sync_state WHERE key = 'applying'")
+        if records:
+            conn.execute(
+                """
+                INSERT INTO sync_state (key, value) VALUES ('clock', ?)
+                ON CONFLICT (key) DO UPDATE SET value = MAX(value, excluded.value)
+                """,
+                (max(r["stamp"] for r in records),),
+            )
+        conn.execute(
+            """
+            INSERT INTO sync_peers (peer, received_seq, last_sync) VALUES (?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT (peer) DO UPDATE SET received_seq = excluded.received_seq, last_sync = excluded.last_sync
+            """,
+            (peer, header["upto"]),
+        )
+        touch(*SYNC_TABLES)
+    if result.applied or result.conflicts:
+        audit.record(actor, "sync", "node", after=asdict(result))
+    return result
+
+
+def init_clone() -> str:
+    """Give a database copied from another node an identity of its own.
+
+    The rows it already has are recorded as the source node's (as a range
+    of ids per table), and the source's changes count as received, so
+    nothing is sent back and forth twice.
+    """
+    with transaction() as conn:
+        source = node_id(conn)
+        node = secrets.token_hex(6)
+        for table in SYNC_TABLES:
+            conn.execute(
+                f"INSERT OR REPLACE INTO sync_bases (tbl, origin, max_id) SELECT ?, ?, COALESCE(MAX(id), 0) FROM {table}",
+                (table, source),
+            )
+        conn.execute(
+            """
+            INSERT INTO sync_peers (peer, received_seq) VALUES (?, (SELECT COALESCE(MAX(seq), 0) FROM change_log))
+            ON CONFLICT (peer) DO UPDATE SET received_seq = excluded.received_seq
+            """,
+            (source,),
+        )
+        conn.execute("UPDATE sync_state SET value = ? WHERE key = 'node'", (node,))
+    return node
+
+
+def compact() -> int:
+    """Drop log entries superseded by a later change of the same row; batches only ever send the latest."""
+    with transaction() as conn:
+        return conn.execute(
+            "DELETE FROM change_log WHERE seq NOT IN (SELECT MAX(seq) FROM change_log GROUP BY tbl, row_id)"
+        ).rowcount
+
+
+def status() -> dict:
+    conn = get_connection()
+    return {
+        "node": node_id(conn),
+        "changes": conn.execute("SELECT COALESCE(MAX(seq), 0) FROM change_log").fetchone()[0],
+        "peers": conn.execute("SELECT peer, received_seq, last_sync FROM sync_peers ORDER BY peer").fetchall(),
+        "conflicts": conn.execute("SELECT COUNT(*) FROM sync_conflicts").fetchone()[0],
+    }
+
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    with tempfile.NamedTemporaryFile(dir=path.parent, delete=False) as tmp:
+        tmp.write(data)
+    os.replace(tmp.name, path)
+
+
+def _batch_files(directory: Path) -> list[tuple[int, int, Path]]:
+    files = []
+    for path in directory.glob("*.jsonl.gz"):
+        since, _, upto = path.name.removesuffix(".jsonl.gz").partition("-")
+        if since.isdigit() and upto.isdigit():
+            files.append((int(since), int(upto), path))
+    return sorted(files)
+
+
+def push_dir(directory: Path | str) -> int:
+    """Write this node's new changes into a shared folder; returns the number of batch files written.
+
+    Batches go to ``<folder>/<node>/``; each node that pulls leaves
+    ``<node>.ack.json`` with what it has received, and batches every node
+    has acknowledged are removed. Every node reads every folder, so only
+    changes made here are written, not ones received from others.
+    """
+    directory = Path(directory)
+    node = node_id()
+    out = directory / node
+    out.mkdir(parents=True, exist_ok=True)
+    acks = [
+        json.loads(path.read_text(encoding="utf-8")).get(node, 0)
+        for path in directory.glob("*" + ACK_SUFFIX)
+        if path.name != node + ACK_SUFFIX
+    ]
+    floor = min(acks, default=0)
+    files = _batch_files(out)
+    if files and files[0][0] <= floor:
+        start = files[-1][1]
+    else:
+        for _, _, path in files:
+            path.unlink()
+        files, start = [], floor
+    written = 0
+    while True:
+        header, data = export_changes(start, own_only=True)
+        if header["upto"] == start:
+            break
+        _write_atomic(out / BATCH_NAME.format(since=start, upto=header["upto"]), data)
+        written += 1
+        start = header["upto"]
+        if not header["more"]:
+            break
+    for _, upto, path in files:
+        if upto <= floor:
+            path.unlink()
+    return written
+
+
+def pull_dir(directory: Path | str, actor=None) -> list[ApplyResult]:
+    """Apply other nodes' batches from a shared folder and acknowledge them."""
+    directory = Path(directory)
+    node = node_id()
+    results = []
+    for origin in sorted(p for p in directory.iterdir() if p.is_dir() and p.name != node):
+        for _, upto, path in _batch_files(origin):
+            if upto > received_seq(origin.name):
+                results.append(apply_changes(path.read_bytes(), actor))
+    acks = {row["peer"]: row["received_seq"] for row in status()["peers"]}
+    _write_atomic(directory / (node + ACK_SUFFIX), json.dumps(acks).encode("utf-8"))
+    return results
+
+
+class _Remote:
+    def __init__(self, url: str, username: str, password: str):
+        self.url = url.rstrip("/")
+        self.token = None
+        self.token = json.loads(self.call("POST", "/api/login", {"username": username, "password": password}))["token"]
+
+    def call(self, method: str, path: str, body=None) -> bytes:
+        headers = {}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        if isinstance(body, bytes):
+            headers["Content-Type"] = "application/gzip"
+        elif body is not None:
+            body = json.dumps(body).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+        with urlopen(Request(self.url + path, body, headers, method=method), timeout=HTTP_TIMEOUT) as response:
+            return response.read()
+
+
+def sync_http(url: str, username: str, password: str, actor=None) -> tuple[list[ApplyResult], list[dict]]:
+    """Pull the server's changes, then push ours, through the HTTP API (``manage.py serve``)."""
+    remote = _Remote(url, username, password)
+    node = node_id()
+    try:
+        info = json.loads(remote.call("GET", f"/api/sync/checkpoint?peer={quote(node)}"))
+        pulled = []
+        while True:
+            since = received_seq(info["node"])
+            result = apply_changes(remote.call("GET", f"/api/sync/changes?since={since}&peer={quote(node)}"), actor)
+            pulled.append(result)
+            if not result.more:
+                break
+        pushed = []
+        since = info["received"]
+        while True:
+            header, data = export_changes(since, peer=info["node"])
+            if header["upto"] == since:
+                break
+            pushed.append(json.loads(remote.call("POST", "/api/sync/changes", data)))
+            since = header["upto"]
+            if not header["more"]:
+                break
+    finally:
+        try:
+            remote.call("POST", "/api/logout", {})
+        except OSError:
+            pass  # the session expires on the server anyway; keep the error that got us here
+    return pulled, pushed
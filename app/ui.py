@@ -1,15 +1,35 @@
 import tkinter as tk
 from datetime import date
-from tkinter import messagebox, ttk
+from tkinter import filedialog, messagebox, ttk
 
-from app import services
+from app import services, startup
 from app.auth import AuthUser
+from app.database import ROOM_STATUSES
+from app.jobs import JobRunner
+from app.widgets import LazyTable
+
+SEARCH_DELAY_MS = 300
+ALL_BUILDINGS = "Все"
+BACKUP_FIRST_CHECK_MS = 60 * 1000
+BACKUP_CHECK_MS = 60 * 60 * 1000
+POLL_FIRST_LOAD_MS = 20
+
+TABS = (
+    ("students", "Студенты", "students_tab"),
+    ("rooms", "Комнаты", "rooms_tab"),
+    ("stays", "Заселение", "stays_tab"),
+    ("finance", "Оплаты", "finance_tab"),
+    ("reports", "Отчеты", "reports_tab"),
+    ("admin", "Диагностика", "diagnostics_tab"),
+)
 
 
 class LoginWindow:
-    def __init__(self, root: tk.Tk, on_success):
+    def __init__(self, root: tk.Tk, on_success, jobs: JobRunner):
         self.root = root
         self.on_success = on_success
+        # Password hashing is deliberately slow, so it runs on the runner's worker.
+        self.jobs = jobs
         self.root.title("СКФУ Общежитие — Вход")
         self.root.geometry("380x190")
 
@@ -24,46 +44,144 @@ class LoginWindow:
         self.password = ttk.Entry(frm, show="*")
         self.password.grid(row=3, column=0, sticky="ew", pady=4)
 
-        ttk.Button(frm, text="Войти", command=self.try_login).grid(row=4, column=0, pady=10, sticky="e")
-        ttk.Label(frm, text="По умолчанию: admin / admin123", foreground="gray").grid(row=5, column=0, sticky="w")
+        # Logging in waits until main.py has prepared the schema in the background.
+        self.login_button = ttk.Button(frm, text="Войти", command=self.try_login, state="disabled")
+        self.login_button.grid(row=4, column=0, pady=10, sticky="e")
+        self.status = ttk.Label(frm, text="Проверка базы данных…", foreground="gray")
+        self.status.grid(row=5, column=0, sticky="w")
 
         frm.columnconfigure(0, weight=1)
 
+    def set_ready(self, _=None):
+        self.login_button.configure(state="normal")
+        self.status.configure(text="По умолчанию: admin / admin123")
+
+    def set_failed(self, error: Exception):
+        self.status.configure(text="База данных недоступна", foreground="red")
+        messagebox.showerror("Ошибка", str(error))
+
     def try_login(self):
         from app.auth import authenticate
 
-        user = authenticate(self.username.get().strip(), self.password.get())
-        if user is None:
-            messagebox.showerror("Ошибка", "Неверный логин или пароль")
+        if str(self.login_button.cget("state")) == "disabled":
             return
-        self.on_success(user)
+        self.login_button.configure(state="disabled")
+        self.status.configure(text="Проверка пароля…", foreground="gray")
+
+        def done(user):
+            if user is None:
+                self.set_ready()
+                messagebox.showerror("Ошибка", "Неверный логин или пароль")
+                return
+            self.on_success(user)
+
+        def failed(error):
+            # LoginThrottled carries the wait time in its message.
+            self.set_ready()
+            messagebox.showerror("Ошибка", str(error))
+
+        self.jobs.submit(authenticate, self.username.get().strip(), self.password.get(), on_done=done, on_error=failed)
 
 
 class MainApp:
-    def __init__(self, root: tk.Tk, user: AuthUser):
+    def __init__(self, root: tk.Tk, user: AuthUser, on_loaded=None):
         self.root = root
         self.user = user
         self.root.title(f"СКФУ Общежитие — {user.username} ({user.role})")
         self.root.geometry("1100x720")
+        self.root.protocol("WM_DELETE_WINDOW", self.close)
+
+        self.jobs = JobRunner(root, on_busy=self.set_busy, on_error=self.show_error)
+        # Uploads and downloads of scans get their own worker so lists keep loading meanwhile.
+        self.files = JobRunner(root, workers=1, on_error=self.show_error)
+        self._search_after = None
+        self._student_query = ""
+
+        status = ttk.Frame(root, padding=(8, 2))
+        status.pack(side="bottom", fill="x")
+        self.status_label = ttk.Label(status, text="")
+        self.status_label.pack(side="left")
+        self.progress = ttk.Progressbar(status, mode="indeterminate", length=120)
 
         self.nb = ttk.Notebook(root)
         self.nb.pack(fill="both", expand=True)
 
-        if services.has_access(user.role, "students"):
-            self.students_tab()
-        if services.has_access(user.role, "rooms"):
-            self.rooms_tab()
-        if services.has_access(user.role, "stays"):
-            self.stays_tab()
-        if services.has_access(user.role, "finance"):
-            self.finance_tab()
-        if services.has_access(user.role, "reports"):
-            self.reports_tab()
-
-    def students_tab(self):
-        tab = ttk.Frame(self.nb, padding=8)
-        self.nb.add(tab, text="Студенты")
-
+        # Tabs get an empty frame up front and their widgets on first selection.
+        self._pending_tabs: dict[str, tuple[str, str, ttk.Frame]] = {}
+        self._built_tabs: set[str] = set()
+        for name, title, builder in TABS:
+            if user.can(name):
+                tab = ttk.Frame(self.nb, padding=8)
+                self.nb.add(tab, text=title)
+                self._pending_tabs[str(tab)] = (name, builder, tab)
+        self.nb.bind("<<NotebookTabChanged>>", self.build_selected_tab)
+        self.root.after_idle(self.build_selected_tab)
+
+        self.on_loaded = on_loaded
+        startup.on_first_frame(self.nb, "первый кадр главного окна",
+                               then=lambda: self.root.after_idle(self._wait_first_load))
+
+        self._backup_after = None
+        if user.can("admin"):
+            self._backup_after = self.root.after(BACKUP_FIRST_CHECK_MS, self.scheduled_backup)
+
+    def build_selected_tab(self, _event=None):
+        current = self.nb.select()
+        if current not in self._pending_tabs:
+            return
+        name, builder, tab = self._pending_tabs.pop(current)
+        getattr(self, builder)(tab)
+        self._built_tabs.add(name)
+        startup.mark(f"вкладка {name} построена")
+
+    def load_after_render(self, table: LazyTable):
+        # The query starts once the freshly built tab has been drawn.
+        self.root.after_idle(table.reload)
+
+    def _wait_first_load(self):
+        if self.jobs.busy:
+            self.root.after(POLL_FIRST_LOAD_MS, self._wait_first_load)
+            return
+        startup.mark("данные первой вкладки загружены")
+        if self.on_loaded is not None:
+            self.on_loaded(self)
+
+    def close(self):
+        if self._backup_after is not None:
+            self.root.after_cancel(self._backup_after)
+        self.jobs.shutdown()
+        self.files.shutdown()
+        self.root.destroy()
+
+    def set_busy(self, busy: bool):
+        if busy:
+            self.status_label.configure(text="Загрузка…")
+            self.progress.pack(side="right")
+            self.progress.start(10)
+            self.root.configure(cursor="watch")
+        else:
+            self.status_label.configure(text="")
+            self.progress.stop()
+            self.progress.pack_forget()
+            self.root.configure(cursor="")
+
+    def show_error(self, error: Exception):
+        messagebox.showerror("Ошибка", str(error))
+
+    def scheduled_backup(self):
+        from app import backup
+
+        def done(result):
+            if result is not None:
+                self.status_label.configure(
+                    text=f"Резервная копия {result.path.name}: {result.db_bytes / (1 << 20):.1f} МБ, "
+                    f"{result.throughput:.1f} МБ/с"
+                )
+
+        self.jobs.submit(backup.snapshot_if_due, channel="backup", on_done=done)
+        self._backup_after = self.root.after(BACKUP_CHECK_MS, self.scheduled_backup)
+
+    def students_tab(self, tab: ttk.Frame):
         left = ttk.LabelFrame(tab, text="Добавить студента", padding=8)
         left.pack(side="left", fill="y")
         right = ttk.LabelFrame(tab, text="Список студентов", padding=8)
@@ -86,14 +204,20 @@ class MainApp:
         search_frame.pack(fill="x")
         self.student_search = ttk.Entry(search_frame)
         self.student_search.pack(side="left", fill="x", expand=True)
-        ttk.Button(search_frame, text="Поиск", command=self.refresh_students).pack(side="left", padx=4)
-
-        cols = ("id", "full_name", "group", "faculty", "phone")
-        self.students_tree = ttk.Treeview(right, columns=cols, show="headings")
-        for col, title in zip(cols, ["ID", "ФИО", "Группа", "Факультет", "Телефон"]):
-            self.students_tree.heading(col, text=title)
-        self.students_tree.pack(fill="both", expand=True, pady=6)
-        self.refresh_students()
+        self.student_search.bind("<KeyRelease>", self.schedule_search)
+        ttk.Button(search_frame, text="Поиск", command=self.search_students).pack(side="left", padx=4)
+        ttk.Button(search_frame, text="Документы…", command=self.show_documents).pack(side="left")
+
+        self.students_table = LazyTable(
+            right,
+            ("id", "full_name", "group", "faculty", "phone"),
+            ["ID", "ФИО", "Группа", "Факультет", "Телефон"],
+            fetch=self.fetch_students,
+            values=lambda row: (row["id"], row["full_name"], row["study_group"], row["faculty"], row["phone"]),
+            runner=self.jobs,
+        )
+        self.students_table.pack(fill="both", expand=True, pady=6)
+        self.load_after_render(self.students_table)
 
     def save_student(self):
         data = {k: v.get().strip() for k, v in self.student_entries.items()}
@@ -101,30 +225,161 @@ class MainApp:
             messagebox.showwarning("Проверка", "ФИО обязательно")
             return
         data["has_benefits"] = self.has_benefits.get()
-        services.add_student(data)
-        for v in self.student_entries.values():
-            v.delete(0, tk.END)
-        self.has_benefits.set(False)
-        self.refresh_students()
 
-    def refresh_students(self):
-        for item in self.students_tree.get_children():
-            self.students_tree.delete(item)
-        q = self.student_search.get().strip() if hasattr(self, "student_search") else ""
-        for row in services.list_students(q):
-            self.students_tree.insert("", tk.END, values=(row["id"], row["full_name"], row["study_group"], row["faculty"], row["phone"]))
+        def saved(_):
+            for v in self.student_entries.values():
+                v.delete(0, tk.END)
+            self.has_benefits.set(False)
+            self.refresh_students()
+
+        self.jobs.submit(services.add_student, data, self.user, on_done=saved)
 
-    def rooms_tab(self):
-        tab = ttk.Frame(self.nb, padding=8)
-        self.nb.add(tab, text="Комнаты")
+    def fetch_students(self, last, limit):
+        # Runs on a worker thread: use the query captured by search_students, not the widget.
+        return services.list_students(
+            self._student_query, limit=limit, after=services.student_page_key(last) if last else None
+        )
 
+    def schedule_search(self, _event=None):
+        if self._search_after is not None:
+            self.root.after_cancel(self._search_after)
+        self._search_after = self.root.after(SEARCH_DELAY_MS, self.search_students)
+
+    def search_students(self):
+        self._search_after = None
+        self._student_query = self.student_search.get().strip()
+        self.students_table.reload()
+
+    def show_documents(self):
+        from app import documents
+
+        selected = self.students_table.selection_values()
+        if not selected:
+            messagebox.showinfo("Документы", "Выберите студента в списке")
+            return
+        student_id, full_name = int(selected[0]), selected[1]
+        labels = {label: kind for kind, label in documents.KIND_LABELS.items()}
+
+        win = tk.Toplevel(self.root)
+        win.title(f"Документы — {full_name}")
+        win.geometry("760x420")
+        body = ttk.Frame(win, padding=8)
+        body.pack(fill="both", expand=True)
+        cols = ("kind", "file", "size", "added")
+        tree = ttk.Treeview(body, columns=cols, show="headings", selectmode="browse")
+        for c, h, w in zip(cols, ["Вид", "Файл", "Размер, КБ", "Добавлен"], [90, 260, 90, 140]):
+            tree.heading(c, text=h)
+            tree.column(c, width=w)
+        tree.pack(side="left", fill="both", expand=True)
+        preview = ttk.Label(body, text="", width=24, anchor="center")
+        preview.pack(side="left", fill="y", padx=8)
+
+        buttons = ttk.Frame(win, padding=8)
+        buttons.pack(fill="x")
+        kind = ttk.Combobox(buttons, values=list(labels), state="readonly", width=12)
+        kind.set(documents.KIND_LABELS["passport"])
+        kind.pack(side="left")
+        status = ttk.Label(buttons, text="")
+        status.pack(side="left", padx=8)
+        rows = {}
+
+        def fill(result):
+            if not win.winfo_exists():
+                return
+            tree.delete(*tree.get_children())
+            rows.clear()
+            for row in result:
+                iid = tree.insert("", tk.END, values=(
+                    documents.KIND_LABELS[row["kind"]], row["file_name"], f"{row['size'] / 1024:.0f}", row["created_at"],
+                ))
+                rows[iid] = row
+
+        def load(_=None):
+            self.jobs.submit(documents.list_documents, student_id, on_done=fill, channel="documents")
+
+        def selected_row():
+            selection = tree.selection()
+            return rows.get(selection[0]) if selection else None
+
+        def show_preview(path):
+            if not win.winfo_exists():
+                return
+            if path is None:
+                preview.configure(image="", text="Предпросмотр\nнедоступен")
+                return
+            preview.image = tk.PhotoImage(file=str(path))
+            preview.configure(image=preview.image, text="")
+
+        def on_select(_event):
+            row = selected_row()
+            if row is not None:
+                self.files.submit(documents.thumbnail, row["sha256"], on_done=show_preview, channel="thumbnail")
+
+        def track(action: str, progress: dict):
+            # The worker only writes the byte count; the label is updated from Tk's side.
+            if not win.winfo_exists():
+                return
+            if progress.get("done") is None:
+                status.configure(text=f"{action}: {progress['bytes'] / (1 << 20):.1f} МБ")
+                win.after(200, track, action, progress)
+            else:
+                status.configure(text="")
+
+        def run(action: str, fn, *args, on_done=None):
+            progress = {"bytes": 0}
+
+            def finished(result):
+                progress["done"] = True
+                if on_done is not None:
+                    on_done(result)
+
+            def failed(error):
+                progress["done"] = True
+                self.show_error(error)
+
+            self.files.submit(fn, *args, lambda done: progress.update(bytes=done), on_done=finished, on_error=failed)
+            track(action, progress)
+
+        def add():
+            path = filedialog.askopenfilename(
+                parent=win,
+                filetypes=[("Сканы", "*.pdf *.png *.jpg *.jpeg *.tif *.tiff"), ("Все файлы", "*.*")],
+            )
+            if path:
+                run("Загрузка", documents.attach, student_id, path, labels[kind.get()], self.user, on_done=load)
+
+        def save():
+            row = selected_row()
+            if row is None:
+                return
+            path = filedialog.asksaveasfilename(parent=win, initialfile=row["file_name"])
+            if path:
+                run("Сохранение", documents.save_copy, row["id"], path)
+
+        def detach():
+            row = selected_row()
+            if row is not None and messagebox.askyesno("Документы", f"Открепить {row['file_name']}?", parent=win):
+                self.jobs.submit(documents.detach, row["id"], self.user, on_done=load)
+
+        ttk.Button(buttons, text="Закрыть", command=win.destroy).pack(side="right")
+        ttk.Button(buttons, text="Открепить", command=detach).pack(side="right", padx=4)
+        ttk.Button(buttons, text="Сохранить как…", command=save).pack(side="right")
+        ttk.Button(buttons, text="Добавить…", command=add).pack(side="right", padx=4)
+        tree.bind("<<TreeviewSelect>>", on_select)
+        load()
+
+    def refresh_students(self):
+        if "students" in self._built_tabs:
+            self.students_table.refresh()
+
+    def rooms_tab(self, tab: ttk.Frame):
         frm = ttk.LabelFrame(tab, text="Добавить комнату", padding=8)
         frm.pack(fill="x")
         self.building = ttk.Entry(frm, width=16)
         self.floor = ttk.Entry(frm, width=6)
         self.room_number = ttk.Entry(frm, width=10)
         self.total_beds = ttk.Entry(frm, width=8)
-        self.status = ttk.Combobox(frm, values=["free", "partial", "full", "repair"], width=10)
+        self.status = ttk.Combobox(frm, values=list(ROOM_STATUSES), state="readonly", width=10)
         self.status.set("free")
 
         for i, (lbl, wid) in enumerate(
@@ -135,41 +390,41 @@ class MainApp:
 
         ttk.Button(frm, text="Сохранить", command=self.save_room).grid(row=0, column=10, padx=4)
 
-        cols = ("id", "building", "floor", "room", "beds", "occupied", "status")
-        self.rooms_tree = ttk.Treeview(tab, columns=cols, show="headings")
-        headers = ["ID", "Корпус", "Этаж", "Комната", "Мест", "Занято", "Статус"]
-        for c, h in zip(cols, headers):
-            self.rooms_tree.heading(c, text=h)
-        self.rooms_tree.pack(fill="both", expand=True, pady=8)
-        self.refresh_rooms()
+        self.rooms_table = LazyTable(
+            tab,
+            ("id", "building", "floor", "room", "beds", "occupied", "status"),
+            ["ID", "Корпус", "Этаж", "Комната", "Мест", "Занято", "Статус"],
+            fetch=lambda last, limit: services.list_rooms(
+                limit=limit, after=(last["building"], last["floor"], last["room_number"], last["id"]) if last else None
+            ),
+            values=lambda row: (
+                row["id"], row["building"], row["floor"], row["room_number"], row["total_beds"], row["occupied"], row["status"]
+            ),
+            runner=self.jobs,
+        )
+        self.rooms_table.pack(fill="both", expand=True, pady=8)
+        self.load_after_render(self.rooms_table)
 
     def save_room(self):
         try:
-            services.add_room(
+            args = (
                 self.building.get().strip(),
                 int(self.floor.get().strip()),
                 self.room_number.get().strip(),
                 int(self.total_beds.get().strip()),
                 self.status.get().strip(),
             )
-            self.refresh_rooms()
-        except Exception as e:
+        except ValueError as e:
             messagebox.showerror("Ошибка", str(e))
+            return
+        self.jobs.submit(services.add_room, *args, self.user, on_done=lambda _: self.refresh_rooms())
 
     def refresh_rooms(self):
-        for item in self.rooms_tree.get_children():
-            self.rooms_tree.delete(item)
-        for row in services.list_rooms():
-            self.rooms_tree.insert(
-                "",
-                tk.END,
-                values=(row["id"], row["building"], row["floor"], row["room_number"], row["total_beds"], row["occupied"], row["status"]),
-            )
-
-    def stays_tab(self):
-        tab = ttk.Frame(self.nb, padding=8)
-        self.nb.add(tab, text="Заселение")
+        # A tab that has not been opened yet loads fresh data when it is.
+        if "rooms" in self._built_tabs:
+            self.rooms_table.refresh()
 
+    def stays_tab(self, tab: ttk.Frame):
         top = ttk.LabelFrame(tab, text="Операции", padding=8)
         top.pack(fill="x")
 
@@ -185,48 +440,130 @@ class MainApp:
         ttk.Label(top, text="Дата").grid(row=0, column=4)
         self.stay_date.grid(row=0, column=5, padx=4)
         ttk.Button(top, text="Заселить", command=self.perform_checkin).grid(row=0, column=6, padx=4)
-
-        cols = ("id", "student", "building", "room", "checkin")
-        self.stays_tree = ttk.Treeview(tab, columns=cols, show="headings")
-        for c, h in zip(cols, ["ID", "Студент", "Корпус", "Комната", "Дата заселения"]):
-            self.stays_tree.heading(c, text=h)
-        self.stays_tree.pack(fill="both", expand=True, pady=8)
+        ttk.Button(top, text="Автораспределение…", command=self.preview_allocation).grid(row=0, column=7, padx=4)
+
+        self.stays_table = LazyTable(
+            tab,
+            ("id", "student", "building", "room", "checkin"),
+            ["ID", "Студент", "Корпус", "Комната", "Дата заселения"],
+            fetch=lambda last, limit: services.current_stays(
+                limit=limit, after=(last["checkin_date"], last["id"]) if last else None
+            ),
+            values=lambda row: (row["id"], row["full_name"], row["building"], row["room_number"], row["checkin_date"]),
+            runner=self.jobs,
+        )
+        self.stays_table.pack(fill="both", expand=True, pady=8)
 
         out = ttk.Frame(tab)
         out.pack(fill="x")
         self.checkout_reason = ttk.Entry(out)
         self.checkout_reason.pack(side="left", fill="x", expand=True)
         ttk.Button(out, text="Выселить выбранного", command=self.perform_checkout).pack(side="left", padx=4)
+        ttk.Button(out, text="Договоры…", command=self.print_contracts).pack(side="left")
 
-        self.refresh_stays()
+        self.load_after_render(self.stays_table)
 
     def perform_checkin(self):
         try:
-            services.check_in(int(self.stay_student_id.get()), int(self.stay_room_id.get()), self.stay_date.get())
-            self.refresh_stays()
-            self.refresh_rooms()
-        except Exception as e:
+            args = (int(self.stay_student_id.get()), int(self.stay_room_id.get()), self.stay_date.get())
+        except ValueError as e:
             messagebox.showerror("Ошибка", str(e))
+            return
+        self.jobs.submit(services.check_in, *args, self.user, on_done=self.after_stay_change)
+
+    def preview_allocation(self):
+        from app import allocation
+
+        checkin_date = self.stay_date.get().strip()
+        self.jobs.submit(allocation.preview, on_done=lambda plan: self.show_allocation(plan, checkin_date))
+
+    def show_allocation(self, plan, checkin_date: str):
+        from app import allocation
+
+        win = tk.Toplevel(self.root)
+        win.title("Автораспределение — предпросмотр")
+        win.geometry("760x520")
+        ttk.Label(
+            win,
+            text=f"Будет заселено: {len(plan.assignments)}, не хватило мест: {len(plan.unassigned)}, дата: {checkin_date}",
+            padding=8,
+        ).pack(anchor="w")
+        cols = ("student", "group", "building", "floor", "room")
+        tree = ttk.Treeview(win, columns=cols, show="headings")
+        for c, h in zip(cols, ["Студент", "Группа", "Корпус", "Этаж", "Комната"]):
+            tree.heading(c, text=h)
+        tree.pack(fill="both", expand=True, padx=8)
+        for a in plan.assignments[:1000]:
+            tree.insert("", tk.END, values=(a.full_name, a.study_group, a.building, a.floor, a.room_number))
+
+        def confirm():
+            win.destroy()
+            self.jobs.submit(allocation.commit, plan, checkin_date, self.user, on_done=self.after_stay_change)
+
+        buttons = ttk.Frame(win, padding=8)
+        buttons.pack(fill="x")
+        ttk.Button(buttons, text="Отмена", command=win.destroy).pack(side="right")
+        ttk.Button(buttons, text="Заселить всех", command=confirm, state="normal" if plan.assignments else "disabled").pack(
+            side="right", padx=4
+        )
+
+    def after_stay_change(self, _=None):
+        self.refresh_stays()
+        self.refresh_rooms()
 
     def refresh_stays(self):
-        for item in self.stays_tree.get_children():
-            self.stays_tree.delete(item)
-        for row in services.current_stays():
-            self.stays_tree.insert("", tk.END, values=(row["id"], row["full_name"], row["building"], row["room_number"], row["checkin_date"]))
+        if "stays" in self._built_tabs:
+            self.stays_table.refresh()
 
     def perform_checkout(self):
-        selected = self.stays_tree.selection()
+        selected = self.stays_table.selection_values()
         if not selected:
             return
-        stay_id = int(self.stays_tree.item(selected[0], "values")[0])
-        services.check_out(stay_id, date.today().isoformat(), self.checkout_reason.get().strip())
-        self.refresh_stays()
-        self.refresh_rooms()
+        stay_id = int(selected[0])
+        self.jobs.submit(
+            services.check_out, stay_id, date.today().isoformat(), self.checkout_reason.get().strip(), self.user,
+            on_done=self.after_stay_change,
+        )
+
+    def print_forms(self, kind: str, **filters):
+        from app import forms
+
+        path = filedialog.asksaveasfilename(
+            defaultextension=".pdf",
+            filetypes=[("PDF для печати", "*.pdf"), ("Архив: файл на студента", "*.zip")],
+        )
+        if not path:
+            return
 
-    def finance_tab(self):
-        tab = ttk.Frame(self.nb, padding=8)
-        self.nb.add(tab, text="Оплаты")
+        def done(result):
+            if not result.documents:
+                messagebox.showinfo("Печать", "Нет документов для печати")
+                return
+            messagebox.showinfo(
+                "Готово", f"Документов: {result.documents}, страниц: {result.pages}, файлов: {result.files}, {result.elapsed:.1f} с"
+            )
 
+        # Thousands of documents take a while: the file runner keeps the lists responsive meanwhile.
+        self.files.submit(lambda: forms.generate(kind, path, **filters), on_done=done)
+
+    def print_contracts(self):
+        selected = self.stays_table.selection_values()
+        if selected:
+            self.print_forms("contract", ids=[int(selected[0])])
+        else:
+            self.print_forms("contract", current=True)
+
+    def print_receipts(self):
+        filters = {"since": date.today().replace(day=1).isoformat()}
+        if self.pay_student.get().strip():
+            try:
+                filters["student_id"] = int(self.pay_student.get())
+            except ValueError as e:
+                messagebox.showerror("Ошибка", str(e))
+                return
+        self.print_forms("receipt", **filters)
+
+    def finance_tab(self, tab: ttk.Frame):
         charge = ttk.LabelFrame(tab, text="Начисление", padding=8)
         charge.pack(fill="x")
         self.charge_student = ttk.Entry(charge, width=10)
@@ -241,6 +578,7 @@ class MainApp:
             ttk.Label(charge, text=t).grid(row=0, column=i * 2)
             w.grid(row=0, column=i * 2 + 1, padx=4)
         ttk.Button(charge, text="Начислить", command=self.save_charge).grid(row=0, column=8, padx=4)
+        ttk.Button(charge, text="Начислить всем за период", command=self.run_billing).grid(row=0, column=9, padx=4)
 
         pay = ttk.LabelFrame(tab, text="Оплата", padding=8)
         pay.pack(fill="x", pady=6)
@@ -253,40 +591,246 @@ class MainApp:
             ttk.Label(pay, text=t).grid(row=0, column=i * 2)
             w.grid(row=0, column=i * 2 + 1, padx=4)
         ttk.Button(pay, text="Оплатить", command=self.save_payment).grid(row=0, column=6, padx=4)
+        ttk.Button(pay, text="Квитанции за месяц…", command=self.print_receipts).grid(row=0, column=7, padx=4)
 
     def save_charge(self):
         try:
-            services.add_charge(
+            args = (
                 int(self.charge_student.get()),
                 self.charge_period.get().strip(),
                 float(self.charge_amount.get()),
                 float(self.charge_discount.get() or 0),
             )
-            messagebox.showinfo("Готово", "Начисление добавлено")
-        except Exception as e:
+        except ValueError as e:
             messagebox.showerror("Ошибка", str(e))
+            return
+        self.jobs.submit(services.add_charge, *args, self.user, on_done=lambda _: messagebox.showinfo("Готово", "Начисление добавлено"))
+
+    def run_billing(self):
+        from app import billing
+
+        def done(result):
+            invalid = ""
+            if result.invalid_stays:
+                invalid = f"\nПропущены проживания с некорректными датами: {', '.join(map(str, result.invalid_stays[:20]))}"
+            messagebox.showinfo(
+                "Готово",
+                f"Период {result.period}: создано начислений {result.created}, "
+                f"уже было {result.already_billed}, сумма {result.total_amount:.2f}{invalid}",
+            )
+
+        self.jobs.submit(billing.run_billing, self.charge_period.get().strip(), self.user, on_done=done)
 
     def save_payment(self):
         try:
-            services.add_payment(int(self.pay_student.get()), date.today().isoformat(), float(self.pay_amount.get()), self.pay_method.get())
-            messagebox.showinfo("Готово", "Оплата зарегистрирована")
-        except Exception as e:
+            args = (int(self.pay_student.get()), date.today().isoformat(), float(self.pay_amount.get()), self.pay_method.get())
+        except ValueError as e:
             messagebox.showerror("Ошибка", str(e))
+            return
+        self.jobs.submit(services.add_payment, *args, self.user, on_done=lambda _: messagebox.showinfo("Готово", "Оплата зарегистрирована"))
 
-    def reports_tab(self):
-        tab = ttk.Frame(self.nb, padding=8)
-        self.nb.add(tab, text="Отчеты")
+    def reports_tab(self, tab: ttk.Frame):
+        top = ttk.Frame(tab)
+        top.pack(fill="x")
+        ttk.Button(top, text="Показать должников", command=self.show_debtors).pack(side="left")
+
+        self.export_reports = {
+            "Должники": "debtors",
+            "Текущие проживающие": "stays",
+            "Занятость комнат": "rooms",
+            "Выписка студента": "statement",
+            "Задолженность по срокам": "aging",
+        }
+        self.export_choice = ttk.Combobox(top, values=list(self.export_reports), state="readonly", width=24)
+        self.export_choice.set("Должники")
+        self.export_student = ttk.Entry(top, width=8)
+        ttk.Button(top, text="Экспорт…", command=self.export_report).pack(side="right")
+        self.export_student.pack(side="right", padx=4)
+        ttk.Label(top, text="ID студента").pack(side="right")
+        self.export_choice.pack(side="right", padx=4)
+
+        self.report_table = LazyTable(
+            tab,
+            ("student", "debt"),
+            ["Студент", "Задолженность"],
+            fetch=lambda last, limit: services.debtors_report(
+                limit=limit, after=(last["full_name"], last["id"]) if last else None
+            ),
+            values=lambda row: (row["full_name"], row["debt"]),
+            runner=self.jobs,
+        )
+        self.report_table.pack(fill="both", expand=True, pady=8)
+
+        box = ttk.LabelFrame(tab, text="Заполняемость", padding=6)
+        box.pack(fill="both", expand=True)
+        controls = ttk.Frame(box)
+        controls.pack(fill="x")
+        ttk.Label(controls, text="Корпус").pack(side="left")
+        self.occupancy_building = ttk.Combobox(controls, state="readonly", width=16, postcommand=self.load_buildings)
+        self.occupancy_building.set(ALL_BUILDINGS)
+        self.occupancy_building.pack(side="left", padx=4)
+        self.load_buildings()
+        ttk.Label(controls, text="Дата").pack(side="left")
+        self.occupancy_date = ttk.Entry(controls, width=12)
+        self.occupancy_date.insert(0, date.today().isoformat())
+        self.occupancy_date.pack(side="left", padx=4)
+        ttk.Button(controls, text="На дату", command=self.show_occupancy).pack(side="left", padx=4)
+        ttk.Button(controls, text="По месяцам за 3 года", command=self.show_utilization).pack(side="left")
+
+        self.occupancy_table = ttk.Treeview(box, columns=("place", "beds", "occupied", "share"), show="headings", height=8)
+        for col, title in zip(("place", "beds", "occupied", "share"), ("Корпус / этаж / месяц", "Мест", "Занято", "Загрузка")):
+            self.occupancy_table.heading(col, text=title)
+        self.occupancy_table.pack(fill="both", expand=True, pady=(6, 0))
+
+    def load_buildings(self):
+        # Runs again each time the list opens; new buildings show up from the next opening.
+        from app import occupancy
+
+        self.jobs.submit(
+            occupancy.buildings,
+            on_done=lambda names: self.occupancy_building.configure(values=[ALL_BUILDINGS, *names]),
+            channel="buildings",
+        )
+
+    def _occupancy_scope(self):
+        building = self.occupancy_building.get()
+        return None if building == ALL_BUILDINGS else building
+
+    def _fill_occupancy(self, rows):
+        self.occupancy_table.delete(*self.occupancy_table.get_children())
+        for place, beds, occupied in rows:
+            share = f"{occupied / beds:.0%}" if beds else "—"
+            self.occupancy_table.insert("", "end", values=(place, f"{beds:g}", f"{occupied:g}", share))
+
+    def show_occupancy(self):
+        from app import occupancy
+
+        day = self.occupancy_date.get().strip()
+        try:
+            date.fromisoformat(day)
+        except ValueError:
+            messagebox.showwarning("Проверка", "Дата должна быть в формате ГГГГ-ММ-ДД")
+            return
+        building = self._occupancy_scope()
+
+        def load():
+            rows = occupancy.snapshot(day, by="floor" if building else "building", building=building)
+            places = [f"{r['building']}, этаж {r['floor']}" if building else r["building"] for r in rows]
+            total = (building or "Всего", sum(r["beds"] for r in rows), sum(r["occupied"] for r in rows))
+            return [*zip(places, (r["beds"] for r in rows), (r["occupied"] for r in rows)), total]
+
+        self.jobs.submit(load, on_done=self._fill_occupancy, channel="occupancy")
+
+    def show_utilization(self):
+        from app import occupancy
+
+        today = date.today()
+        first = f"{today.year - 3:04d}-{today.month:02d}"
+        building = self._occupancy_scope()
 
-        ttk.Button(tab, text="Показать должников", command=self.show_debtors).pack(anchor="w")
+        def load():
+            # Beds taken on an average day of the month, so the columns read like the "На дату" view.
+            months = occupancy.monthly(first, today.isoformat()[:7], building=building)
+            return [(m.period, m.beds, round(m.average_occupied, 1)) for m in months]
 
-        cols = ("student", "debt")
-        self.report_tree = ttk.Treeview(tab, columns=cols, show="headings")
-        self.report_tree.heading("student", text="Студент")
-        self.report_tree.heading("debt", text="Задолженность")
-        self.report_tree.pack(fill="both", expand=True, pady=8)
+        self.jobs.submit(load, on_done=self._fill_occupancy, channel="occupancy")
 
     def show_debtors(self):
-        for item in self.report_tree.get_children():
-            self.report_tree.delete(item)
-        for full_name, debt in services.debtors_report():
-            self.report_tree.insert("", tk.END, values=(full_name, debt))
+        self.report_table.reload()
+
+    def export_report(self):
+        from app.export import export_report
+
+        report = self.export_reports[self.export_choice.get()]
+        student_id = None
+        if report == "statement":
+            try:
+                student_id = int(self.export_student.get())
+            except ValueError:
+                messagebox.showwarning("Проверка", "Укажите ID студента для выписки")
+                return
+        path = filedialog.asksaveasfilename(
+            defaultextension=".xlsx",
+            filetypes=[("Excel", "*.xlsx"), ("CSV", "*.csv"), ("PDF", "*.pdf")],
+        )
+        if not path:
+            return
+        self.jobs.submit(
+            export_report, report, path, None, student_id,
+            on_done=lambda count: messagebox.showinfo("Готово", f"Выгружено строк: {count}"),
+        )
+
+    def diagnostics_tab(self, tab: ttk.Frame):
+        from app import diagnostics
+
+        top = ttk.Frame(tab)
+        top.pack(fill="x")
+        self.trace_enabled = tk.BooleanVar(value=diagnostics.enabled())
+        ttk.Checkbutton(
+            top, text="Собирать статистику SQL-запросов", variable=self.trace_enabled, command=self.toggle_tracing
+        ).pack(side="left")
+        ttk.Label(top, text=f"медленные: от {diagnostics.SLOW_QUERY_MS:g} мс", foreground="gray").pack(side="left", padx=12)
+        ttk.Button(top, text="Сбросить", command=self.reset_diagnostics).pack(side="right")
+        ttk.Button(top, text="Обновить", command=self.show_diagnostics).pack(side="right", padx=4)
+
+        columns = ("count", "total", "mean", "p95", "max", "rows", "callers", "shape")
+        headings = ("Запросов", "Всего, мс", "Сред., мс", "p95 ≤, мс", "Макс., мс", "Строк", "Откуда", "Запрос")
+        self.query_stats = ttk.Treeview(tab, columns=columns, show="headings", height=12)
+        for col, title in zip(columns, headings):
+            self.query_stats.heading(col, text=title)
+            self.query_stats.column(col, width=80 if col not in ("callers", "shape") else 220, stretch=col == "shape")
+        self.query_stats.pack(fill="both", expand=True, pady=8)
+        self.query_stats.bind("<<TreeviewSelect>>", lambda _: self.show_query_details())
+
+        self.query_details = tk.Text(tab, height=12, wrap="word")
+        self.query_details.pack(fill="both", expand=True)
+        self.cache_stats = ttk.Label(tab, foreground="gray", justify="left")
+        self.cache_stats.pack(fill="x", pady=(8, 0))
+        self._query_stats = {}
+
+    def toggle_tracing(self):
+        from app import diagnostics
+
+        if self.trace_enabled.get():
+            diagnostics.enable()
+        else:
+            diagnostics.disable()
+
+    def reset_diagnostics(self):
+        from app import diagnostics
+
+        diagnostics.reset()
+        self.show_diagnostics()
+
+    def show_diagnostics(self):
+        from app import cache, diagnostics
+
+        self.cache_stats.config(text="Кэш чтения: " + "; ".join(
+            f"{s.name} — попаданий {s.hits}, промахов {s.misses} ({s.hit_rate:.0%}), записей {s.size}" for s in cache.stats()
+        ))
+
+        self.query_stats.delete(*self.query_stats.get_children())
+        self._query_stats = {}
+        for i, stats in enumerate(diagnostics.snapshot()):
+            item = str(i)
+            self._query_stats[item] = stats
+            self.query_stats.insert("", "end", iid=item, values=(
+                stats.count, f"{stats.total_ms:.1f}", f"{stats.mean_ms:.2f}", f"{stats.percentile_ms(0.95):.2f}",
+                f"{stats.max_ms:.2f}", stats.rows, ", ".join(sorted(stats.callers)), stats.shape[:300],
+            ))
+        self.query_details.delete("1.0", tk.END)
+        for query in reversed(list(diagnostics.slow_queries)):
+            self.query_details.insert(tk.END, f"{query.ms:.1f} мс — {query.caller}\n{diagnostics.query_shape(query.sql)}\n")
+            self.query_details.insert(tk.END, "".join(f"    {step}\n" for step in query.plan) + "\n")
+
+    def show_query_details(self):
+        from app import diagnostics
+
+        selected = self.query_stats.selection()
+        if not selected:
+            return
+        stats = self._query_stats[selected[0]]
+        bounds = [f"≤{b:g}" for b in diagnostics.BUCKETS_MS] + [f">{diagnostics.BUCKETS_MS[-1]:g}"]
+        histogram = "\n".join(f"{bound:>8} мс: {hits}" for bound, hits in zip(bounds, stats.histogram) if hits)
+        self.query_details.delete("1.0", tk.END)
+        self.query_details.insert(tk.END, f"{stats.shape}\n\nВызывается из: {', '.join(sorted(stats.callers))}\n\n{histogram}\n")
@@ -0,0 +1,140 @@
+import tkinter as tk
+from tkinter import ttk
+from typing import Callable
+
+PAGE_SIZE = 200
+PREFETCH_AT = 0.9
+# Rows kept in the Treeview at most: scrolling further would only grow the widget,
+# so past this point the table asks for a narrower search instead.
+MAX_ROWS = 2000
+
+
+class LazyTable(ttk.Frame):
+    """Treeview that loads rows page by page as the user scrolls.
+
+    ``fetch(last_row, limit)`` returns the next window of rows after
+    ``last_row`` (``None`` for the first page); ``values(row)`` gives the
+    cells to show and ``key(row)`` a stable identity used as the item id.
+    At most ``max_rows`` rows are loaded.
+    """
+
+    def __init__(
+        self,
+        master,
+        columns: tuple,
+        headings: list,
+        fetch: Callable,
+        values: Callable,
+        key: Callable = lambda row: row["id"],
+        page_size: int = PAGE_SIZE,
+        runner=None,
+        max_rows: int = MAX_ROWS,
+    ):
+        super().__init__(master)
+        self.runner = runner
+        self.fetch = fetch
+        self.values = values
+        self.key = key
+        self.page_size = page_size
+        self.max_rows = max_rows
+
+        self.tree = ttk.Treeview(self, columns=columns, show="headings")
+        for col, title in zip(columns, headings):
+            self.tree.heading(col, text=title)
+        self.scrollbar = ttk.Scrollbar(self, orient="vertical", command=self.tree.yview)
+        self.tree.configure(yscrollcommand=self._on_scroll)
+        self.tree.pack(side="left", fill="both", expand=True)
+        self.scrollbar.pack(side="right", fill="y")
+        self.capped_label = ttk.Label(
+            self, text=f"Показаны первые {max_rows} строк — уточните поиск", foreground="gray"
+        )
+
+        self._shown: dict[str, tuple] = {}
+        self._last_row = None
+        self._exhausted = False
+        self._loading = False
+
+    def selection_values(self) -> tuple | None:
+        selected = self.tree.selection()
+        return self._shown.get(selected[0]) if selected else None
+
+    def reload(self) -> None:
+        self.tree.delete(*self.tree.get_children())
+        self._shown.clear()
+        self._last_row = None
+        self._exhausted = False
+        self.capped_label.pack_forget()
+        self._request(None, self.page_size, self._append)
+
+    def refresh(self) -> None:
+        limit = min(max(self.page_size, len(self._shown)), self.max_rows)
+        self._request(None, limit, lambda rows: self.show_rows(rows, limit))
+
+    def load_more(self) -> None:
+        if self._exhausted or self._loading:
+            return
+        self._request(self._last_row, min(self.page_size, self.max_rows - len(self._shown)), self._append)
+
+    def _request(self, last, limit: int, apply: Callable) -> None:
+        self._loading = True
+        if self.runner is None:
+            try:
+                rows = self.fetch(last, limit)
+            finally:
+                self._loading = False
+            apply(rows)
+            return
+
+        def done(rows):
+            self._loading = False
+            apply(rows)
+
+        def failed(error):
+            self._loading = False
+            if self.runner.on_error is None:
+                raise error
+            self.runner.on_error(error)
+
+        # A reload/refresh supersedes whatever this table still has in flight.
+        self.runner.submit(self.fetch, last, limit, on_done=done, on_error=failed, channel=f"table-{id(self)}")
+
+    def _append(self, rows: list) -> None:
+        for row in rows:
+            iid = str(self.key(row))
+            self._shown[iid] = tuple(self.values(row))
+            self.tree.insert("", tk.END, iid=iid, values=self._shown[iid])
+        self._track(rows, self.page_size)
+
+    def show_rows(self, rows: list, limit: int | None = None) -> None:
+        wanted = {str(self.key(row)): tuple(self.values(row)) for row in rows}
+        stale = [iid for iid in self._shown if iid not in wanted]
+        if stale:
+            self.tree.delete(*stale)
+            for iid in stale:
+                del self._shown[iid]
+        for iid, values in wanted.items():
+            if iid not in self._shown:
+                self.tree.insert("", tk.END, iid=iid, values=values)
+            elif self._shown[iid] != values:
+                self.tree.item(iid, values=values)
+        self._shown = wanted
+        self._last_row = None
+        order = tuple(wanted)
+        if self.tree.get_children() != order:
+            self.tree.set_children("", *order)
+        self._track(rows, limit)
+
+    def _track(self, rows: list, limit: int | None) -> None:
+        if rows:
+            self._last_row = rows[-1]
+        self._exhausted = limit is None or len(rows) < limit
+        if not self._exhausted and len(self._shown) >= self.max_rows:
+            self._exhausted = True
+            self.capped_label.pack(side="bottom", fill="x", before=self.tree)
+        elif len(self._shown) < self.max_rows:
+            self.capped_label.pack_forget()
+
+    def _on_scroll(self, first: str, last: str) -> None:
+        self.scrollbar.set(first, last)
+        if float(last) >= PREFETCH_AT and not self._exhausted:
+            self.after_idle(self.load_more)
@@ -0,0 +1 @@
+"""Performance benchmarks for the services layer: ``python -m benchmarks --help``."""
@@ -0,0 +1,60 @@
+import argparse
+import json
+import sys
+from pathlib import Path
+
+from benchmarks import suite
+
+
+def cmd_run(args) -> int:
+    scales = [int(s) for s in args.scales.split(",")]
+    result = suite.run(scales, repeat=args.repeat, seed=args.seed, only=args.only, progress=print)
+    Path(args.output).write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"Результаты записаны в {args.output}")
+    if args.baseline:
+        return report(suite.compare(suite.load(args.baseline), result, args.threshold))
+    return 0
+
+
+def cmd_compare(args) -> int:
+    return report(suite.compare(suite.load(args.baseline), suite.load(args.current), args.threshold))
+
+
+def report(rows: list[dict]) -> int:
+    regressions = [row for row in rows if row["regression"]]
+    for row in rows:
+        mark = "  РЕГРЕССИЯ" if row["regression"] else ""
+        print(
+            f"{row['scale']:>8} {row['scenario']:<28} {row['metric']:<6} "
+            f"{row['before']:9.3f} -> {row['after']:9.3f} мс  x{row['ratio']:.2f}{mark}"
+        )
+    print(f"Сравнено: {len(rows)}, регрессий: {len(regressions)}")
+    return 1 if regressions else 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Замеры производительности сервисного слоя")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("run", help="прогнать набор сценариев")
+    p.add_argument("--scales", default=",".join(map(str, suite.DEFAULT_SCALES)), help="число студентов, через запятую")
+    p.add_argument("--repeat", type=int, default=suite.DEFAULT_REPEAT)
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--only", help="только сценарии, содержащие эту подстроку")
+    p.add_argument("-o", "--output", default="bench.json")
+    p.add_argument("--baseline", help="сразу сравнить с предыдущим прогоном")
+    p.add_argument("--threshold", type=float, default=0.2, help="допустимое замедление, доля (0.2 = 20%%)")
+    p.set_defaults(func=cmd_run)
+
+    p = sub.add_parser("compare", help="сравнить два прогона")
+    p.add_argument("baseline")
+    p.add_argument("current")
+    p.add_argument("--threshold", type=float, default=0.2)
+    p.set_defaults(func=cmd_compare)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,174 @@
+import math
+import random
+from dataclasses import dataclass
+from datetime import date, timedelta
+from pathlib import Path
+
+from app import billing, database
+from app.database import get_connection, transaction
+
+# Fixed so that the same seed gives the same database regardless of when it is built.
+REFERENCE_DATE = date(2025, 9, 1)
+MONTHLY_RATE = 3500.0
+BENEFIT_DISCOUNT = 0.5
+
+LAST_NAMES = (
+    "Иванов", "Петров", "Сидоров", "Кузнецов", "Смирнов", "Попов", "Васильев", "Соколов", "Михайлов", "Новиков",
+    "Федоров", "Морозов", "Волков", "Алексеев", "Лебедев", "Семенов", "Егоров", "Павлов", "Козлов", "Степанов",
+)
+MALE_NAMES = ("Александр", "Дмитрий", "Максим", "Сергей", "Андрей", "Алексей", "Артем", "Илья", "Кирилл", "Михаил")
+FEMALE_NAMES = ("Анна", "Мария", "Елена", "Дарья", "Алина", "Ирина", "Екатерина", "Арина", "Полина", "Ольга")
+PATRONYMICS = ("Александрович", "Сергеевич", "Дмитриевич", "Андреевич", "Игоревич", "Олегович", "Викторович")
+FACULTIES = {
+    "ИТ": "Институт цифрового развития",
+    "ЭК": "Институт экономики и управления",
+    "ЮР": "Юридический институт",
+    "МЕД": "Медико-биологический факультет",
+    "ИН": "Инженерный институт",
+    "ГУМ": "Гуманитарный институт",
+}
+PAYMENT_METHODS = ("Наличные", "Банковская карта", "Перевод")
+
+
+@dataclass
+class DatasetSize:
+    students: int
+    buildings: int
+    floors: int
+    rooms_per_floor: int
+    years: int
+
+    @classmethod
+    def for_students(cls, students: int, years: int = 3) -> "DatasetSize":
+        # About one bed per student; 85% of students live in the dormitory in a given year.
+        floors, rooms_per_floor, average_beds = 5, 20, 3
+        buildings = max(1, math.ceil(students / (floors * rooms_per_floor * average_beds)))
+        return cls(students, buildings, floors, rooms_per_floor, years)
+
+
+def _students(rng: random.Random, count: int) -> list[tuple]:
+    rows = []
+    codes = list(FACULTIES)
+    for i in range(count):
+        code = rng.choice(codes)
+        year = rng.randint(REFERENCE_DATE.year - 4, REFERENCE_DATE.year) % 100
+        last, patronymic = rng.choice(LAST_NAMES), rng.choice(PATRONYMICS)
+        if rng.random() < 0.5:
+            first = rng.choice(MALE_NAMES)
+        else:
+            first, last, patronymic = rng.choice(FEMALE_NAMES), last + "а", patronymic.replace("вич", "вна")
+        rows.append((
+            f"{last} {first} {patronymic}",
+            f"{rng.randint(1998, 2007)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            f"{rng.randint(1000, 9999)} {rng.randint(100000, 999999)}",
+            f"+7 9{rng.randint(10, 99)} {rng.randint(100, 999)}-{rng.randint(10, 99)}-{rng.randint(10, 99)}",
+            f"student{i + 1}@example.ru",
+            f"{code}-{year:02d}-{rng.randint(1, 4)}",
+            FACULTIES[code],
+            "очная" if rng.random() < 0.9 else "заочная",
+            int(rng.random() < 0.12),
+        ))
+    return rows
+
+
+def _rooms(rng: random.Random, size: DatasetSize) -> list[tuple]:
+    rows = []
+    for b in range(1, size.buildings + 1):
+        for floor in range(1, size.floors + 1):
+            for n in range(1, size.rooms_per_floor + 1):
+                status = "repair" if rng.random() < 0.02 else "free"
+                rows.append((f"Корпус {b}", floor, f"{floor}{n:02d}", rng.choice((2, 3, 3, 4)), status))
+    return rows
+
+
+def _stays(rng: random.Random, student_ids: list[int], rooms: list[tuple[int, int]], years: int) -> list[tuple]:
+    """One stay per resident per academic year; the current year's stays are open."""
+    rows = []
+    for offset in range(years, -1, -1):
+        start = REFERENCE_DATE.replace(year=REFERENCE_DATE.year - offset)
+        end = date(start.year + 1, 6, 30)
+        residents = [sid for sid in student_ids if rng.random() < 0.85]
+        rng.shuffle(residents)
+        beds = [room_id for room_id, total in rooms for _ in range(total)]
+        rng.shuffle(beds)
+        for student_id, room_id in zip(residents, beds):
+            checkin = start + timedelta(days=rng.randint(0, 20))
+            if offset == 0:
+                checkout, reason = None, None
+            elif rng.random() < 0.1:
+                checkout, reason = checkin + timedelta(days=rng.randint(30, 200)), "Отчисление"
+            else:
+                checkout, reason = end - timedelta(days=rng.randint(0, 20)), "Окончание учебного года"
+            rows.append((student_id, room_id, checkin.isoformat(), checkout and checkout.isoformat(), reason))
+    return rows
+
+
+def _months(first: date, last: date) -> list[str]:
+    periods = []
+    year, month = first.year, first.month
+    while (year, month) <= (last.year, last.month):
+        periods.append(f"{year:04d}-{month:02d}")
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return periods
+
+
+def _payments(rng: random.Random, charges: list) -> list[tuple]:
+    rows = []
+    for student_id, period, due in charges:
+        if rng.random() < 0.1:
+            continue
+        paid_on = date.fromisoformat(f"{period}-01") + timedelta(days=rng.randint(0, 40))
+        amount = due if rng.random() < 0.9 else round(due * rng.uniform(0.3, 0.9), 2)
+        rows.append((student_id, paid_on.isoformat(), amount, rng.choice(PAYMENT_METHODS)))
+    return rows
+
+
+def generate(path: Path | str, size: DatasetSize, seed: int = 1) -> dict[str, int]:
+    """Build a fresh database at ``path``; the same size and seed give the same data."""
+    path = Path(path)
+    for suffix in ("", "-wal", "-shm"):
+        Path(f"{path}{suffix}").unlink(missing_ok=True)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    database.DB_PATH = path
+    database.init_db()
+    rng = random.Random(seed)
+
+    with transaction() as conn:
+        conn.executemany(
+            """
+            INSERT INTO students (full_name, birth_date, passport_data, phone, email, study_group,
+                                  faculty, study_mode, has_benefits)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            _students(rng, size.students),
+        )
+        conn.executemany(
+            "INSERT INTO rooms (building, floor, room_number, total_beds, status) VALUES (?, ?, ?, ?, ?)",
+            _rooms(rng, size),
+        )
+        student_ids = [row[0] for row in conn.execute("SELECT id FROM students ORDER BY id")]
+        rooms = [tuple(row) for row in conn.execute("SELECT id, total_beds FROM rooms WHERE status != 'repair' ORDER BY id")]
+        conn.executemany(
+            "INSERT INTO stays (student_id, room_id, checkin_date, checkout_date, checkout_reason) VALUES (?, ?, ?, ?, ?)",
+            _stays(rng, student_ids, rooms, size.years),
+        )
+
+    first = REFERENCE_DATE.replace(year=REFERENCE_DATE.year - size.years)
+    billing.set_tariff(first.isoformat(), MONTHLY_RATE, BENEFIT_DISCOUNT)
+    with transaction():
+        for period in _months(first, REFERENCE_DATE):
+            billing.run_billing(period)
+    charges = get_connection().execute(
+        "SELECT student_id, period, ROUND(amount - benefit_discount, 2) FROM charges ORDER BY id"
+    ).fetchall()
+    with transaction() as conn:
+        conn.executemany(
+            "INSERT INTO payments (student_id, payment_date, amount, method) VALUES (?, ?, ?, ?)",
+            _payments(rng, charges),
+        )
+    conn = get_connection()
+    conn.execute("ANALYZE")
+    return {
+        table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        for table in ("students", "rooms", "stays", "charges", "payments")
+    }
@@ -0,0 +1,45 @@
+"""Throughput of the printable forms, in documents per second.
+
+    python -m benchmarks.forms --students 10000 --workers 1 4
+
+Contracts are printed for all current residents and receipts for the payments
+since ``--since``, each as one print file and as a per-student archive.
+"""
+import argparse
+import os
+import tempfile
+from pathlib import Path
+
+from app import database, forms
+from app.database import close_all
+from benchmarks.suite import dataset
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.forms", description="Скорость печати договоров и квитанций")
+    parser.add_argument("--students", type=int, default=10_000, help="размер набора данных")
+    parser.add_argument("--kind", nargs="+", choices=list(forms.FORMS), default=list(forms.FORMS))
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, os.cpu_count() or 1], help="числа процессов")
+    parser.add_argument("--since", default="2025-09-01", help="квитанции по оплатам с этой даты")
+    args = parser.parse_args(argv)
+
+    database.DB_PATH = dataset(args.students, seed=1)
+    database.init_db()
+    filters = {"contract": {"current": True}, "receipt": {"since": args.since}}
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            for kind in args.kind:
+                for suffix in ("pdf", "zip"):
+                    for workers in dict.fromkeys(args.workers):
+                        result = forms.generate(kind, Path(tmp) / f"{kind}.{suffix}", workers=workers, **filters[kind])
+                        print(
+                            f"{kind:<9} {suffix}  процессов {result.workers:>2}: {result.documents:>6} док. "
+                            f"за {result.elapsed:6.2f} с  {result.per_second:7.0f} док/с  {result.size / (1 << 20):7.1f} МБ"
+                        )
+    finally:
+        close_all()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
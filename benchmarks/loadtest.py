@@ -0,0 +1,143 @@
+"""Load test for the HTTP API: many keep-alive clients hitting list endpoints.
+
+    python -m benchmarks.loadtest --clients 32 --duration 10
+    python -m benchmarks.loadtest --url http://host:8080 --password ...
+
+Without ``--url`` a server is started in-process on the benchmark dataset.
+"""
+import argparse
+import http.client
+import json
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from app import api, audit, auth, database
+from benchmarks.suite import dataset, percentile
+
+PATHS = (
+    "/api/students?limit=50",
+    "/api/rooms?limit=50",
+    "/api/stays?limit=50",
+    "/api/reports/debtors?limit=50",
+)
+WRITE_PATH = "/api/payments"
+
+
+def _login(host: str, port: int, username: str, password: str) -> str:
+    conn = http.client.HTTPConnection(host, port, timeout=30)
+    conn.request("POST", "/api/login", json.dumps({"username": username, "password": password}),
+                 {"Content-Type": "application/json"})
+    response = conn.getresponse()
+    body = json.loads(response.read())
+    conn.close()
+    if response.status != 200:
+        raise SystemExit(f"Вход не выполнен: {response.status} {body.get('error')}")
+    return body["token"]
+
+
+def _client(host: str, port: int, token: str, deadline: float, write_every: int, etag: bool,
+            latencies: list[float], statuses: dict[int, int], lock: threading.Lock, offset: int) -> None:
+    conn = http.client.HTTPConnection(host, port, timeout=30)
+    headers = {"Authorization": f"Bearer {token}"}
+    tags: dict[str, str] = {}
+    local, counts, n = [], {}, offset
+    while time.perf_counter() < deadline:
+        n += 1
+        started = time.perf_counter()
+        if write_every and n % write_every == 0:
+            body = json.dumps({"student_id": 1, "payment_date": "2025-09-15", "amount": 1, "method": "loadtest"})
+            conn.request("POST", WRITE_PATH, body, {**headers, "Content-Type": "application/json"})
+        else:
+            path = PATHS[n % len(PATHS)]
+            extra = {"If-None-Match": tags[path]} if etag and path in tags else {}
+            conn.request("GET", path, headers={**headers, **extra})
+        response = conn.getresponse()
+        response.read()
+        local.append((time.perf_counter() - started) * 1000)
+        counts[response.status] = counts.get(response.status, 0) + 1
+        if etag and response.getheader("ETag"):
+            tags[path] = response.getheader("ETag")
+    conn.close()
+    with lock:
+        latencies.extend(local)
+        for status, count in counts.items():
+            statuses[status] = statuses.get(status, 0) + count
+
+
+def run(url: str, username: str, password: str, clients: int, duration: float, write_every: int = 0,
+        etag: bool = False) -> dict:
+    parts = urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+    token = _login(host, port, username, password)
+    latencies: list[float] = []
+    statuses: dict[int, int] = {}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+    threads = [
+        threading.Thread(target=_client, args=(host, port, token, deadline, write_every, etag, latencies, statuses, lock, i))
+        for i in range(clients)
+    ]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    return {
+        "clients": clients,
+        "requests": len(latencies),
+        "rps": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 0.5) if latencies else 0.0,
+        "p95_ms": percentile(latencies, 0.95) if latencies else 0.0,
+        "p99_ms": percentile(latencies, 0.99) if latencies else 0.0,
+        "statuses": statuses,
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.loadtest", description="Нагрузочный тест HTTP API")
+    parser.add_argument("--url", help="адрес работающего сервера (иначе запускается встроенный)")
+    parser.add_argument("--username", default="admin")
+    parser.add_argument("--password", default="admin123")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 8, 32], help="числа одновременных клиентов")
+    parser.add_argument("--duration", type=float, default=5, help="длительность каждого прогона, с")
+    parser.add_argument("--write-every", type=int, default=0, help="каждый N-й запрос клиента — запись оплаты")
+    parser.add_argument("--etag", action="store_true", help="повторять запросы с If-None-Match")
+    parser.add_argument("--students", type=int, default=10_000, help="размер набора данных встроенного сервера")
+    parser.add_argument("--readers", type=int, default=api.DEFAULT_READERS)
+    args = parser.parse_args(argv)
+
+    server = None
+    url = args.url
+    tmp = tempfile.TemporaryDirectory()
+    if url is None:
+        # A copy, so that logins and payments do not change the cached benchmark dataset.
+        database.DB_PATH = Path(tmp.name) / "loadtest.db"
+        shutil.copyfile(dataset(args.students, seed=1), database.DB_PATH)
+        database.init_db()
+        auth.ensure_default_admin()
+        server = api.ApiServer(("127.0.0.1", 0), readers=args.readers)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        print(f"{'клиентов':>8} {'запросов':>9} {'запр/с':>9} {'p50, мс':>9} {'p95, мс':>9} {'p99, мс':>9}  коды")
+        for clients in args.clients:
+            r = run(url, args.username, args.password, clients, args.duration, args.write_every, args.etag)
+            print(f"{r['clients']:>8} {r['requests']:>9} {r['rps']:>9.0f} {r['p50_ms']:>9.2f} {r['p95_ms']:>9.2f} "
+                  f"{r['p99_ms']:>9.2f}  {r['statuses']}")
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+            audit.flush()
+            database.close_all()
+        tmp.cleanup()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,188 @@
+import json
+import platform
+import sqlite3
+import statistics
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable
+
+from app import allocation, audit, database, finance, occupancy, services
+from app.database import close_all, get_connection
+from benchmarks.datagen import DatasetSize, generate
+
+DEFAULT_SCALES = (1_000, 10_000)
+DEFAULT_REPEAT = 30
+PAGE = 200
+DATA_DIR = Path(__file__).resolve().parent / "data"
+
+
+@dataclass
+class Scenario:
+    name: str
+    run: Callable[[dict], object]
+    writes: bool = False
+
+
+def _context() -> dict:
+    """Keys and parameters the scenarios use, picked from the generated data."""
+    conn = get_connection()
+    middle = conn.execute(
+        "SELECT full_name, id FROM students ORDER BY full_name, id LIMIT 1 OFFSET (SELECT COUNT(*) / 2 FROM students)"
+    ).fetchone()
+    room = conn.execute("SELECT building, floor, room_number, id FROM rooms ORDER BY building, floor, room_number, id "
+                        "LIMIT 1 OFFSET (SELECT COUNT(*) / 2 FROM rooms)").fetchone()
+    stay = conn.execute("SELECT checkin_date, id FROM stays WHERE checkout_date IS NULL ORDER BY checkin_date DESC, id DESC "
+                        "LIMIT 1 OFFSET (SELECT COUNT(*) / 2 FROM stays WHERE checkout_date IS NULL)").fetchone()
+    debtor = conn.execute("SELECT st.full_name, st.id FROM student_balances b JOIN students st ON st.id = b.student_id "
+                          "WHERE b.balance > 0 ORDER BY st.full_name, st.id LIMIT 1").fetchone()
+    pending = conn.execute(
+        "SELECT id FROM students st WHERE NOT EXISTS (SELECT 1 FROM stays s WHERE s.student_id = st.id "
+        "AND s.checkout_date IS NULL) LIMIT 1"
+    ).fetchone()
+    free_room = conn.execute("SELECT id FROM rooms WHERE status != 'repair' AND occupied < total_beds LIMIT 1").fetchone()
+    return {
+        "student_after": tuple(middle),
+        "room_after": tuple(room),
+        "stay_after": tuple(stay) if stay else None,
+        "debtor_after": tuple(debtor) if debtor else None,
+        "student_id": pending["id"] if pending else middle["id"],
+        "free_room_id": free_room["id"] if free_room else None,
+        "last_name": middle["full_name"].split()[0],
+    }
+
+
+def _check_in_out(ctx: dict) -> None:
+    stay_id = services.check_in(ctx["student_id"], ctx["free_room_id"], "2025-09-15")
+    services.check_out(stay_id, "2025-09-16", "benchmark")
+
+
+# The listings are cached (app.cache); the plain scenarios time the queries behind the cache.
+list_students = services.list_students.__wrapped__
+list_rooms = services.list_rooms.__wrapped__
+current_stays = services.current_stays.__wrapped__
+
+SCENARIOS = (
+    Scenario("list_students.first_page", lambda ctx: list_students(limit=PAGE)),
+    Scenario("list_students.middle_page", lambda ctx: list_students(limit=PAGE, after=ctx["student_after"])),
+    Scenario("list_students.search", lambda ctx: list_students(ctx["last_name"], limit=PAGE)),
+    Scenario("list_students.search_prefix", lambda ctx: list_students(ctx["last_name"][:3], limit=PAGE)),
+    Scenario("list_rooms.first_page", lambda ctx: list_rooms(limit=PAGE)),
+    Scenario("list_rooms.middle_page", lambda ctx: list_rooms(limit=PAGE, after=ctx["room_after"])),
+    Scenario("current_stays.first_page", lambda ctx: current_stays(limit=PAGE)),
+    Scenario("current_stays.middle_page", lambda ctx: current_stays(limit=PAGE, after=ctx["stay_after"])),
+    Scenario("list_rooms.cached", lambda ctx: services.list_rooms(limit=PAGE)),
+    Scenario("current_stays.cached", lambda ctx: services.current_stays(limit=PAGE)),
+    Scenario("debtors_report.first_page", lambda ctx: services.debtors_report(limit=PAGE)),
+    Scenario("debtors_report.all", lambda ctx: services.debtors_report()),
+    Scenario("verify_balances", lambda ctx: services.verify_balances()),
+    Scenario("allocation.preview", lambda ctx: allocation.preview()),
+    Scenario("occupancy.on_date", lambda ctx: occupancy.snapshot("2024-03-01")),
+    Scenario("occupancy.monthly_3y", lambda ctx: occupancy.monthly("2022-09", "2025-08")),
+    Scenario("finance.aging", lambda ctx: finance.aging("2025-09-30")),
+    Scenario("finance.statement", lambda ctx: finance.allocations(ctx["student_id"], "2025-09-30")),
+    Scenario("check_in_out", _check_in_out, writes=True),
+    Scenario("add_payment", lambda ctx: services.add_payment(ctx["student_id"], "2025-09-15", 1.0, "benchmark"), writes=True),
+)
+
+
+def percentile(samples: list[float], q: float) -> float:
+    ordered = sorted(samples)
+    index = (len(ordered) - 1) * q
+    low = int(index)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (index - low)
+
+
+def measure(fn: Callable[[], object], repeat: int, warmup: int = 2) -> dict:
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return {
+        "n": repeat,
+        "p50_ms": round(percentile(samples, 0.5), 4),
+        "p95_ms": round(percentile(samples, 0.95), 4),
+        "mean_ms": round(statistics.fmean(samples), 4),
+        "min_ms": round(min(samples), 4),
+    }
+
+
+def dataset(students: int, seed: int, data_dir: Path = DATA_DIR, rebuild: bool = False) -> Path:
+    path = data_dir / f"skfu-{students}-seed{seed}.db"
+    if rebuild or not path.exists():
+        generate(path, DatasetSize.for_students(students), seed)
+        audit.flush()
+        close_all()
+    return path
+
+
+def run(scales=DEFAULT_SCALES, repeat: int = DEFAULT_REPEAT, seed: int = 1, only: str | None = None,
+        progress: Callable[[str], None] | None = None) -> dict:
+    results = {}
+    for students in scales:
+        path = dataset(students, seed)
+        database.DB_PATH = path
+        database.init_db()
+        ctx = _context()
+        scale = results[str(students)] = {}
+        conn = get_connection()
+        for scenario in SCENARIOS:
+            if only and only not in scenario.name:
+                continue
+            if scenario.writes:
+                # Keep the cached dataset unchanged between runs.
+                conn.execute("SAVEPOINT bench")
+            try:
+                scale[scenario.name] = measure(lambda: scenario.run(ctx), repeat)
+            finally:
+                if scenario.writes:
+                    conn.execute("ROLLBACK TO bench")
+                    conn.execute("RELEASE bench")
+            if progress is not None:
+                stats = scale[scenario.name]
+                progress(f"{students:>8} {scenario.name:<28} p50 {stats['p50_ms']:9.3f} мс  p95 {stats['p95_ms']:9.3f} мс")
+        audit.flush()
+        close_all()
+    return {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "seed": seed,
+            "repeat": repeat,
+        },
+        "results": results,
+    }
+
+
+def compare(baseline: dict, current: dict, threshold: float = 0.2, min_delta_ms: float = 0.05) -> list[dict]:
+    """Scenario/scale pairs whose p50 or p95 got slower than ``threshold`` (relative) and ``min_delta_ms``."""
+    rows = []
+    for scale, scenarios in current["results"].items():
+        for name, stats in scenarios.items():
+            old = baseline["results"].get(scale, {}).get(name)
+            if old is None:
+                continue
+            for metric in ("p50_ms", "p95_ms"):
+                before, after = old[metric], stats[metric]
+                ratio = after / before if before else float("inf")
+                rows.append({
+                    "scale": scale,
+                    "scenario": name,
+                    "metric": metric,
+                    "before": before,
+                    "after": after,
+                    "ratio": ratio,
+                    "regression": ratio > 1 + threshold and after - before > min_delta_ms,
+                })
+    return rows
+
+
+def load(path: Path | str) -> dict:
+    return json.loads(Path(path).read_text(encoding="utf-8"))
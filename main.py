@@ -1,24 +1,74 @@
+from app import startup  # first, so the startup clock covers the other imports
+
+import argparse
+import os
 import tkinter as tk
 
-from app.auth import ensure_default_admin
-from app.database import init_db
+from app import audit
+from app.auth import authenticate, ensure_default_admin
+from app.database import close_all, init_db
+from app.jobs import JobRunner
 from app.ui import LoginWindow, MainApp
 
+if os.environ.get("SKFU_SQL_TRACE"):
+    from app import diagnostics  # noqa: F401  (enables tracing on import)
+
 
-def run_app() -> None:
+def prepare_database() -> None:
     init_db()
     ensure_default_admin()
 
+
+def run_app(measure: bool = False, login: str | None = None) -> None:
+    startup.enabled = measure
+    startup.mark("модули загружены")
+
     root = tk.Tk()
+    # Schema checks run on a worker; the login window is usable once they finish.
+    jobs = JobRunner(root, workers=1)
 
     def open_main(user):
+        jobs.shutdown(wait=False)
         for widget in root.winfo_children():
             widget.destroy()
-        MainApp(root, user)
+        MainApp(root, user, on_loaded=MainApp.close if measure else None)
+
+    def database_ready(_=None):
+        startup.mark("база данных готова")
+        login_window.set_ready()
+        if login is not None:
+            username, _, password = login.partition(":")
+            jobs.submit(authenticate, username, password, on_done=logged_in, on_error=login_failed)
+
+    def logged_in(user):
+        if user is None:
+            raise SystemExit("Неверный логин или пароль")
+        open_main(user)
+
+    def login_failed(error):
+        raise SystemExit(str(error))
+
+    login_window = LoginWindow(root, on_success=open_main, jobs=jobs)
+    startup.on_first_frame(root, "первый кадр окна входа")
+    jobs.submit(prepare_database, on_done=database_ready, on_error=login_window.set_failed)
+    try:
+        root.mainloop()
+    finally:
+        try:
+            jobs.shutdown()
+        finally:
+            audit.flush()
+            close_all()
+
 
-    LoginWindow(root, on_success=open_main)
-    root.mainloop()
+def main() -> None:
+    parser = argparse.ArgumentParser(description="СКФУ Общежитие")
+    parser.add_argument("--measure-startup", action="store_true",
+                        help="вывести время этапов запуска и закрыть окно после загрузки первой вкладки")
+    parser.add_argument("--login", metavar="USER:PASSWORD", help="войти автоматически (для --measure-startup)")
+    args = parser.parse_args()
+    run_app(measure=args.measure_startup, login=args.login)
 
 
 if __name__ == "__main__":
-    run_app()
+    main()
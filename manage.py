@@ -0,0 +1,450 @@
+import argparse
+import sys
+import time
+from datetime import date
+
+from app import audit, cache, database, diagnostics
+from app.database import close_all, get_connection, init_db
+
+
+def cmd_import(args) -> int:
+    from app.importer import import_file
+
+    def progress(result):
+        print(
+            f"\r{result.processed} строк, добавлено {result.inserted}, ошибок {len(result.errors)}, "
+            f"{result.rows_per_sec:.0f} строк/с",
+            end="",
+            file=sys.stderr,
+            flush=True,
+        )
+
+    result = import_file(args.table, args.path, batch_size=args.batch_size, progress=progress)
+    print(file=sys.stderr)
+    for error in result.errors[: args.max_errors]:
+        print(f"строка {error.line}: {error.message}")
+    if len(result.errors) > args.max_errors:
+        print(f"... и еще {len(result.errors) - args.max_errors} ошибок")
+    print(f"Импортировано {result.inserted} из {result.processed} за {result.elapsed:.2f} с")
+    return 1 if result.errors else 0
+
+
+def cmd_balances(args) -> int:
+    from app import services
+
+    if args.action == "rebuild":
+        drift = services.rebuild_balances()
+        print(f"Балансы пересчитаны, исправлено расхождений: {drift}")
+        return 0
+    drift = services.verify_balances()
+    for row in drift:
+        print(f"студент {row['student_id']}: сохранено {row['stored']:.2f}, по истории {row['actual']:.2f}")
+    print(f"Расхождений: {len(drift)}")
+    return 1 if drift else 0
+
+
+def cmd_allocate(args) -> int:
+    from app import allocation
+
+    plan = allocation.preview(faculty=args.faculty, building=args.building)
+    for a in plan.assignments[: args.show]:
+        print(f"{a.full_name}\t{a.study_group or ''}\t{a.building}/{a.floor}/{a.room_number}")
+    print(f"Распределено: {len(plan.assignments)}, без места: {len(plan.unassigned)}")
+    if args.commit and plan.assignments:
+        allocation.commit(plan, args.date)
+        print(f"Заселено с {args.date}")
+    return 0
+
+
+def cmd_billing(args) -> int:
+    from app import billing
+
+    if args.action == "tariff":
+        billing.set_tariff(args.valid_from, args.rate, args.benefit_discount)
+        print(f"Тариф с {args.valid_from}: {args.rate:.2f} в месяц, льгота {args.benefit_discount:.0%}")
+        return 0
+    result = billing.run_billing(args.period)
+    print(
+        f"Период {result.period}: создано {result.created}, уже было {result.already_billed}, "
+        f"сумма {result.total_amount:.2f}, {result.elapsed * 1000:.0f} мс"
+    )
+    if result.invalid_stays:
+        print(f"Пропущены проживания с некорректными датами: {', '.join(map(str, result.invalid_stays))}", file=sys.stderr)
+    return 0
+
+
+def cmd_export(args) -> int:
+    from app.export import export_report
+
+    def progress(count):
+        print(f"\r{count} строк", end="", file=sys.stderr, flush=True)
+
+    started = time.perf_counter()
+    count = export_report(args.report, args.path, fmt=args.format, student_id=args.student, progress=progress)
+    elapsed = time.perf_counter() - started
+    print(f"\rВыгружено {count} строк в {args.path} за {elapsed:.2f} с", file=sys.stderr)
+    return 0
+
+
+def cmd_forms(args) -> int:
+    from app import forms
+
+    def progress(done):
+        print(f"\r{done} документов", end="", file=sys.stderr, flush=True)
+
+    result = forms.generate(
+        args.kind, args.path, archive=args.zip or None, workers=args.workers, progress=progress,
+        student_id=args.student, since=args.since, until=args.until, current=args.current,
+    )
+    if not result.documents:
+        print("Нет документов для печати", file=sys.stderr)
+        return 1
+    print(
+        f"\rНапечатано {result.documents} документов в {args.path}: страниц {result.pages}, файлов {result.files}, "
+        f"{result.size / (1 << 20):.1f} МБ за {result.elapsed:.2f} с, {result.per_second:.0f} док/с "
+        f"(процессов: {result.workers})",
+        file=sys.stderr,
+    )
+    return 0
+
+
+def cmd_finance(args) -> int:
+    from app import finance
+
+    if args.action == "statement":
+        if args.student is None:
+            print("Укажите --student", file=sys.stderr)
+            return 2
+        for row in finance.statement(args.student, args.as_of):
+            print(f"{row['op_date']}\t{row['kind']}\t{row['amount_kop'] / 100:.2f}\t{row['balance_kop'] / 100:.2f}\t{row['note'] or ''}")
+        print("\nРаспределение оплат (FIFO):")
+        for row in finance.allocations(args.student, args.as_of):
+            label = finance.AGING_LABELS[finance.aging_bucket(row["age_days"])] if row["open_kop"] else "оплачено"
+            print(f"{row['period']}\tначислено {row['due_kop'] / 100:.2f}\tоплачено {row['paid_kop'] / 100:.2f}\t"
+                  f"долг {row['open_kop'] / 100:.2f}\t{label}")
+        return 0
+    started = time.perf_counter()
+    rows = finance.aging(args.as_of, args.min_debt)
+    elapsed = time.perf_counter() - started
+    for row in rows[: args.show]:
+        buckets = "\t".join(f"{row[f'bucket{i}_kop'] / 100:.2f}" for i in range(len(finance.AGING_BUCKETS)))
+        print(f"{row['student_id']}\t{row['full_name']}\t{row['debt_kop'] / 100:.2f}\t{buckets}")
+    totals = finance.aging_totals(rows)
+    for label, kop in zip(finance.AGING_LABELS, totals["buckets_kop"]):
+        print(f"{label}: {kop / 100:.2f}")
+    print(f"Должников: {totals['students']}, долг {totals['debt_kop'] / 100:.2f}, расчет {elapsed:.2f} с")
+    return 0
+
+
+def cmd_occupancy(args) -> int:
+    from app import occupancy
+
+    if args.months:
+        try:
+            months = occupancy.monthly(*args.months, building=args.building, floor=args.floor)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            return 2
+        for m in months:
+            print(f"{m.period}\tмест {m.beds}\tв среднем занято {m.average_occupied:.1f}\t{m.utilization:.1%}")
+        return 0
+    for row in occupancy.snapshot(args.on, by=args.by, building=args.building, floor=args.floor):
+        place = "/".join(str(row[k]) for k in row.keys() if k not in ("beds", "occupied", "id"))
+        share = row["occupied"] / row["beds"] if row["beds"] else 0
+        print(f"{place}\t{row['occupied']}/{row['beds']}\t{share:.0%}")
+    return 0
+
+
+def cmd_auth_benchmark(args) -> int:
+    from app import auth
+
+    for log_n, elapsed in auth.benchmark_kdf(args.target_ms):
+        mark = " <- текущая настройка" if log_n == auth.SCRYPT_LOG_N else ""
+        print(f"scrypt n=2^{log_n}: {elapsed:.1f} мс{mark}")
+    return 0
+
+
+def cmd_audit(args) -> int:
+    if args.action == "prune":
+        dropped = audit.prune(args.keep_months)
+        print(f"Удалено разделов журнала: {len(dropped)} {' '.join(dropped)}")
+        return 0
+    for row in audit.history(student_id=args.student, user_id=args.user, limit=args.limit):
+        print(
+            f"{row['created_at']}\t{row['username'] or '-'}\t{row['action']}\t{row['entity']}#{row['entity_id']}\t"
+            f"{row['before_json'] or ''}\t{row['after_json'] or ''}"
+        )
+    return 0
+
+
+def cmd_backup(args) -> int:
+    from app import backup
+
+    def progress(done, total):
+        print(f"\r{done}/{total} страниц", end="", file=sys.stderr, flush=True)
+
+    def report(result, verb):
+        print(file=sys.stderr)
+        print(
+            f"{verb} {result.path}: {result.db_bytes / (1 << 20):.1f} МБ базы, архив {result.file_bytes / (1 << 20):.1f} МБ, "
+            f"{result.elapsed:.2f} с, {result.throughput:.1f} МБ/с, сканов скопировано {result.documents}"
+        )
+
+    if args.action == "list":
+        for path in backup.snapshots(args.dir):
+            print(f"{path}\t{path.stat().st_size / (1 << 20):.1f} МБ")
+        return 0
+    if args.action == "create":
+        report(backup.create_snapshot(args.dir, keep=args.keep, progress=progress), "Снимок")
+        return 0
+    if not args.path:
+        print("Укажите файл снимка", file=sys.stderr)
+        return 2
+    try:
+        if args.action == "verify":
+            backup.verify(args.path)
+            print(f"{args.path}: OK")
+        else:
+            report(backup.restore(args.path, progress=progress), "Восстановлено из")
+    except backup.BackupError as e:
+        print(e, file=sys.stderr)
+        return 1
+    return 0
+
+
+def cmd_documents(args) -> int:
+    from app import documents
+
+    try:
+        if args.action == "add":
+            if args.student is None or not args.path:
+                print("Укажите --student и файл", file=sys.stderr)
+                return 2
+            for path in args.path:
+                document_id = documents.attach(args.student, path, args.kind)
+                row = documents.get_document(document_id)
+                print(f"{document_id}\t{row['sha256']}\t{row['size']}\t{path}")
+        elif args.action == "list":
+            if args.student is None:
+                print("Укажите --student", file=sys.stderr)
+                return 2
+            for row in documents.list_documents(args.student):
+                print(f"{row['id']}\t{row['kind']}\t{row['file_name']}\t{row['size']}\t{row['sha256']}")
+        elif args.action == "get":
+            if args.id is None or len(args.path) != 1:
+                print("Укажите --id и файл", file=sys.stderr)
+                return 2
+            print(documents.save_copy(args.id, args.path[0]))
+        elif args.action == "rm":
+            if args.id is None:
+                print("Укажите --id", file=sys.stderr)
+                return 2
+            documents.detach(args.id)
+        elif args.action == "gc":
+            result = documents.gc(grace=args.grace, dry_run=args.dry_run)
+            verb = "Будет удалено" if args.dry_run else "Удалено"
+            print(f"{verb} файлов: {result.removed} ({result.freed_bytes / (1 << 20):.1f} МБ), миниатюр: {result.thumbnails}, "
+                  f"осталось: {result.kept}")
+        else:
+            problems = documents.verify()
+            for sha256, reason in problems:
+                print(f"{sha256}\t{reason}")
+            print(f"Поврежденных или отсутствующих файлов: {len(problems)}")
+            return 1 if problems else 0
+    except documents.DocumentError as e:
+        print(e, file=sys.stderr)
+        return 1
+    return 0
+
+
+def cmd_sync(args) -> int:
+    from urllib.error import URLError
+
+    from app import sync
+
+    cache.set_max_age(cache.SHARED_MAX_AGE)
+
+    def report(results):
+        for r in results:
+            print(f"{r.origin} до #{r.upto}: применено {r.applied}, пропущено {r.skipped}, конфликтов {r.conflicts}")
+
+    started = time.perf_counter()
+    try:
+        if args.action == "status":
+            info = sync.status()
+            print(f"Узел {info['node']}, изменений в журнале: {info['changes']}, конфликтов: {info['conflicts']}")
+            for row in info["peers"]:
+                print(f"{row['peer']}\tполучено до #{row['received_seq']}\t{row['last_sync'] or '-'}")
+            return 0
+        if args.action == "init":
+            print(f"Новый идентификатор узла: {sync.init_clone()}")
+            return 0
+        if args.action == "compact":
+            print(f"Удалено записей журнала: {sync.compact()}")
+            return 0
+        if args.action == "conflicts":
+            for row in get_connection().execute("SELECT * FROM sync_conflicts ORDER BY id DESC LIMIT ?", (args.limit,)):
+                print(f"{row['created_at']}\t{row['peer']}\t{row['tbl']} {row['origin']}#{row['origin_id']}\t{row['reason']}")
+            return 0
+        if not args.target:
+            print("Укажите каталог обмена или адрес сервера", file=sys.stderr)
+            return 2
+        if args.action == "push":
+            print(f"Записано пакетов: {sync.push_dir(args.target)}")
+        elif args.action == "pull":
+            report(sync.pull_dir(args.target))
+        else:
+            username, _, password = (args.login or "").partition(":")
+            pulled, pushed = sync.sync_http(args.target, username, password)
+            report(pulled)
+            for r in pushed:
+                print(f"отправлено до #{r['upto']}: применено {r['applied']}, пропущено {r['skipped']}, "
+                      f"конфликтов {r['conflicts']}")
+    except (sync.SyncError, URLError, OSError) as e:
+        print(e, file=sys.stderr)
+        return 1
+    print(f"Синхронизация заняла {time.perf_counter() - started:.2f} с", file=sys.stderr)
+    return 0
+
+
+def cmd_serve(args) -> int:
+    from app import api, auth
+
+    auth.ensure_default_admin()
+    api.serve(args.host, args.port, readers=args.readers)
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="СКФУ Общежитие — служебные команды")
+    parser.add_argument("--db", help="путь к файлу базы данных (по умолчанию skfu_dormitory.db)")
+    parser.add_argument("--trace", action="store_true", help="вывести статистику SQL-запросов по завершении")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("import", help="массовый импорт из CSV/JSONL")
+    p.add_argument("table", choices=["students", "rooms", "charges"])
+    p.add_argument("path")
+    p.add_argument("--batch-size", type=int, default=1000)
+    p.add_argument("--max-errors", type=int, default=50, help="сколько ошибок вывести")
+    p.set_defaults(func=cmd_import)
+
+    p = sub.add_parser("balances", help="проверка/пересчет балансов студентов")
+    p.add_argument("action", choices=["verify", "rebuild"])
+    p.set_defaults(func=cmd_balances)
+
+    p = sub.add_parser("allocate", help="автоматическое распределение незаселенных студентов")
+    p.add_argument("--faculty")
+    p.add_argument("--building")
+    p.add_argument("--date", default=date.today().isoformat(), help="дата заселения (по умолчанию сегодня)")
+    p.add_argument("--show", type=int, default=20, help="сколько строк плана вывести")
+    p.add_argument("--commit", action="store_true", help="заселить по плану (иначе только предпросмотр)")
+    p.set_defaults(func=cmd_allocate)
+
+    p = sub.add_parser("billing", help="начисления за проживание")
+    billing_sub = p.add_subparsers(dest="action", required=True)
+    run = billing_sub.add_parser("run", help="начислить за месяц всем проживающим")
+    run.add_argument("period", help="ГГГГ-ММ")
+    tariff = billing_sub.add_parser("tariff", help="задать тариф")
+    tariff.add_argument("valid_from", help="дата начала действия, ГГГГ-ММ-ДД")
+    tariff.add_argument("rate", type=float, help="плата за месяц")
+    tariff.add_argument("--benefit-discount", type=float, default=0, help="доля скидки для льготников, 0..1")
+    p.set_defaults(func=cmd_billing)
+
+    p = sub.add_parser("export", help="выгрузка отчета в CSV/XLSX/PDF")
+    p.add_argument("report", choices=["debtors", "stays", "rooms", "statement", "aging"])
+    p.add_argument("path", help="файл назначения; формат по расширению")
+    p.add_argument("--format", choices=["csv", "xlsx", "pdf"])
+    p.add_argument("--student", type=int, help="ID студента (для statement)")
+    p.set_defaults(func=cmd_export)
+
+    p = sub.add_parser("forms", help="печатные формы: договоры найма и квитанции в PDF")
+    p.add_argument("kind", choices=["contract", "receipt"])
+    p.add_argument("path", help="PDF для печати или .zip с файлом на каждого студента")
+    p.add_argument("--student", type=int)
+    p.add_argument("--since", help="с даты заселения/оплаты, ГГГГ-ММ-ДД")
+    p.add_argument("--until", help="по дату заселения/оплаты включительно")
+    p.add_argument("--current", action="store_true", help="только проживающие сейчас")
+    p.add_argument("--zip", action="store_true", help="архив по студентам независимо от расширения")
+    p.add_argument("--workers", type=int, help="число процессов (по умолчанию по числу ядер)")
+    p.set_defaults(func=cmd_forms)
+
+    p = sub.add_parser("finance", help="выписки и задолженность по срокам")
+    p.add_argument("action", choices=["aging", "statement"])
+    p.add_argument("--student", type=int, help="ID студента (для statement)")
+    p.add_argument("--as-of", help="на дату ГГГГ-ММ-ДД (по умолчанию сегодня)")
+    p.add_argument("--min-debt", type=float, default=0, help="не показывать долги меньше этой суммы")
+    p.add_argument("--show", type=int, default=20, help="сколько студентов вывести")
+    p.set_defaults(func=cmd_finance)
+
+    p = sub.add_parser("occupancy", help="заполняемость на дату или по месяцам")
+    p.add_argument("--on", default=date.today().isoformat(), help="на дату ГГГГ-ММ-ДД (по умолчанию сегодня)")
+    p.add_argument("--by", choices=["building", "floor", "room"], default="building")
+    p.add_argument("--building")
+    p.add_argument("--floor", type=int)
+    p.add_argument("--months", nargs=2, metavar=("С", "ПО"), help="загрузка по месяцам ГГГГ-ММ ГГГГ-ММ")
+    p.set_defaults(func=cmd_occupancy)
+
+    p = sub.add_parser("kdf-benchmark", help="замер стоимости хэширования паролей")
+    p.add_argument("--target-ms", type=float, default=250, help="целевое время входа, мс")
+    p.set_defaults(func=cmd_auth_benchmark)
+
+    p = sub.add_parser("audit", help="журнал действий пользователей")
+    p.add_argument("action", choices=["history", "prune"])
+    p.add_argument("--student", type=int)
+    p.add_argument("--user", type=int)
+    p.add_argument("--limit", type=int, default=100)
+    p.add_argument("--keep-months", type=int, default=36, help="сколько месяцев хранить (для prune)")
+    p.set_defaults(func=cmd_audit)
+
+    p = sub.add_parser("backup", help="резервные копии базы данных")
+    p.add_argument("action", choices=["create", "list", "verify", "restore"])
+    p.add_argument("path", nargs="?", help="файл снимка (для verify/restore)")
+    p.add_argument("--dir", help="каталог снимков (по умолчанию backups рядом с базой)")
+    p.add_argument("--keep", type=int, default=14, help="сколько последних снимков хранить")
+    p.set_defaults(func=cmd_backup)
+
+    p = sub.add_parser("documents", help="сканы документов студентов")
+    p.add_argument("action", choices=["add", "list", "get", "rm", "gc", "verify"])
+    p.add_argument("path", nargs="*", help="файлы для add, файл назначения для get")
+    p.add_argument("--student", type=int)
+    p.add_argument("--id", type=int, help="номер документа (для get/rm)")
+    p.add_argument("--kind", choices=list(database.DOCUMENT_KINDS), default="other")
+    p.add_argument("--grace", type=float, default=3600, help="не удалять файлы моложе, с (для gc)")
+    p.add_argument("--dry-run", action="store_true", help="только показать, что удалит gc")
+    p.set_defaults(func=cmd_documents)
+
+    p = sub.add_parser("sync", help="обмен изменениями с базами других корпусов")
+    p.add_argument("action", choices=["status", "init", "push", "pull", "http", "conflicts", "compact"])
+    p.add_argument("target", nargs="?", help="каталог обмена (push/pull) или адрес API, например http://host:8080 (http)")
+    p.add_argument("--login", metavar="USER:PASSWORD", help="учетная запись администратора на сервере (для http)")
+    p.add_argument("--limit", type=int, default=50, help="сколько конфликтов показать")
+    p.set_defaults(func=cmd_sync)
+
+    p = sub.add_parser("serve", help="HTTP API для удаленных рабочих мест")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8080)
+    p.add_argument("--readers", type=int, default=4, help="число потоков чтения")
+    p.set_defaults(func=cmd_serve)
+
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.db:
+        database.DB_PATH = args.db
+    if args.trace:
+        diagnostics.enable()
+    init_db()
+    try:
+        return args.func(args)
+    finally:
+        audit.flush()
+        close_all()
+        if diagnostics.enabled():
+            print(diagnostics.report(), file=sys.stderr)
+            print(cache.report(), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
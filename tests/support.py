@@ -0,0 +1,35 @@
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+from app import audit, cache, database, services
+
+
+class DatabaseTestCase(unittest.TestCase):
+    """Each test runs against fresh, fully migrated databases in a temporary directory."""
+
+    def setUp(self):
+        self.tmp = Path(tempfile.mkdtemp(prefix="skfu-test-"))
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+        self.addCleanup(setattr, database, "DB_PATH", database.DB_PATH)
+        self.addCleanup(self._close)
+        self.use_database()
+
+    def _close(self):
+        audit.flush()
+        database.close_all()
+        cache.clear()
+
+    def use_database(self, name: str = "skfu.db") -> Path:
+        """Switch this thread to ``name`` in the test directory, creating it on first use."""
+        audit.flush()
+        database.DB_PATH = self.tmp / name
+        database.init_db()
+        return database.DB_PATH
+
+    def add_student(self, full_name: str = "Иванов Иван", **data) -> int:
+        return services.add_student({"full_name": full_name, **data})
+
+    def add_room(self, room_number: str = "101", total_beds: int = 2, status: str = "free") -> int:
+        return services.add_room("Корпус 1", 1, room_number, total_beds, status)
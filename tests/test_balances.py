@@ -0,0 +1,73 @@
+import unittest
+
+from app import services
+from app.database import get_connection, transaction
+
+from tests.support import DatabaseTestCase
+
+
+class BalanceLedgerTest(DatabaseTestCase):
+    def balances(self) -> dict:
+        rows = get_connection().execute("SELECT student_id, total_charges, total_payments, balance FROM student_balances")
+        return {row["student_id"]: tuple(round(v, 2) for v in tuple(row)[1:]) for row in rows}
+
+    def assert_matches_history(self):
+        self.assertEqual(services.verify_balances(), [])
+        # The triggers leave a zeroed row behind where a rebuild has none.
+        maintained = {k: v for k, v in self.balances().items() if any(v)}
+        self.assertEqual(services.rebuild_balances(), 0)
+        self.assertEqual(self.balances(), maintained)
+
+    def test_inserts_keep_ledger_in_step(self):
+        first, second = self.add_student("Антонов"), self.add_student("Борисова")
+        services.add_charge(first, "2025-09", 3500, 1750)
+        services.add_charge(first, "2025-10", 3500.10)
+        services.add_charge(second, "2025-09", 3500)
+        services.add_payment(first, "2025-09-15", 1000.05, "наличные")
+        services.add_payment(second, "2025-09-20", 4000, "карта")
+
+        self.assertEqual(self.balances()[first][2], 4250.05)
+        self.assertEqual(self.balances()[second][2], -500)
+        self.assert_matches_history()
+
+    def test_updates_and_deletes_move_amounts_between_students(self):
+        first, second = self.add_student("Антонов"), self.add_student("Борисова")
+        charge = services.add_charge(first, "2025-09", 3500, 500)
+        payment = services.add_payment(first, "2025-09-15", 1200, "карта")
+        with transaction() as conn:
+            conn.execute("UPDATE charges SET student_id = ?, amount = 3600 WHERE id = ?", (second, charge))
+            conn.execute("UPDATE payments SET amount = 700 WHERE id = ?", (payment,))
+        self.assertEqual(self.balances()[first][2], -700)
+        self.assertEqual(self.balances()[second][2], 3100)
+        self.assert_matches_history()
+
+        with transaction() as conn:
+            conn.execute("DELETE FROM charges WHERE id = ?", (charge,))
+            conn.execute("DELETE FROM payments WHERE id = ?", (payment,))
+        self.assertEqual(self.balances()[first][2], 0)
+        self.assertEqual(self.balances()[second][2], 0)
+        self.assert_matches_history()
+
+    def test_debtors_report_reads_ledger(self):
+        debtor, paid_up = self.add_student("Антонов"), self.add_student("Борисова")
+        services.add_charge(debtor, "2025-09", 3500)
+        services.add_charge(paid_up, "2025-09", 3500)
+        services.add_payment(paid_up, "2025-09-10", 3500, "карта")
+
+        self.assertEqual([row["id"] for row in services.debtors_report()], [debtor])
+        self.assertEqual(services.debtors_report(min_debt=3500), [])
+
+    def test_rebuild_repairs_drift(self):
+        student = self.add_student()
+        services.add_charge(student, "2025-09", 3500)
+        with transaction() as conn:
+            conn.execute("UPDATE student_balances SET balance = 0 WHERE student_id = ?", (student,))
+        self.assertEqual([row["student_id"] for row in services.verify_balances()], [student])
+
+        self.assertEqual(services.rebuild_balances(), 1)
+        self.assertEqual(self.balances()[student][2], 3500)
+        self.assert_matches_history()
+
+
+if __name__ == "__main__":
+    unittest.main()
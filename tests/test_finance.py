@@ -0,0 +1,71 @@
+import unittest
+from datetime import date, timedelta
+
+from app import finance, services
+
+from tests.support import DatabaseTestCase
+
+
+class AgingBucketTest(unittest.TestCase):
+    def test_bucket_edges(self):
+        for age, bucket in ((0, 0), (29, 0), (30, 1), (59, 1), (60, 2), (89, 2), (90, 3), (400, 3)):
+            with self.subTest(age=age):
+                self.assertEqual(finance.aging_bucket(age), bucket)
+
+
+class AgingTest(DatabaseTestCase):
+    def buckets(self, as_of: str) -> list[int]:
+        rows = finance.aging(as_of)
+        return [rows[0][f"bucket{i}_kop"] for i in range(len(finance.AGING_BUCKETS))] if rows else []
+
+    def test_single_charge_moves_through_buckets_day_by_day(self):
+        student = self.add_student()
+        services.add_charge(student, "2025-01", 1000)
+        day = date(2025, 1, 1)
+        while day <= date(2025, 5, 1):
+            as_of = day.isoformat()
+            age = finance.allocations(student, as_of)[0]["age_days"]
+            expected = [0] * len(finance.AGING_BUCKETS)
+            expected[finance.aging_bucket(age)] = 100_000
+            with self.subTest(as_of=as_of, age=age):
+                self.assertEqual(age, (day - date(2025, 1, 1)).days)
+                self.assertEqual(self.buckets(as_of), expected)
+            day += timedelta(days=1)
+
+    def test_payments_close_oldest_charges_first(self):
+        student = self.add_student()
+        for period in ("2025-01", "2025-02", "2025-03", "2025-04"):
+            services.add_charge(student, period, 1000)
+        services.add_payment(student, "2025-04-10", 1500.50, "карта")
+
+        # Ages on 2025-04-30: January 119 days, February 88, March 60, April 29.
+        self.assertEqual(self.buckets("2025-04-30"), [100_000, 0, 149_950, 0])
+        self.assertEqual(
+            [row["open_kop"] for row in finance.allocations(student, "2025-04-30")],
+            [0, 49_950, 100_000, 100_000],
+        )
+
+    def test_later_operations_are_ignored(self):
+        student = self.add_student()
+        services.add_charge(student, "2025-01", 1000)
+        services.add_charge(student, "2025-03", 1000)
+        services.add_payment(student, "2025-03-05", 1000, "карта")
+
+        self.assertEqual(self.buckets("2025-02-28"), [0, 100_000, 0, 0])
+        self.assertEqual(self.buckets("2025-03-10"), [100_000, 0, 0, 0])
+
+    def test_min_debt_and_totals(self):
+        small, large, paid_up = (self.add_student(name) for name in ("Антонов", "Борисова", "Власов"))
+        services.add_charge(small, "2025-01", 100)
+        services.add_charge(large, "2025-01", 5000)
+        services.add_charge(paid_up, "2025-01", 5000)
+        services.add_payment(paid_up, "2025-01-20", 5000, "карта")
+
+        rows = finance.aging("2025-01-31")
+        self.assertEqual([row["student_id"] for row in rows], [small, large])
+        self.assertEqual(finance.aging_totals(rows), {"students": 2, "debt_kop": 510_000, "buckets_kop": [0, 510_000, 0, 0]})
+        self.assertEqual([row["student_id"] for row in finance.aging("2025-01-31", min_debt=100.01)], [large])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+import unittest
+
+from app import services
+from app.database import get_connection
+from app.services import OccupancyError
+
+from tests.support import DatabaseTestCase
+
+
+class CheckInTest(DatabaseTestCase):
+    def occupied(self, room_id: int) -> int:
+        return get_connection().execute("SELECT occupied FROM rooms WHERE id = ?", (room_id,)).fetchone()[0]
+
+    def test_fills_room_up_to_capacity(self):
+        room = self.add_room(total_beds=2)
+        first, second, third = (self.add_student(name) for name in ("Антонов", "Борисова", "Власов"))
+        services.check_in(first, room, "2025-09-01")
+        services.check_in(second, room, "2025-09-01")
+        self.assertEqual(self.occupied(room), 2)
+
+        with self.assertRaisesRegex(OccupancyError, "нет свободных мест"):
+            services.check_in(third, room, "2025-09-01")
+        self.assertEqual(self.occupied(room), 2)
+
+    def test_check_out_frees_the_bed(self):
+        room = self.add_room(total_beds=1)
+        first, second = self.add_student("Антонов"), self.add_student("Борисова")
+        stay = services.check_in(first, room, "2025-09-01")
+        services.check_out(stay, "2025-12-31", "окончание семестра")
+        self.assertEqual(self.occupied(room), 0)
+        services.check_in(second, room, "2026-01-10")
+
+        with self.assertRaisesRegex(OccupancyError, "уже закрыто"):
+            services.check_out(stay, "2026-01-31", "")
+
+    def test_room_under_repair(self):
+        room = self.add_room(status="repair")
+        with self.assertRaisesRegex(OccupancyError, "на ремонте"):
+            services.check_in(self.add_student(), room, "2025-09-01")
+
+    def test_unknown_room_and_student(self):
+        room = self.add_room()
+        with self.assertRaisesRegex(OccupancyError, "Комната 999 не найдена"):
+            services.check_in(self.add_student(), 999, "2025-09-01")
+        with self.assertRaisesRegex(OccupancyError, "Студент 999 не найден"):
+            services.check_in(999, room, "2025-09-01")
+
+    def test_student_already_checked_in(self):
+        student = self.add_student()
+        services.check_in(student, self.add_room("101"), "2025-09-01")
+        with self.assertRaisesRegex(OccupancyError, "уже заселен"):
+            services.check_in(student, self.add_room("102"), "2025-09-02")
+
+    def test_batch_is_all_or_nothing(self):
+        room = self.add_room(total_beds=1)
+        first, second = self.add_student("Антонов"), self.add_student("Борисова")
+        with self.assertRaises(OccupancyError):
+            services.check_in_many([(first, room), (second, room)], "2025-09-01")
+        self.assertEqual(self.occupied(room), 0)
+        self.assertEqual(services.current_stays(), [])
+
+    def test_dates_are_validated(self):
+        room, student = self.add_room(), self.add_student()
+        for value in ("2025-02-30", "01.09.2025", "2025-9-1", ""):
+            with self.subTest(value=value), self.assertRaisesRegex(OccupancyError, "ГГГГ-ММ-ДД"):
+                services.check_in(student, room, value)
+        stay = services.check_in(student, room, " 2025-09-01 ")
+        with self.assertRaisesRegex(OccupancyError, "раньше даты заселения"):
+            services.check_out(stay, "2025-08-31", "")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+import gzip
+import json
+import time
+import unittest
+
+from app import services, sync
+from app.database import get_connection, transaction
+
+from tests.support import DatabaseTestCase
+
+
+class SyncTest(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.use_database("b.db")
+        self.b = sync.node_id()
+        self.use_database("a.db")
+        self.a = sync.node_id()
+
+    def count(self, table: str) -> int:
+        return get_connection().execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+    def test_applying_a_batch_twice_changes_nothing(self):
+        student = self.add_student()
+        services.check_in(student, self.add_room(), "2025-09-01")
+        _, data = sync.export_changes(0, peer=self.b)
+
+        self.use_database("b.db")
+        first = sync.apply_changes(data)
+        self.assertEqual((first.applied, first.conflicts), (3, 0))
+        again = sync.apply_changes(data)
+        self.assertEqual((again.applied, again.skipped, again.conflicts), (0, 0, 0))
+        self.assertEqual([self.count(t) for t in ("students", "rooms", "stays")], [1, 1, 1])
+        self.assertEqual(get_connection().execute("SELECT occupied FROM rooms").fetchone()[0], 1)
+
+    def test_overlapping_batch_skips_what_was_applied(self):
+        self.add_student("Антонов")
+        _, first = sync.export_changes(0, peer=self.b)
+        self.add_student("Борисова")
+        _, overlapping = sync.export_changes(0, peer=self.b)
+
+        self.use_database("b.db")
+        sync.apply_changes(first)
+        result = sync.apply_changes(overlapping)
+        self.assertEqual((result.applied, result.skipped), (1, 1))
+        self.assertEqual(self.count("students"), 2)
+
+    def test_gap_and_own_batches_are_refused(self):
+        self.add_student("Антонов")
+        header, _ = sync.export_changes(0, peer=self.b)
+        self.add_student("Борисова")
+        _, later = sync.export_changes(header["upto"], peer=self.b)
+        with self.assertRaisesRegex(sync.SyncError, "этим же узлом"):
+            sync.apply_changes(later)
+
+        self.use_database("b.db")
+        with self.assertRaisesRegex(sync.SyncError, "Пропущены изменения"):
+            sync.apply_changes(later)
+        self.assertEqual(self.count("students"), 0)
+
+    def test_missing_parent_is_recorded_as_conflict(self):
+        header = {"format": sync.FORMAT, "node": self.a, "since": 0, "upto": 7, "more": False, "count": 1}
+        stay = {
+            "table": "stays", "gid": [self.a, 1], "op": "upsert", "stamp": "2025-09-01T10:00:00.000Z", "origin": self.a,
+            "row": {"student_id": [self.a, 42], "room_id": [self.a, 1], "checkin_date": "2025-09-01",
+                    "checkout_date": None, "checkout_reason": None, "created_at": "2025-09-01 10:00:00"},
+        }
+        data = gzip.compress("\n".join(json.dumps(x) for x in (header, stay)).encode())
+
+        self.use_database("b.db")
+        result = sync.apply_changes(data)
+        self.assertEqual((result.applied, result.conflicts), (0, 1))
+        conflict = get_connection().execute("SELECT peer, tbl, origin, origin_id, reason FROM sync_conflicts").fetchone()
+        self.assertEqual(tuple(conflict)[:4], (self.a, "stays", self.a, 1))
+        self.assertIn("students", conflict["reason"])
+        self.assertEqual(self.count("stays"), 0)
+        self.assertEqual(sync.received_seq(self.a), 7)
+
+    def test_rooms_merge_by_key_and_last_writer_wins(self):
+        room_a = self.add_room("101", total_beds=2)
+        self.use_database("b.db")
+        room_b = self.add_room("101", total_beds=3)
+        time.sleep(0.01)  # stamps have millisecond resolution; the update must be the newest change
+        with transaction() as conn:
+            conn.execute("UPDATE rooms SET total_beds = 4 WHERE id = ?", (room_b,))
+        _, from_b = sync.export_changes(0, peer=self.a)
+
+        self.use_database("a.db")
+        _, from_a = sync.export_changes(0, peer=self.b)
+        sync.apply_changes(from_b)
+        self.use_database("b.db")
+        sync.apply_changes(from_a)
+
+        beds = []
+        for name, room in (("a.db", room_a), ("b.db", room_b)):
+            self.use_database(name)
+            self.assertEqual(self.count("rooms"), 1)
+            beds.append(get_connection().execute("SELECT total_beds FROM rooms WHERE id = ?", (room,)).fetchone()[0])
+        self.assertEqual(beds, [4, 4])
+
+
+if __name__ == "__main__":
+    unittest.main()